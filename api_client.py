@@ -0,0 +1,113 @@
+import json
+import logging
+import random
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from metrics import METRICS
+
+logger = logging.getLogger(__name__)
+
+# (connect, read) timeouts in seconds when an endpoint doesnt set its own
+DEFAULT_TIMEOUT = (3.05, 30)
+# http statuses worth retrying for idempotent calls
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+class ApiError(Exception):
+    pass
+
+
+class ApiClient:
+    # shared client for the SMS/Content and case-close APIs
+    # - one requests.Session with pooled keep-alive connections
+    # - per-endpoint connect/read timeouts so a slow upstream cant hang the script thread
+    # - bounded retries with jittered exponential backoff, only for calls marked idempotent
+    # - per-endpoint call/error/retry/latency counters
+    #
+    # endpoints: {'sms': {'url': ..., 'connect_timeout': 3.05, 'read_timeout': 30}, ...}
+
+    def __init__(self, api_key, endpoints, pool_size=10, max_retries=3, backoff=0.5, max_backoff=8):
+        self.endpoints = endpoints
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self.session.headers.update({
+            'Content-Type':'application/json',
+            'x-api-key': api_key
+        })
+        self._lock = threading.Lock()
+        self._stats = {name: {'calls': 0, 'errors': 0, 'retries': 0, 'latency_total_s': 0.0, 'latency_max_s': 0.0}
+                       for name in endpoints}
+
+    def _timeout(self, endpoint):
+        cfg = self.endpoints[endpoint]
+        return (cfg.get('connect_timeout', DEFAULT_TIMEOUT[0]), cfg.get('read_timeout', DEFAULT_TIMEOUT[1]))
+
+    def _record(self, endpoint, latency, error=False, retry=False):
+        with self._lock:
+            stats = self._stats[endpoint]
+            if retry:
+                stats['retries'] += 1
+                return
+            stats['calls'] += 1
+            stats['errors'] += int(error)
+            stats['latency_total_s'] += latency
+            stats['latency_max_s'] = max(stats['latency_max_s'], latency)
+
+    def _sleep_before_retry(self, attempt):
+        # full jitter: anywhere between 0 and the exponential cap
+        time.sleep(random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt)))
+
+    def post(self, endpoint, payload, idempotent=False, headers=None):
+        # POST payload as json and return the decoded json body
+        # the APIs report business errors (422, 404 ...) inside the body, so those are returned, not raised
+        with METRICS.span('api_request', endpoint=endpoint) as span:
+            url = self.endpoints[endpoint]['url']
+            attempts = 1 + (self.max_retries if idempotent else 0)
+            start = time.perf_counter()
+            for attempt in range(attempts):
+                last = attempt == attempts - 1
+                try:
+                    response = self.session.post(url, data=json.dumps(payload), headers=headers, timeout=self._timeout(endpoint))
+                except (requests.ConnectionError, requests.Timeout) as e:
+                    if last:
+                        self._record(endpoint, time.perf_counter() - start, error=True)
+                        raise ApiError(f"{endpoint} API call failed after {attempt + 1} attempt(s): {e}") from e
+                    logger.info(f"{endpoint} API call failed ({e}), retrying")
+                    self._record(endpoint, 0, retry=True)
+                    self._sleep_before_retry(attempt)
+                    continue
+
+                if response.status_code in RETRY_STATUSES and not last:
+                    logger.info(f"{endpoint} API returned {response.status_code}, retrying")
+                    self._record(endpoint, 0, retry=True)
+                    self._sleep_before_retry(attempt)
+                    continue
+
+                try:
+                    api_output = response.json()
+                except ValueError as e:
+                    self._record(endpoint, time.perf_counter() - start, error=True)
+                    raise ApiError(f"{endpoint} API returned a non-json response (status {response.status_code})") from e
+                self._record(endpoint, time.perf_counter() - start, error=response.status_code >= 400)
+                span.set(status=response.status_code, attempts=attempt + 1)
+                METRICS.inc('api_responses_total', endpoint=endpoint, status=response.status_code)
+                return api_output
+
+    def stats(self):
+        with self._lock:
+            out = {name: dict(stats) for name, stats in self._stats.items()}
+        for stats in out.values():
+            stats['latency_avg_s'] = stats['latency_total_s'] / stats['calls'] if stats['calls'] else 0.0
+        return out
+
+    def close(self):
+        self.session.close()
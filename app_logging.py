@@ -0,0 +1,156 @@
+import atexit
+import datetime
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import time
+
+# the listener writing the log records, one per process
+_listener = None
+
+
+def truncate(text, limit):
+    if limit is None or len(text) <= limit:
+        return text
+    return f'{text[:limit]}... [{len(text) - limit} more chars]'
+
+
+def payload_text(payload, limit):
+    if isinstance(payload, str):
+        return truncate(payload, limit)
+    return truncate(json.dumps(payload, default=str), limit)
+
+
+def payload_field(payload, limit):
+    # small payloads stay structured in the json record, big ones become a truncated string
+    if isinstance(payload, str):
+        return truncate(payload, limit)
+    text = json.dumps(payload, default=str)
+    return payload if limit is None or len(text) <= limit else truncate(text, limit)
+
+
+class PayloadSampler(logging.Filter):
+    # api request/response bodies are logged as extra={'payload': ...}
+    # keep the body on sample_rate of those records, the message itself is always logged
+    def __init__(self, sample_rate=1.0):
+        super().__init__()
+        self.sample_rate = sample_rate
+
+    def filter(self, record):
+        if getattr(record, 'payload', None) is not None and random.random() >= self.sample_rate:
+            record.payload = '[sampled out]'
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    # one json object per line: ts, level, logger, thread, message and the (truncated) payload if there is one
+
+    def __init__(self, max_message_chars=2000, max_payload_chars=1000):
+        super().__init__()
+        self.max_message_chars = max_message_chars
+        self.max_payload_chars = max_payload_chars
+
+    def format(self, record):
+        out = {
+            'ts': datetime.datetime.fromtimestamp(record.created).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'thread': record.threadName,
+            'message': truncate(record.getMessage(), self.max_message_chars),
+        }
+        if getattr(record, 'payload', None) is not None:
+            out['payload'] = payload_field(record.payload, self.max_payload_chars)
+        return json.dumps(out, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    # the old console format, with the (truncated) payload on the end
+
+    def __init__(self, max_payload_chars=1000):
+        super().__init__('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+        self.max_payload_chars = max_payload_chars
+
+    def format(self, record):
+        text = super().format(record)
+        if getattr(record, 'payload', None) is not None:
+            text += ': ' + payload_text(record.payload, self.max_payload_chars)
+        return text
+
+
+class RotatingLogFile(logging.handlers.TimedRotatingFileHandler):
+    # rotates at `when` (midnight by default) and also whenever the file reaches max_bytes
+    # backups are <path>.<date>, <path>.<date>.1 ... and only the newest backup_count are kept
+
+    def __init__(self, path, max_bytes=50_000_000, when='midnight', backup_count=14):
+        super().__init__(path, when=when, backupCount=backup_count, encoding='utf-8', delay=True)
+        self.max_bytes = max_bytes
+        self.namer = self._unique_name
+
+    def shouldRollover(self, record):
+        if super().shouldRollover(record):
+            return True
+        if self.max_bytes and self.stream is not None:
+            return self.stream.tell() >= self.max_bytes
+        return False
+
+    def _unique_name(self, default_name):
+        # a size rollover can happen more than once per period, dont overwrite the earlier backup
+        name, n = default_name, 0
+        while os.path.exists(name):
+            n += 1
+            name = f'{default_name}.{n}'
+        return name
+
+    def getFilesToDelete(self):
+        # the base class sorts backups by name, which puts <date>.10 before <date>.2 and <date> after its .N,
+        # so after several size rollovers in a day it deleted the newest ones. Keep the newest by write time
+        dir_name, base_name = os.path.split(self.baseFilename)
+        prefix = base_name + '.'
+        backups = []
+        for file_name in os.listdir(dir_name or '.'):
+            if not file_name.startswith(prefix):
+                continue
+            date_part, _, n = file_name[len(prefix):].partition('.')
+            if n and not n.isdigit():
+                continue
+            try:
+                time.strptime(date_part, self.suffix)
+            except ValueError:
+                continue
+            path = os.path.join(dir_name, file_name)
+            backups.append((os.path.getmtime(path), date_part, int(n or 0), path))
+        backups.sort()
+        return [path for *_, path in backups[:max(len(backups) - self.backupCount, 0)]]
+
+
+def setup_logging(path='sms_2_way.log', level=logging.INFO, max_bytes=50_000_000, when='midnight', backup_count=14,
+                  max_message_chars=2000, max_payload_chars=1000, payload_sample_rate=1.0, console=True):
+    # route all logging through a queue so the script thread never waits on the disk
+    # a background listener formats the records and writes json lines to a rotating file (and text to the console)
+    global _listener
+    if _listener is not None:
+        return _listener
+
+    file_handler = RotatingLogFile(path, max_bytes=max_bytes, when=when, backup_count=backup_count)
+    file_handler.setFormatter(JsonFormatter(max_message_chars, max_payload_chars))
+    handlers = [file_handler]
+    if console:
+        console_handler = logging.StreamHandler()
+        console_handler.setFormatter(TextFormatter(max_payload_chars))
+        handlers.append(console_handler)
+
+    log_queue = queue.SimpleQueue()
+    queue_handler = logging.handlers.QueueHandler(log_queue)
+    queue_handler.addFilter(PayloadSampler(payload_sample_rate))
+    root = logging.getLogger()
+    root.setLevel(level)
+    root.addHandler(queue_handler)
+
+    _listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+    _listener.start()
+    # flush what is still queued when the server stops
+    atexit.register(_listener.stop)
+    return _listener
@@ -0,0 +1,309 @@
+import datetime
+import logging
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+# do a quick mapping of language code to actual language
+LANG_MAP = {"en-US":"English", "ar-001":"Arabic", "es-419":"Spanish"}
+LANG_CODES = {name: code for code, name in LANG_MAP.items()}
+
+# low cardinality backlog columns that are stored as categoricals
+CATEGORY_COLUMNS = ['CASE_STATUS', 'CLIENT', 'PROGRAM', 'CONTENT_CODE', 'BLOCK_NAME', 'TOUCHPOINT_NAME', 'LANGUAGE',
+                    'LANGUAGE_WRITTEN', 'COUNTY', 'SEX', 'GENDER', 'STATUS', 'OUTCOME_CODE', 'OUTCOME_SUBCODE']
+# values update_apptable() and the outbox reconcile write to STATUS
+STATUS_VALUES = ['Closed No Response', 'Response Sent', 'Queued', 'Failed']
+
+# how many ids go into one `in (...)` list
+ID_CHUNK_SIZE = 1000
+
+# get the backlog of inbound sms newer than created_after
+# created_after is bound by the connector, so the same statement serves the full pull and the delta pulls
+# {filters} is where backlog_query() adds the predicates of a BacklogFilter
+BACKLOG_SQL = """
+    select
+    Null as Status,
+    tph.id as touchpoint_history_id,
+    c.id as case_id,
+    c.status as case_status,
+    sms.sms_data:metadata.member_id::string as account_casesafe_id,
+    sms.sms_data:metadata.client_code::string as client,
+    sms.sms_data:metadata.program_code::string as program,
+    sms.sms_data:payload:outbound:payload.body::string as message_sent,
+    sms.sms_data:metadata.content_code::string as content_code,
+    mb.name as block_name,
+    tph.touchpoint_name__c as touchpoint_name,
+    sms.sms_data:payload:language::string as language,
+    sms.sms_data:payload:language_written::string as language_written,
+    CONVERT_TIMEZONE('UTC', 'America/New_York', sms.sms_data:metadata.created_dt::datetime) AS created_date_EST,
+    sms.sms_data:metadata.created_dt::datetime as created_date,
+    sms.sms_data:metadata.acknowledged = true as acknowledge_status,
+    sms.sms_data:payload.Body::string as body,
+    Null as outcome_code,
+    null as outcome_subcode,
+    null as chg_response,
+    ac.firstname as account_first_name,
+    ac.lastname as account_last_name,
+    c.mobile__c as phone,
+    -- ac.phone ,
+    coalesce(billingstreet, '') ||' '|| coalesce(billing_address_2__c, '') ||' '|| coalesce(billingcity, '') ||' '|| coalesce(billingstate, '') ||' '|| coalesce(billingpostalcode, '') as billing_address,
+    county__c as county,
+    ac.personbirthdate as member_dob,
+    ac.member_id__c as member_id,
+    IFNULL(cs_sex__c, sex__pc) as sex,
+    IFNULL(cs_gender__c, gender__pc) as gender,
+    ac.primary_do_not_contact__c as do_not_contact,
+    ac.primary_do_not_text__c as do_not_text
+    FROM "CCP_MEMBER_INTEGRATION"."CCP_SMS_HISTORY" sms
+    inner join salesforce_raw.account ac
+        on sms.sms_data:metadata.member_id = ac.id
+    left join salesforce_raw.member_block_touchpoint_history__c tph
+        on sms.sms_data:payload.salesforce_history.body.id = tph.ssh_internal_object_link_id
+    left join salesforce_raw.member_block__c mb
+        on tph.member_block__c = mb.id
+    LEFT JOIN SALESFORCE_RAW.CASE c
+    on touchpoint_history_id = c.touchpoint_history_id__c --account_casesafe_id = c.accountid
+    where sms_data:metadata.execution = 'incoming'
+    and case_id is not null  -- uncomment for PROD
+    and case_status = 'New' -- Uncomment for PROD
+    and ac.test_account__c = False --  ## UCOMMENT FOR PROD
+    and sms_data:metadata.created_dt::datetime >= %(created_after)s{filters}
+   -- and sms.sms_data:metadata.acknowledged = False   # UNCOMMENT FOR PROD
+    order by sms_data:metadata.created_dt asc;
+"""
+
+# what a backlog result set is filtered on. None means no filter on that column
+# created_after is the start of the date window, language is the LANG_MAP name the filters show
+BacklogFilter = namedtuple('BacklogFilter', ['created_after', 'client', 'program', 'touchpoint_name', 'language'],
+                           defaults=[None, None, None, None])
+
+# BacklogFilter field -> (backlog column, the same value in the query), each bound as %(field)s
+FILTER_PREDICATES = {
+    'client': ('CLIENT', "sms.sms_data:metadata.client_code::string"),
+    'program': ('PROGRAM', "sms.sms_data:metadata.program_code::string"),
+    'touchpoint_name': ('TOUCHPOINT_NAME', "tph.touchpoint_name__c"),
+    'language': ('LANGUAGE', "sms.sms_data:payload:language::string"),
+}
+
+# the historical touchpoints for a chunk of members. member_ids is bound as a list by the connector
+HISTORY_SQL = """
+    select touchpoint_history_id, account_casesafe_id, touchpoint_name, mb.name, tph.message, tph.touchpoint_datetime, modality, touchpoint_type, outcome_code, outcome_subcode
+    from salesforce_mart.touchpoint_history_best_result_view tph
+    inner join salesforce_raw.member_block__c mb
+    on tph.member_block = mb.id
+    where account_casesafe_id in (%(member_ids)s)
+    and error = False
+    order by account_casesafe_id, touchpoint_datetime;
+"""
+HISTORY_COLUMNS = ['TOUCHPOINT_HISTORY_ID', 'ACCOUNT_CASESAFE_ID', 'TOUCHPOINT_NAME', 'NAME', 'MESSAGE', 'TOUCHPOINT_DATETIME',
+                   'MODALITY', 'TOUCHPOINT_TYPE', 'OUTCOME_CODE', 'OUTCOME_SUBCODE']
+
+# and get a list of all outcome subcodes that go with inbound sms
+SUBCODE_SQL = """
+    select outcome_code__c, outcome_subcode__c, count(*) as n
+    from salesforce_raw.member_block_touchpoint_history__c
+    where modality__c = 'SMS'
+    and outcome_code__c not like 'Outbound Call%'
+    and outcome_code__c != 'Inbound SMS - Wrong Language'
+    group by 1, 2
+    order by 3 desc;
+"""
+
+# cases that left status New since changed_since (utc, like the salesforce timestamps)
+# one small query per delta refresh however many cases are in the window
+CLOSED_CASES_SQL = """
+    select id as case_id
+    from salesforce_raw.case
+    where status != 'New'
+    and lastmodifieddate >= %(changed_since)s;
+"""
+
+
+def chunks(values, size=ID_CHUNK_SIZE):
+    # split a list of ids into lists of at most `size`
+    values = list(values)
+    return [values[i:i + size] for i in range(0, len(values), size)]
+
+
+def timestamp_param(value):
+    # dates and timestamps are bound as text, the way the created_dt comparison expects them
+    if isinstance(value, (datetime.date, datetime.datetime, pd.Timestamp)):
+        return pd.Timestamp(value).strftime("%Y-%m-%d %H:%M:%S.%f")
+    return value
+
+
+def filter_values(backlog_filter):
+    # {field: value to bind} for the column filters that are set
+    values = {}
+    for field in FILTER_PREDICATES:
+        value = getattr(backlog_filter, field, None)
+        if value is None:
+            continue
+        # the query has the language code, the filters show the LANG_MAP name
+        values[field] = LANG_CODES.get(value, value) if field == 'language' else value
+    return values
+
+
+def backlog_query(created_after, backlog_filter=None):
+    # BACKLOG_SQL with the column filters of backlog_filter as bound predicates -> (sql, params)
+    # created_after is passed on its own so the delta pulls can move it past the filter's window start
+    values = filter_values(backlog_filter)
+    predicates = ''.join(f"\n    and {FILTER_PREDICATES[field][1]} = %({field})s" for field in values)
+    return BACKLOG_SQL.replace('{filters}', predicates), {'created_after': timestamp_param(created_after), **values}
+
+
+def covers(wide, narrow):
+    # True if every row of the narrow filter is in the result set of the wide one
+    if wide.created_after is not None and (narrow.created_after is None or
+                                           pd.Timestamp(wide.created_after) > pd.Timestamp(narrow.created_after)):
+        return False
+    return all(getattr(wide, field) is None or getattr(wide, field) == getattr(narrow, field)
+               for field in FILTER_PREDICATES)
+
+
+def apply_filter(backlog_df, backlog_filter):
+    # the rows of a wider result set that backlog_filter would have fetched
+    keep = pd.Series(True, index=backlog_df.index)
+    if backlog_filter.created_after is not None:
+        keep &= backlog_df.CREATED_DATE >= pd.Timestamp(backlog_filter.created_after)
+    for field, (col, _) in FILTER_PREDICATES.items():
+        value = getattr(backlog_filter, field)
+        if value is not None:
+            keep &= backlog_df[col] == value
+    return backlog_df[keep].reset_index(drop=True)
+
+
+# the fetch_* functions take a data source (data_sources.py): SnowflakeSource in the app, SqliteSource offline
+def fetch_backlog(source, created_after, backlog_filter=None):
+    # pull the inbound sms backlog created at or after created_after (and matching backlog_filter)
+    backlog_df = source.backlog(created_after, backlog_filter)
+    backlog_df.LANGUAGE = backlog_df.LANGUAGE.replace(LANG_MAP)
+    return compact_backlog(backlog_df)
+
+
+def compact_backlog(backlog_df):
+    # low cardinality text columns -> categoricals, so each snapshot and session copy is much smaller
+    for col in CATEGORY_COLUMNS:
+        if col in backlog_df.columns and not isinstance(backlog_df[col].dtype, pd.CategoricalDtype):
+            backlog_df[col] = backlog_df[col].astype('category')
+    if 'STATUS' in backlog_df.columns:
+        backlog_df['STATUS'] = backlog_df.STATUS.cat.add_categories(
+            [v for v in STATUS_VALUES if v not in backlog_df.STATUS.cat.categories])
+    return backlog_df
+
+
+def set_backlog_value(backlog_df, label, col, value):
+    # backlog_df.loc[label, col] = value, adding the value to the categories first if the column is categorical
+    if isinstance(backlog_df[col].dtype, pd.CategoricalDtype) and value is not None and value not in backlog_df[col].cat.categories:
+        backlog_df[col] = backlog_df[col].cat.add_categories([value])
+    backlog_df.loc[label, col] = value
+
+
+def carry_over_edits(backlog_df, previous_df, columns):
+    # copy what a session did to its rows (STATUS, OUTCOME_CODE ...) onto the same rows of another result set
+    edited = previous_df[previous_df.STATUS.notna()]
+    if len(edited) == 0:
+        return backlog_df
+    label_of = dict(zip(backlog_df.TOUCHPOINT_HISTORY_ID.astype(str), backlog_df.index))
+    for _, row in edited.iterrows():
+        label = label_of.get(str(row.TOUCHPOINT_HISTORY_ID))
+        if label is None:
+            continue
+        for col in columns:
+            set_backlog_value(backlog_df, label, col, None if pd.isna(row[col]) else row[col])
+    return backlog_df
+
+
+def memory_report(backlog_df, top=5):
+    # how big the backlog frame is, for the logs
+    col_bytes = backlog_df.memory_usage(deep=True, index=False).sort_values(ascending=False)
+    return {
+        'rows': len(backlog_df),
+        'total_mb': round(col_bytes.sum() / 1e6, 2),
+        'largest_columns_mb': {c: round(b / 1e6, 2) for c, b in col_bytes.head(top).items()},
+    }
+
+
+def fetch_subcodes(source):
+    return source.subcodes()
+
+
+def run_timed(timings, name, fn, *args, **kwargs):
+    # call fn and record how long it took (seconds) in timings[name]
+    start = time.perf_counter()
+    try:
+        return fn(*args, **kwargs)
+    finally:
+        timings[name] = round(time.perf_counter() - start, 3)
+
+
+def fetch_closed_case_ids(source, changed_since):
+    # the set of case ids that moved out of status New at or after changed_since
+    return set(source.closed_cases(changed_since).CASE_ID)
+
+
+def fetch_history(source, member_ids, chunk_size=ID_CHUNK_SIZE, max_workers=4):
+    # pull all the historical touchpoints for these members
+    # the ids are split into chunks that run concurrently on the source's connections
+    member_chunks = chunks(pd.unique(pd.Series(member_ids, dtype=object).dropna()), chunk_size)
+    if len(member_chunks) == 0:
+        return pd.DataFrame(columns=HISTORY_COLUMNS)
+
+    def run(chunk):
+        return source.history(chunk)
+
+    if len(member_chunks) == 1:
+        frames = [run(member_chunks[0])]
+    else:
+        with ThreadPoolExecutor(max_workers=min(max_workers, len(member_chunks))) as ex:
+            frames = list(ex.map(run, member_chunks))
+    history_df = pd.concat(frames, ignore_index=True)
+    # chunks come back in chunk order, but keep the member/date ordering the single query had
+    return history_df.sort_values(['ACCOUNT_CASESAFE_ID', 'TOUCHPOINT_DATETIME'], kind='stable').reset_index(drop=True)
+
+
+def backlog_watermark(backlog_df):
+    # the newest created_dt we have seen
+    if backlog_df is None or len(backlog_df) == 0:
+        return None
+    return backlog_df.CREATED_DATE.max()
+
+
+def merge_backlog_delta(backlog_df, delta_df, closed_case_ids, window_start):
+    # add the new rows, drop the cases that were closed and the rows that fell out of the window
+    merged = pd.concat([backlog_df, delta_df], ignore_index=True)
+    # the delta is pulled with >= on the watermark, so the boundary rows come back twice
+    merged = merged.drop_duplicates('TOUCHPOINT_HISTORY_ID', keep='first')
+    keep = ~merged.CASE_ID.isin(closed_case_ids)
+    keep &= merged.CREATED_DATE >= pd.Timestamp(window_start)
+    # concat of categoricals with different categories falls back to object, so compact again
+    return compact_backlog(merged[keep].sort_values('CREATED_DATE', kind='stable').reset_index(drop=True))
+
+
+def append_backlog_rows(backlog_df, new_df):
+    # add rows that arrived after backlog_df was loaded (change feed). They are the newest, so they go on the end
+    # and the rows already there keep their labels, positions and any STATUS / OUTCOME edits
+    new_df = new_df[~new_df.TOUCHPOINT_HISTORY_ID.isin(backlog_df.TOUCHPOINT_HISTORY_ID)]
+    if len(new_df) == 0:
+        return backlog_df
+    return compact_backlog(pd.concat([backlog_df, new_df], ignore_index=True))
+
+
+def refresh_backlog(source, backlog_df, window_start, delta=True, backlog_filter=None, changed_since=None):
+    # full pull when we have nothing yet (or delta is off), otherwise only pull what is newer
+    # than the watermark and drop rows whose case has been closed since changed_since (the last refresh)
+    watermark = backlog_watermark(backlog_df) if delta and changed_since is not None else None
+    if watermark is None:
+        logger.info(f"Backlog full refresh from {window_start}")
+        return fetch_backlog(source, window_start, backlog_filter)
+
+    delta_df = fetch_backlog(source, max(pd.Timestamp(watermark), pd.Timestamp(window_start)), backlog_filter)
+    closed_case_ids = fetch_closed_case_ids(source, changed_since)
+    merged = merge_backlog_delta(backlog_df, delta_df, closed_case_ids, window_start)
+    logger.info(f"Backlog delta refresh from {watermark}: {len(delta_df)} rows fetched, "
+                f"{len(backlog_df) + len(delta_df) - len(merged)} dropped, {len(merged)} in backlog")
+    return merged
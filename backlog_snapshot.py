@@ -0,0 +1,163 @@
+import datetime
+import logging
+import threading
+import time
+from collections import OrderedDict, namedtuple
+
+logger = logging.getLogger(__name__)
+
+# data is whatever the loader returns; version goes up by one on every successful load
+# started_at is when that load began, the data is at least as new as the source was then
+Snapshot = namedtuple('Snapshot', ['data', 'version', 'loaded_at', 'started_at'])
+
+
+class SnapshotService:
+    # one shared copy of the backlog data for every session in the process
+    # - only one load runs at a time (single flight), everyone else waits on it or gets the previous snapshot
+    # - once the snapshot is older than ttl seconds, callers get the old one while a refresh runs in the background
+    # - get(force=True) is an explicit "refresh now": it waits for a fresh load but never evicts the old snapshot
+
+    def __init__(self, loader, ttl=120):
+        self.loader = loader
+        self.ttl = ttl
+        self._cond = threading.Condition()
+        self._snapshot = None
+        self._loaded_monotonic = None
+        self._refreshing = False
+        self._error = None
+
+    def _refresh(self):
+        started_at = datetime.datetime.now()
+        try:
+            data, error = self.loader(), None
+        except Exception as e:
+            data, error = None, e
+            logger.exception("Backlog snapshot refresh failed")
+        with self._cond:
+            if error is None:
+                version = self._snapshot.version + 1 if self._snapshot is not None else 1
+                self._snapshot = Snapshot(data, version, datetime.datetime.now(), started_at)
+                self._loaded_monotonic = time.monotonic()
+                logger.info(f"Backlog snapshot version {version} loaded")
+            self._error = error
+            self._refreshing = False
+            self._cond.notify_all()
+
+    def _start_refresh(self, background):
+        # caller holds the lock. returns True if this call started the refresh
+        if self._refreshing:
+            return False
+        self._refreshing = True
+        if background:
+            threading.Thread(target=self._refresh, name='backlog-snapshot-refresh', daemon=True).start()
+        return True
+
+    def age(self):
+        with self._cond:
+            if self._loaded_monotonic is None:
+                return None
+            return time.monotonic() - self._loaded_monotonic
+
+    def get(self, force=False):
+        with self._cond:
+            snapshot = self._snapshot
+            stale = snapshot is None or (time.monotonic() - self._loaded_monotonic) > self.ttl
+            if snapshot is not None and not force:
+                if stale:
+                    # stale-while-revalidate
+                    self._start_refresh(background=True)
+                return snapshot
+            run_here = self._start_refresh(background=False)
+
+        # nothing loaded yet, or an explicit refresh: wait for the one refresh in flight
+        if run_here:
+            self._refresh()
+        with self._cond:
+            while self._refreshing:
+                self._cond.wait()
+            if self._snapshot is None:
+                raise self._error
+            return self._snapshot
+
+    def version(self):
+        with self._cond:
+            return self._snapshot.version if self._snapshot is not None else 0
+
+    def fresh(self):
+        # the current snapshot if it is younger than ttl, else None. Never starts a load
+        with self._cond:
+            if self._snapshot is None or (time.monotonic() - self._loaded_monotonic) > self.ttl:
+                return None
+            return self._snapshot
+
+
+class SnapshotCache:
+    # one SnapshotService per key (e.g. a BacklogFilter), for result sets that differ between sessions
+    # - get(key) gives a fresh snapshot of key itself, else a slice of a fresh snapshot whose key covers it,
+    #   else loads key, with the same single flight / stale-while-revalidate as SnapshotService
+    # - loader(key, state): state is a dict kept with the key's entry, for the loader's own bookkeeping (delta refresh)
+    # - covers(wide, narrow) says if wide's result set has every row of narrow's, narrow(data, key) slices it
+    # - versions are (key, version) for a load and (key, wide key, wide version) for a slice, so they are
+    #   unique across keys. At most max_entries keys are kept, the least recently used goes first
+
+    def __init__(self, loader, covers, narrow, ttl=120, max_entries=4):
+        self.loader = loader
+        self.covers = covers
+        self.narrow = narrow
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._services = OrderedDict()
+        self._slices = {}    # key -> slice snapshot, replaced when the wide snapshot it came from changes
+
+    def _service(self, key):
+        with self._lock:
+            service = self._services.get(key)
+            if service is None:
+                state = {}
+                service = self._services[key] = SnapshotService(lambda: self.loader(key, state), ttl=self.ttl)
+                while len(self._services) > self.max_entries:
+                    evicted, _ = self._services.popitem(last=False)
+                    self._slices.pop(evicted, None)
+            self._services.move_to_end(key)
+            return service
+
+    def _covering_slice(self, key):
+        # a slice of the freshest snapshot of a key that covers this one, or None
+        with self._lock:
+            candidates = [(other, service) for other, service in self._services.items()
+                          if other != key and self.covers(other, key)]
+        fresh = [(other, snapshot) for other, snapshot in ((o, s.fresh()) for o, s in candidates) if snapshot is not None]
+        if len(fresh) == 0:
+            return None
+        wide_key, wide = max(fresh, key=lambda item: item[1].loaded_at)
+        version = (key, wide_key, wide.version)
+        with self._lock:
+            if wide_key in self._services:
+                self._services.move_to_end(wide_key)
+            cached = self._slices.get(key)
+        if cached is not None and cached.version == version:
+            return cached
+        sliced = Snapshot(self.narrow(wide.data, key), version, wide.loaded_at, wide.started_at)
+        logger.info(f"Snapshot for {key} sliced from {wide_key} version {wide.version}")
+        with self._lock:
+            self._slices[key] = sliced
+            while len(self._slices) > 2 * self.max_entries:
+                self._slices.pop(next(iter(self._slices)))
+        return sliced
+
+    def get(self, key, force=False):
+        if not force:
+            with self._lock:
+                service = self._services.get(key)
+                if service is not None:
+                    self._services.move_to_end(key)
+            snapshot = service.fresh() if service is not None else None
+            if snapshot is not None:
+                return snapshot._replace(version=(key, snapshot.version))
+            # only keys that are loaded take up an entry, a slice doesnt evict anything
+            sliced = self._covering_slice(key)
+            if sliced is not None:
+                return sliced
+        snapshot = self._service(key).get(force=force)
+        return snapshot._replace(version=(key, snapshot.version))
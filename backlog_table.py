@@ -0,0 +1,44 @@
+import numpy as np
+import pandas as pd
+
+# what the backlog table shows, in order
+TABLE_COLUMNS = ['MEMBER_ID', 'STATUS', 'CHG_RESPONSE', 'CLIENT', 'PROGRAM', 'TOUCHPOINT_NAME', 'BODY',
+                 'MESSAGE_SENT', 'CREATED_DATE', 'OUTCOME_CODE', 'OUTCOME_SUBCODE']
+# columns that change while agents work the queue (update_apptable, bulk close, outbox results)
+LIVE_COLUMNS = ['STATUS', 'CHG_RESPONSE', 'OUTCOME_CODE', 'OUTCOME_SUBCODE']
+# sort option that keeps the rows in the order they will be texted
+QUEUE_ORDER = 'Queue order'
+
+
+def sort_order(view_df, sort_by=QUEUE_ORDER, ascending=True, backlog_df=None):
+    # row positions of view_df in display order. Missing values go last either way
+    # live columns are sorted on their current values in backlog_df, which the view may be behind on
+    if sort_by == QUEUE_ORDER or len(view_df) == 0:
+        return np.arange(len(view_df))
+    if sort_by in LIVE_COLUMNS and backlog_df is not None:
+        values = backlog_df[sort_by].loc[view_df['index']]
+    else:
+        values = view_df[sort_by]
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        # category order is load order, sort on the values themselves
+        values = values.astype(object)
+    values = values.reset_index(drop=True)
+    return values.sort_values(ascending=ascending, kind='stable', na_position='last').index.to_numpy()
+
+
+def page_count(n_rows, page_size):
+    return max(1, -(-n_rows // page_size))
+
+
+def table_page(view_df, order, page, page_size, backlog_df=None):
+    # page (1-based) of the table: only these rows are sent to the browser
+    # the live columns are read from backlog_df for just these rows, so a status change shows up without
+    # rebuilding the view, and pages without changes come out identical (and are served from the browser cache)
+    positions = order[(page - 1) * page_size:page * page_size]
+    rows = view_df.iloc[positions]
+    page_df = rows[TABLE_COLUMNS].reset_index(drop=True)
+    if backlog_df is not None and len(rows) > 0:
+        live = backlog_df.loc[rows['index'], LIVE_COLUMNS].reset_index(drop=True)
+        for col in LIVE_COLUMNS:
+            page_df[col] = live[col].astype(object)
+    return page_df
@@ -0,0 +1,76 @@
+# cold start of the app: how long a fresh process takes to draw the login screen, and what it imports on the way
+# each sample is a new python process, so nothing is already in sys.modules
+#
+# usage (from the repo root):
+#   python -m benchmarks.cold_start                  # 5 samples, writes cold_start.json
+#   python -m benchmarks.cold_start --samples 10 --output before.json
+import argparse
+import datetime
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+from benchmarks.run_benchmarks import REPO, APP, git_commit, summarize
+
+# modules the login screen shouldnt need
+HEAVY_MODULES = ['pandas', 'numpy', 'pyarrow', 'requests', 'snowflake.connector', 'cryptography']
+
+# runs in the fresh process: import streamlit's test runner, then time the first script run with nobody logged in
+CHILD = """
+import json, sys, time
+start = time.perf_counter()
+from streamlit.testing.v1 import AppTest
+import_s = time.perf_counter() - start
+before = set(sys.modules)
+at = AppTest.from_file({app!r}, default_timeout=120)
+at.secrets['oauth'] = {{'client_id': 'bench', 'client_secret': 'bench', 'redirect_uri': 'bench'}}
+at.secrets['authorization'] = {{'allowed_users': ['bench@example.com']}}
+run_start = time.perf_counter()
+at.run()
+first_paint_s = time.perf_counter() - run_start
+print(json.dumps({{
+    'streamlit_import_ms': import_s * 1000,
+    'first_paint_ms': first_paint_s * 1000,
+    'total_ms': (time.perf_counter() - start) * 1000,
+    'modules_imported': len(set(sys.modules) - before),
+    'heavy_modules_loaded': [m for m in {heavy!r} if m in sys.modules],
+    'exception': [e.message for e in at.exception],
+}}))
+"""
+
+
+def sample():
+    child = CHILD.format(app=APP, heavy=HEAVY_MODULES)
+    out = subprocess.run([sys.executable, '-c', child], cwd=REPO, capture_output=True, text=True, check=True)
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Time the login screen of a cold app process')
+    parser.add_argument('--samples', type=int, default=5)
+    parser.add_argument('--output', default='cold_start.json')
+    args = parser.parse_args(argv)
+
+    samples = [sample() for _ in range(args.samples)]
+    report = {
+        'commit': git_commit(),
+        'timestamp': datetime.datetime.now().isoformat(timespec='seconds'),
+        'results': {name: summarize([s[name] for s in samples])
+                    for name in ('streamlit_import_ms', 'first_paint_ms', 'total_ms')},
+        'modules_imported': statistics.median(s['modules_imported'] for s in samples),
+        'heavy_modules_loaded': samples[-1]['heavy_modules_loaded'],
+        'exception': samples[-1]['exception'],
+    }
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+
+    for name, r in report['results'].items():
+        print(f"{name:<20} median {r['median_ms']:>8.1f} ms  min {r['min_ms']:>8.1f} ms  ({r['runs']} runs)")
+    print(f"modules imported by the first run: {report['modules_imported']}, heavy ones loaded: {report['heavy_modules_loaded']}")
+    print(f'results written to {args.output}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,320 @@
+# benchmarks for the load, filter and texting panel hot paths, on synthetic data
+# snowflake is a stub connection and the apis are a local http server, so nothing leaves the machine
+#
+# usage (from the repo root):
+#   python -m benchmarks.run_benchmarks                      # default sizes, writes bench_results.json
+#   python -m benchmarks.run_benchmarks --rows 100000 --members 20000 --output big.json
+#   python -m benchmarks.run_benchmarks --skip-apptest       # library level timings only
+#   python -m benchmarks.run_benchmarks --source sqlite      # the queries on a seeded local sqlite file instead of the stub
+#
+# the json has the commit, library versions, sizes and per benchmark min/median/mean/max in ms,
+# so runs from two commits can be diffed directly
+import argparse
+import datetime
+import json
+import logging
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import warnings
+
+import pandas as pd
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO)
+
+import snowflake.connector  # noqa: E402
+import streamlit  # noqa: E402
+
+from api_client import ApiClient  # noqa: E402
+from backlog_queries import (LANG_MAP, BacklogFilter, append_backlog_rows, apply_filter, compact_backlog,  # noqa: E402
+                             fetch_backlog, fetch_history, fetch_subcodes, merge_backlog_delta, refresh_backlog)
+from backlog_table import sort_order, table_page  # noqa: E402
+from benchmarks.synthetic import SIZES, StubApiServer, seed_sqlite, stub_connect, synthetic_data  # noqa: E402
+from data_sources import SnowflakeSource  # noqa: E402
+from filter_index import FilterIndex  # noqa: E402
+from member_history import MemberHistoryCache  # noqa: E402
+from queue_scheduler import QueueScheduler, priority_from_config  # noqa: E402
+from reference_data import ReferenceData  # noqa: E402
+from snowflake_pool import SnowflakePool  # noqa: E402
+from template_catalog import ParsedCatalog, TemplateCatalogCache  # noqa: E402
+from work_claims import WorkClaims  # noqa: E402
+
+APP = os.path.join(REPO, 'streamlit_app.py')
+
+
+def timed(fn, repeat):
+    # run fn `repeat` times, timings in ms
+    runs = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        runs.append((time.perf_counter() - start) * 1000)
+    return summarize(runs)
+
+
+def summarize(runs):
+    return {'runs': len(runs), 'min_ms': round(min(runs), 3), 'median_ms': round(statistics.median(runs), 3),
+            'mean_ms': round(statistics.mean(runs), 3), 'max_ms': round(max(runs), 3)}
+
+
+def bench_load(data, source, repeat):
+    results = {}
+    two_weeks = datetime.datetime.now() - datetime.timedelta(weeks=2)
+    raw = data['backlog']
+    results['load.fetch_backlog'] = timed(lambda: fetch_backlog(source, two_weeks), repeat)
+    # the default 'Last Day' view with the date window in the query
+    last_day = (datetime.datetime.now() - datetime.timedelta(days=1)).strftime('%Y-%m-%d')
+    results['load.fetch_backlog_last_day'] = timed(lambda: fetch_backlog(source, last_day, BacklogFilter(last_day)), repeat)
+
+    def post_process():
+        backlog_df = raw.copy()
+        backlog_df.LANGUAGE = backlog_df.LANGUAGE.replace(LANG_MAP)
+        compact_backlog(backlog_df)
+    results['load.post_process'] = timed(post_process, repeat)
+
+    backlog_df = fetch_backlog(source, two_weeks)
+    last_refresh = datetime.datetime.now() - datetime.timedelta(minutes=2)
+    results['load.refresh_delta'] = timed(
+        lambda: refresh_backlog(source, backlog_df, two_weeks, delta=True, changed_since=last_refresh), repeat)
+    delta_df = backlog_df.tail(max(1, len(backlog_df) // 100))
+    closed_ids = set(backlog_df.CASE_ID.iloc[::100])
+    results['load.merge_delta'] = timed(
+        lambda: merge_backlog_delta(backlog_df, delta_df, closed_ids, two_weeks), repeat)
+    # a change feed batch going into a session's backlog
+    feed_rows = delta_df.assign(TOUCHPOINT_HISTORY_ID=delta_df.TOUCHPOINT_HISTORY_ID.astype(str) + '-new')
+    results['load.feed_merge'] = timed(lambda: append_backlog_rows(backlog_df, feed_rows), repeat)
+    results['load.subcodes'] = timed(lambda: fetch_subcodes(source), repeat)
+    languages_csv = os.path.join(REPO, 'languages(in).csv')
+    results['load.languages_csv'] = timed(lambda: pd.read_csv(languages_csv), repeat)
+    # the same two tables from the reference data file, the way a new process starts
+    with tempfile.TemporaryDirectory() as tmp:
+        loaders = {'subcodes': lambda: fetch_subcodes(source), 'languages': lambda: pd.read_csv(languages_csv)}
+        ReferenceData(os.path.join(tmp, 'reference.sqlite3'), loaders).refresh()
+
+        def reference_open():
+            reference = ReferenceData(os.path.join(tmp, 'reference.sqlite3'), loaders)
+            reference.get('subcodes')
+            reference.get('languages')
+        results['load.reference_open'] = timed(reference_open, repeat)
+    # a narrow window served from a cached wider one
+    results['load.window_slice'] = timed(lambda: apply_filter(backlog_df, BacklogFilter(last_day)), repeat)
+    return results, backlog_df
+
+
+def bench_filter(backlog_df, repeat):
+    results = {}
+    last_week = (datetime.datetime.now() - datetime.timedelta(weeks=1)).strftime('%Y-%m-%d')
+    selected = {'CLIENT': 'ACME', 'PROGRAM': 'All', 'TOUCHPOINT_NAME': 'All', 'LANGUAGE': 'English'}
+    results['filter.index_build'] = timed(lambda: FilterIndex(backlog_df), repeat)
+    fidx = FilterIndex(backlog_df)
+
+    def options():
+        fidx.options('CLIENT')
+        fidx.options('PROGRAM', CLIENT='ACME')
+        fidx.options('TOUCHPOINT_NAME', CLIENT='ACME', PROGRAM='All')
+        fidx.options('LANGUAGE')
+    results['filter.options'] = timed(options, repeat)
+    results['filter.df_toshow_all'] = timed(lambda: fidx.view(backlog_df, None), repeat)
+    results['filter.df_toshow_selected'] = timed(lambda: fidx.view(backlog_df, last_week, **selected), repeat)
+
+    df_toshow = fidx.view(backlog_df, None)
+    # the old first_null_index scan, with the first half of the queue already worked
+    worked = df_toshow.copy()
+    worked.loc[:len(worked) // 2, 'STATUS'] = 'Response Sent'
+    results['queue.first_null_index'] = timed(
+        lambda: worked.STATUS.isna().idxmax() if worked.STATUS.isna().any() else None, repeat)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        claims = WorkClaims(os.path.join(tmp, 'claims.sqlite3'))
+        open_ids = worked.TOUCHPOINT_HISTORY_ID[worked.STATUS.isna()].astype(str)
+        # other agents holding the first few open messages
+        for agent in range(5):
+            claims.claim_next(f'agent{agent}', open_ids)
+        results['queue.claim_next'] = timed(lambda: claims.claim_next('bench', open_ids), repeat)
+
+    # the heap the texting panel uses instead: built once per view, then next + done per message
+    priority = priority_from_config({'priority': ['sla', 'do_not_text', 'client'], 'clients': ['EVER']})
+    results['queue.scheduler_build'] = timed(lambda: QueueScheduler(worked, priority), repeat)
+    scheduler = QueueScheduler(worked, priority)
+
+    def next_and_done():
+        scheduler.mark_done(scheduler.next_open())
+    results['queue.next_and_done'] = timed(next_and_done, repeat)
+
+    order = sort_order(df_toshow, 'CREATED_DATE', False, backlog_df)
+    results['table.sort'] = timed(lambda: sort_order(df_toshow, 'CLIENT', True, backlog_df), repeat)
+    results['table.page'] = timed(lambda: table_page(df_toshow, order, 2, 50, backlog_df), repeat)
+    return results
+
+
+def bench_history(backlog_df, source, repeat):
+    results = {}
+    members = list(pd.unique(backlog_df.ACCOUNT_CASESAFE_ID))
+    results['history.fetch_one_member'] = timed(lambda: fetch_history(source, members[:1]), repeat)
+    results['history.fetch_all_members'] = timed(lambda: fetch_history(source, members, max_workers=source.size), 1)
+    cache = MemberHistoryCache(lambda ids: fetch_history(source, ids))
+    cache.get(members[0])
+    results['history.cache_hit'] = timed(lambda: cache.get(members[0]), repeat)
+    misses = iter(members[1:])
+    results['history.cache_miss'] = timed(lambda: cache.get(next(misses)), min(repeat, len(members) - 1))
+    return results
+
+
+def bench_catalog(data, client, repeat):
+    results = {}
+    collection = data['catalog']['collection']
+    results['catalog.parse'] = timed(lambda: ParsedCatalog(collection), repeat)
+    parsed = ParsedCatalog(collection)
+    subject = parsed.subjects[-1]
+    name = parsed.names[subject][-1]
+    source = parsed.sources[(subject, name)][0]
+    results['catalog.lookup'] = timed(lambda: parsed.source_of(subject, parsed.message_id(subject, name, source)), repeat)
+    # the old way: the list response flattened into response_df and filtered on every rerun
+    def response_df():
+        rows = [(topic['name'], m['id'], m['touchpoint_code'], m['name'], m['message_source'])
+                for topic in collection for m in topic['messages']]
+        df = pd.DataFrame(rows, columns=['subjects', 'message_ids', 'touchpoint_code', 'message_name', 'message_source'])
+        msgs_df = df[df.subjects == subject]
+        response_id = msgs_df.message_ids[(msgs_df.message_name == name) & (msgs_df.message_source == source)].unique()[0]
+        msgs_df.message_source[msgs_df.message_ids == response_id].unique()[0]
+    results['catalog.response_df'] = timed(response_df, repeat)
+
+    results['api.sms_list'] = timed(lambda: client.post('sms', {'action': 'list', 'member_id': 'm'}), repeat)
+    cache = TemplateCatalogCache(lambda member_id: client.post('sms', {'action': 'list', 'member_id': member_id}))
+    cache.parsed('m0')
+    results['catalog.cache_hit'] = timed(lambda: cache.parsed('m0'), repeat)
+    return results
+
+
+def app_test(stub_api, state_dir, data_source=None):
+    from streamlit.testing.v1 import AppTest
+    at = AppTest.from_file(APP, default_timeout=120)
+    at.secrets['snowflake'] = {k: 'bench' for k in ['user', 'password', 'account', 'role', 'warehouse', 'database', 'schema']}
+    at.secrets['api'] = {'sms_api_url': stub_api.url('sms'), 'case_close_api_url': stub_api.url('case_close'), 'x_api_key': 'bench'}
+    at.secrets['oauth'] = {'client_id': 'bench', 'client_secret': 'bench', 'redirect_uri': 'bench'}
+    at.secrets['authorization'] = {'allowed_users': ['bench@example.com']}
+    at.secrets['outbox'] = {'path': os.path.join(state_dir, 'outbox.sqlite3')}
+    at.secrets['work_claims'] = {'path': os.path.join(state_dir, 'claims.sqlite3')}
+    at.secrets['reference_data'] = {'path': os.path.join(state_dir, 'reference.sqlite3')}
+    if data_source is not None:
+        at.secrets['data_source'] = data_source
+    at.session_state['auth'] = 'bench@example.com'
+    at.session_state['token'] = {}
+    return at
+
+
+def run_app(at):
+    at.run()
+    if at.exception:
+        raise RuntimeError(at.exception[0].message)
+
+
+def bench_app(stub_api, reruns, data_source=None):
+    # full script reruns, headless
+    results = {}
+    with tempfile.TemporaryDirectory() as state_dir:
+        at = app_test(stub_api, state_dir, data_source)
+        results['app.first_run'] = timed(lambda: run_app(at), 1)
+        results['app.rerun'] = timed(lambda: run_app(at), reruns)
+        at.selectbox[4].select('Last Two Weeks')
+        results['app.filter_change'] = timed(lambda: run_app(at), 1)
+        at.checkbox(key='start_checkbox').check()
+        results['app.start_texting'] = timed(lambda: run_app(at), 1)
+
+        runs = []
+        for i in range(reruns):
+            for step in ('Close Case & Respond', None):
+                at.selectbox(key='selectbox_next_step').select(step)
+                start = time.perf_counter()
+                run_app(at)
+                runs.append((time.perf_counter() - start) * 1000)
+        results['app.action_interaction'] = summarize(runs)
+        at.selectbox(key='table_sort_by').select('CREATED_DATE')
+        results['app.table_sort'] = timed(lambda: run_app(at), 1)
+    return results
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=REPO, capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the backlog load, filter and texting panel hot paths')
+    for name, default in SIZES.items():
+        parser.add_argument(f"--{name.replace('_', '-')}", type=int, default=default)
+    parser.add_argument('--repeat', type=int, default=5, help='runs per library benchmark')
+    parser.add_argument('--apptest-reruns', type=int, default=5, help='reruns per AppTest benchmark')
+    parser.add_argument('--skip-apptest', action='store_true')
+    parser.add_argument('--source', choices=['stub', 'sqlite'], default='stub',
+                        help='run the queries on the snowflake stub or on a local sqlite file seeded with the same data')
+    parser.add_argument('--output', default='bench_results.json')
+    args = parser.parse_args(argv)
+    sizes = {name: getattr(args, name) for name in SIZES}
+
+    # the app and the caches log every call at INFO, keep that out of the timings
+    logging.disable(logging.INFO)
+    warnings.simplefilter('ignore', pd.errors.SettingWithCopyWarning)
+    data = synthetic_data(sizes)
+    # every snowflake connection made from here on, including the app's, is the stub
+    snowflake.connector.connect = stub_connect(data)
+    stub_api = StubApiServer(data)
+    pool = SnowflakePool({}, size=4)
+    source_dir = tempfile.TemporaryDirectory()
+    if args.source == 'sqlite':
+        sqlite_path = os.path.join(source_dir.name, 'source.sqlite3')
+        source = seed_sqlite(sqlite_path, data)
+        app_source = {'backend': 'sqlite', 'path': sqlite_path}
+    else:
+        source, app_source = SnowflakeSource(pool), None
+    client = ApiClient('bench', {'sms': {'url': stub_api.url('sms')}, 'case_close': {'url': stub_api.url('case_close')}})
+
+    results = {}
+    try:
+        load_results, backlog_df = bench_load(data, source, args.repeat)
+        results.update(load_results)
+        results.update(bench_filter(backlog_df, args.repeat))
+        results.update(bench_history(backlog_df, source, args.repeat))
+        results.update(bench_catalog(data, client, args.repeat))
+        if not args.skip_apptest:
+            # the app reads its logo and language list relative to the working directory
+            cwd = os.getcwd()
+            os.chdir(REPO)
+            try:
+                results.update(bench_app(stub_api, args.apptest_reruns, app_source))
+            finally:
+                os.chdir(cwd)
+    finally:
+        stub_api.stop()
+        client.close()
+        pool.close()
+        source_dir.cleanup()
+
+    report = {
+        'commit': git_commit(),
+        'timestamp': datetime.datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'pandas': pd.__version__,
+        'streamlit': streamlit.__version__,
+        'sizes': sizes,
+        'source': args.source,
+        'results': results,
+    }
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+
+    width = max(len(name) for name in results)
+    for name, r in results.items():
+        print(f"{name:<{width}}  median {r['median_ms']:>10.3f} ms  min {r['min_ms']:>10.3f} ms  ({r['runs']} runs)")
+    print(f'results written to {args.output}')
+
+
+if __name__ == '__main__':
+    main()
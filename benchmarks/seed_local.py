@@ -0,0 +1,36 @@
+# seed a local sqlite data source with the synthetic backlog, so the app can run without snowflake
+#
+# usage (from the repo root):
+#   python -m benchmarks.seed_local                          # default sizes, writes sms_local.sqlite3
+#   python -m benchmarks.seed_local --rows 200000 --members 50000 --path big.sqlite3
+#
+# then point the app at it in .streamlit/secrets.toml:
+#   [data_source]
+#   backend = "sqlite"
+#   path = "sms_local.sqlite3"
+import argparse
+import logging
+import os
+import time
+
+from benchmarks.synthetic import SIZES, seed_sqlite, synthetic_data
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Seed a local sqlite data source with synthetic backlog data')
+    for name, default in SIZES.items():
+        parser.add_argument(f"--{name.replace('_', '-')}", type=int, default=default)
+    parser.add_argument('--path', default='sms_local.sqlite3')
+    args = parser.parse_args(argv)
+    sizes = {name: getattr(args, name) for name in SIZES}
+    if os.path.exists(args.path):
+        parser.error(f'{args.path} already exists, remove it first')
+
+    logging.basicConfig(level=logging.INFO)
+    start = time.perf_counter()
+    seed_sqlite(args.path, synthetic_data(sizes))
+    print(f'Seeded {args.path} in {time.perf_counter() - start:.1f}s')
+
+
+if __name__ == '__main__':
+    main()
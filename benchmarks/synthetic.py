@@ -0,0 +1,251 @@
+import datetime
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+import pandas as pd
+
+# default data sizes, override any of them from the command line
+SIZES = {
+    'rows': 20000,          # inbound sms in the two week backlog
+    'members': 5000,        # distinct members sending them
+    'history_depth': 20,    # touchpoints per member in the history view
+    'subjects': 8,          # templated response subjects per catalog
+    'messages': 12,         # messages per subject
+}
+
+# BacklogFilter field -> backlog column, for the predicates the backlog query can carry
+FILTER_COLUMNS = {'client': 'CLIENT', 'program': 'PROGRAM', 'touchpoint_name': 'TOUCHPOINT_NAME', 'language': 'LANGUAGE'}
+
+CLIENTS = ['ACME', 'BETA', 'CORE', 'DELTA', 'EVER']
+PROGRAMS = ['P1', 'P2', 'P3', 'P4']
+TOUCHPOINTS = ['Welcome', 'Reminder', 'Follow Up', 'Survey', 'Refill', 'Appointment']
+LANGUAGES = ['en-US', 'es-419', 'ar-001']
+BODIES = ['STOP', 'Thanks!', 'who is this?', 'yes', 'no', 'Please call me back, I have a question about my benefits',
+          'wrong number', 'ok']
+OUTCOMES = [('Inbound SMS', 'Stop'), ('Inbound SMS', 'Thanks'), ('Inbound SMS', 'Question'), ('Inbound SMS', 'Wrong Language'),
+            ('Inbound SMS - Wrong Number', None), ('Inbound SMS', 'Other')]
+
+
+def member_ids(members):
+    return [f'001M{i:08d}' for i in range(members)]
+
+
+def backlog_frame(rows, members, days=14, seed=0, now=None):
+    # the backlog as BACKLOG_SQL returns it (before LANG_MAP / compact_backlog), oldest first
+    rng = np.random.default_rng(seed)
+    now = now or datetime.datetime.now()
+    ids = np.array(member_ids(members))
+    member = ids[rng.integers(0, members, rows)]
+    created = pd.Timestamp(now) - pd.to_timedelta(np.sort(rng.uniform(0, days * 86400, rows))[::-1], unit='s')
+    return pd.DataFrame({
+        'STATUS': None,
+        'TOUCHPOINT_HISTORY_ID': [f'a0T{i:09d}' for i in range(rows)],
+        'CASE_ID': [f'500C{i:09d}' for i in range(rows)],
+        'CASE_STATUS': 'New',
+        'ACCOUNT_CASESAFE_ID': member,
+        'CLIENT': rng.choice(CLIENTS, rows),
+        'PROGRAM': rng.choice(PROGRAMS, rows),
+        'MESSAGE_SENT': 'Hi, this is your health plan. Reply STOP to opt out.',
+        'CONTENT_CODE': rng.choice(['C1', 'C2', 'C3'], rows),
+        'BLOCK_NAME': rng.choice(['Block A', 'Block B'], rows),
+        'TOUCHPOINT_NAME': rng.choice(TOUCHPOINTS, rows),
+        'LANGUAGE': rng.choice(LANGUAGES, rows, p=[0.8, 0.15, 0.05]),
+        'LANGUAGE_WRITTEN': 'en',
+        'CREATED_DATE_EST': created - pd.Timedelta(hours=4),
+        'CREATED_DATE': created,
+        'ACKNOWLEDGE_STATUS': False,
+        'BODY': rng.choice(BODIES, rows),
+        'OUTCOME_CODE': None,
+        'OUTCOME_SUBCODE': None,
+        'CHG_RESPONSE': None,
+        'ACCOUNT_FIRST_NAME': 'Pat',
+        'ACCOUNT_LAST_NAME': 'Doe',
+        'PHONE': '5555550100',
+        'BILLING_ADDRESS': '1 Main St  Springfield IL 62701',
+        'COUNTY': rng.choice(['Cook', 'Kane', 'Lake'], rows),
+        'MEMBER_DOB': pd.Timestamp('1950-01-02'),
+        'MEMBER_ID': [f'M{i:08d}' for i in rng.integers(0, members, rows)],
+        'SEX': rng.choice(['F', 'M'], rows),
+        'GENDER': rng.choice(['F', 'M'], rows),
+        'DO_NOT_CONTACT': False,
+        'DO_NOT_TEXT': False,
+    })
+
+
+def history_frame(ids, depth, seed=0):
+    # HISTORY_SQL rows for these members, depth touchpoints each
+    ids = list(ids)
+    rng = np.random.default_rng(seed)
+    n = len(ids) * depth
+    outcome = rng.integers(0, len(OUTCOMES), n)
+    return pd.DataFrame({
+        'TOUCHPOINT_HISTORY_ID': [f'a0H{i:09d}' for i in range(n)],
+        'ACCOUNT_CASESAFE_ID': np.repeat(ids, depth),
+        'TOUCHPOINT_NAME': rng.choice(TOUCHPOINTS, n),
+        'NAME': 'Block A',
+        'MESSAGE': 'Hi, this is your health plan. Reply STOP to opt out.',
+        'TOUCHPOINT_DATETIME': pd.Timestamp('2024-01-01') + pd.to_timedelta(np.tile(np.arange(depth), len(ids)), unit='D'),
+        'MODALITY': 'SMS',
+        'TOUCHPOINT_TYPE': rng.choice(['SMS', 'Call', 'Mail'], n),
+        'OUTCOME_CODE': [OUTCOMES[i][0] for i in outcome],
+        'OUTCOME_SUBCODE': [OUTCOMES[i][1] for i in outcome],
+    })
+
+
+def subcode_frame():
+    return pd.DataFrame({
+        'OUTCOME_CODE__C': [code for code, _ in OUTCOMES],
+        'OUTCOME_SUBCODE__C': [subcode for _, subcode in OUTCOMES],
+        'N': np.arange(len(OUTCOMES), 0, -1) * 100,
+    })
+
+
+def catalog(subjects, messages):
+    # the sms api `list` response
+    return {'collection': [
+        {'name': f'Subject {s}', 'messages': [
+            {'id': f'{s}-{m}', 'touchpoint_code': f'TP{s}', 'name': f'Message {m}',
+             'message_source': f'Subject {s} template {m}: thanks for your reply, we will be in touch.'}
+            for m in range(messages)]}
+        for s in range(subjects)]}
+
+
+class StubCursor:
+    # answers the app's queries from the synthetic data
+    def __init__(self, data):
+        self.data = data
+        self.sql = None
+        self.params = None
+        self.sfqid = None
+
+    def execute(self, sql, params=None):
+        self.sql, self.params = sql.lower(), params
+        return self
+
+    def fetchone(self):
+        return (1,)
+
+    def fetch_pandas_all(self):
+        sql = self.sql
+        if 'ccp_sms_history' in sql:
+            backlog = self.data['backlog']
+            keep = backlog.CREATED_DATE >= pd.Timestamp(self.params['created_after'])
+            # the column predicates backlog_query() pushed down
+            for field, col in FILTER_COLUMNS.items():
+                if field in self.params:
+                    keep &= backlog[col] == self.params[field]
+            return backlog[keep].reset_index(drop=True)
+        if 'touchpoint_history_best_result_view' in sql:
+            return history_frame(self.params['member_ids'], self.data['sizes']['history_depth'])
+        if 'outcome_subcode__c' in sql:
+            return subcode_frame()
+        if 'salesforce_raw.case' in sql:
+            # every 100th case in the backlog has been closed since the last refresh
+            return pd.DataFrame({'CASE_ID': self.data['backlog'].CASE_ID.iloc[::100].reset_index(drop=True)})
+        raise ValueError(f'No synthetic data for query: {sql[:80]}')
+
+    def close(self):
+        pass
+
+
+class StubConnection:
+    def __init__(self, data):
+        self.data = data
+        self.closed = False
+
+    def cursor(self):
+        return StubCursor(self.data)
+
+    def is_closed(self):
+        return self.closed
+
+    def close(self):
+        self.closed = True
+
+
+def stub_connect(data):
+    # drop-in for snowflake.connector.connect
+    return lambda **connection_parameters: StubConnection(data)
+
+
+def synthetic_data(sizes):
+    return {'sizes': sizes, 'backlog': backlog_frame(sizes['rows'], sizes['members']),
+            'catalog': catalog(sizes['subjects'], sizes['messages'])}
+
+
+def seed_sqlite(path, data):
+    # a SqliteSource holding the synthetic backlog, with history_depth touchpoints for every member
+    from data_sources import SqliteSource
+    source = SqliteSource(path)
+    source.seed(data['backlog'], history_frame(member_ids(data['sizes']['members']), data['sizes']['history_depth']))
+    return source
+
+
+class StubApiServer:
+    # local http server standing in for the sms/content api (/sms) and the case close api (/case_close)
+    # fail_next() queues error statuses or slow responses, requests records (path, action) of every call
+    def __init__(self, data):
+        catalog_body = json.dumps(data['catalog']).encode()
+        stub = self
+        self.requests = []
+        self._faults = []
+        self._lock = threading.Lock()
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                payload = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+                fault = stub._take_fault(self.path.lstrip('/'), payload.get('action'))
+                if fault is not None:
+                    status, delay = fault
+                    time.sleep(delay)
+                    if status is not None:
+                        body = b'<html>gateway error</html>'
+                        self.send_response(status)
+                        self.send_header('Content-Type', 'text/html')
+                        self.send_header('Content-Length', str(len(body)))
+                        self.end_headers()
+                        self.wfile.write(body)
+                        return
+                if self.path == '/sms' and payload.get('action') == 'list':
+                    body = catalog_body
+                elif self.path == '/sms':
+                    body = json.dumps({'status': 200, 'message': 'sent'}).encode()
+                else:
+                    body = json.dumps({'case': {'bulkupdate': {'Body': 'ok'}, 'remove_two_way_sms': 'ok'}}).encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.thread = threading.Thread(target=self.server.serve_forever, name='stub-api', daemon=True)
+        self.thread.start()
+
+    def fail_next(self, path, status=None, delay=0, times=1):
+        # the next `times` calls to path answer with status (a non-json error page) after delay seconds
+        # status None with a delay is a slow but normal response
+        with self._lock:
+            self._faults.extend([(path, status, delay)] * times)
+
+    def _take_fault(self, path, action):
+        with self._lock:
+            self.requests.append((path, action))
+            for i, (fault_path, status, delay) in enumerate(self._faults):
+                if fault_path == path:
+                    del self._faults[i]
+                    return status, delay
+        return None
+
+    def url(self, path):
+        return f'http://127.0.0.1:{self.server.server_port}/{path}'
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
@@ -0,0 +1,137 @@
+import datetime
+import logging
+import threading
+import time
+from collections import deque
+
+import pandas as pd
+
+from backlog_queries import LANG_MAP, backlog_watermark, compact_backlog
+from metrics import METRICS
+
+logger = logging.getLogger(__name__)
+
+
+class ChangeFeed:
+    # new inbound sms for every session, without waiting for the next snapshot refresh
+    # - a background thread calls source(since) every interval seconds; it returns the backlog rows
+    #   (BACKLOG_SQL shape) created at or after since, so the watermark is the newest created_dt seen
+    # - every poll that finds new rows is kept as a batch with the next version number
+    # - a session starts from version_at(snapshot.started_at), the batches its snapshot already saw,
+    #   remembers the version it has merged and asks for rows_since(version) on its next rerun
+    # - batches older than retention seconds are dropped, a session that far behind should refresh the backlog
+
+    def __init__(self, source, interval=15, retention=86400):
+        self.source = source
+        self.interval = interval
+        self.retention = retention
+        self._lock = threading.Lock()
+        self._batches = deque()       # (version, arrived monotonic, polled at, rows)
+        self._version = 0
+        self._watermark = None
+        self._boundary_ids = set()    # ids at the watermark, the next `>=` poll returns them again
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self, backlog_df=None):
+        # start polling after the newest row of backlog_df (or from now if there is nothing yet)
+        if self._thread is not None:
+            return
+        watermark = backlog_watermark(backlog_df)
+        with self._lock:
+            if watermark is None:
+                self._watermark = pd.Timestamp(datetime.datetime.now())
+            else:
+                self._watermark = pd.Timestamp(watermark)
+                self._boundary_ids = set(backlog_df.TOUCHPOINT_HISTORY_ID[backlog_df.CREATED_DATE == watermark])
+        self._thread = threading.Thread(target=self._run, name='change-feed', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self.poll()
+            except Exception:
+                logger.exception("Change feed poll failed")
+            self._stop.wait(self.interval)
+
+    def poll(self):
+        # one fetch past the watermark. returns how many new rows it found
+        with self._lock:
+            watermark, boundary_ids = self._watermark, self._boundary_ids
+        polled_at = datetime.datetime.now()
+        with METRICS.span('change_feed_poll') as span:
+            rows = self.source(watermark)
+            rows = rows[~rows.TOUCHPOINT_HISTORY_ID.isin(boundary_ids)].reset_index(drop=True)
+            span.set(rows=len(rows))
+        if len(rows) == 0:
+            return 0
+
+        newest = rows.CREATED_DATE.max()
+        with self._lock:
+            self._version += 1
+            self._batches.append((self._version, time.monotonic(), polled_at, rows))
+            at_newest = set(rows.TOUCHPOINT_HISTORY_ID[rows.CREATED_DATE == newest])
+            self._boundary_ids = at_newest | boundary_ids if newest == watermark else at_newest
+            self._watermark = max(watermark, newest)
+            cutoff = time.monotonic() - self.retention
+            while self._batches and self._batches[0][1] < cutoff:
+                self._batches.popleft()
+            version = self._version
+        METRICS.inc('change_feed_rows_total', len(rows))
+        logger.info(f"Change feed version {version}: {len(rows)} new inbound sms, watermark {newest}")
+        return len(rows)
+
+    def version(self):
+        with self._lock:
+            return self._version
+
+    def version_at(self, when):
+        # the newest version polled before when. a snapshot whose load started at when already has
+        # those rows, in their newer state (a case closed since the poll is not New in the snapshot)
+        with self._lock:
+            version = self._batches[0][0] - 1 if self._batches else self._version
+            for v, _, polled_at, _ in self._batches:
+                if polled_at < when:
+                    version = v
+            return version
+
+    def pending(self, version):
+        # how many rows arrived after version
+        with self._lock:
+            return sum(len(rows) for v, _, _, rows in self._batches if v > version)
+
+    def rows_since(self, version):
+        # (rows that arrived after version or None, current version)
+        with self._lock:
+            frames = [rows for v, _, _, rows in self._batches if v > version]
+            current = self._version
+        if len(frames) == 0:
+            return None, current
+        return pd.concat(frames, ignore_index=True), current
+
+
+class LocalTableSource:
+    # stands in for CCP_SMS_HISTORY in tests and benchmarks: a table of BACKLOG_SQL rows
+    # (before LANG_MAP) that new messages are appended to, answered the way fetch_backlog would
+
+    def __init__(self, rows=None):
+        self._lock = threading.Lock()
+        self.rows = pd.DataFrame() if rows is None else rows.copy()
+
+    def append(self, rows):
+        with self._lock:
+            self.rows = pd.concat([self.rows, rows], ignore_index=True)
+
+    def __call__(self, since):
+        with self._lock:
+            rows = self.rows
+        if len(rows) == 0:
+            return rows
+        rows = rows[rows.CREATED_DATE >= pd.Timestamp(since)].sort_values('CREATED_DATE', kind='stable')
+        rows = rows.reset_index(drop=True)
+        rows.LANGUAGE = rows.LANGUAGE.replace(LANG_MAP)
+        return compact_backlog(rows)
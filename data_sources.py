@@ -0,0 +1,292 @@
+import json
+import logging
+import sqlite3
+import threading
+
+import pandas as pd
+
+from backlog_queries import (BACKLOG_SQL, CLOSED_CASES_SQL, HISTORY_SQL, SUBCODE_SQL, backlog_query, filter_values,
+                             timestamp_param)
+from metrics import METRICS
+
+logger = logging.getLogger(__name__)
+
+# a data source answers the four backlog queries with the columns the snowflake statements return:
+#   backlog(created_after, backlog_filter)  BACKLOG_SQL rows (before LANG_MAP), oldest first
+#   history(member_ids)                     HISTORY_SQL rows for one chunk of members
+#   subcodes()                              SUBCODE_SQL rows
+#   closed_cases(changed_since)             CASE_ID of the cases that left status New at or after changed_since
+# plus size (how many queries can run at once), stats() and close()
+# backlog_queries.py does the chunking, concurrency and post-processing on top
+
+
+class SnowflakeSource:
+    # the production queries on the shared snowflake connection pool
+
+    def __init__(self, pool):
+        self.pool = pool
+        self.size = pool.size
+
+    def backlog(self, created_after, backlog_filter=None):
+        sql, params = backlog_query(created_after, backlog_filter)
+        return self.pool.fetch_pandas(sql, params, name='backlog')
+
+    def history(self, member_ids):
+        return self.pool.fetch_pandas(HISTORY_SQL, {'member_ids': list(member_ids)}, name='history')
+
+    def subcodes(self):
+        return self.pool.fetch_pandas(SUBCODE_SQL, name='subcodes')
+
+    def closed_cases(self, changed_since):
+        return self.pool.fetch_pandas(CLOSED_CASES_SQL, {'changed_since': timestamp_param(changed_since)},
+                                      name='closed_cases')
+
+    def stats(self):
+        return self.pool.stats()
+
+    def close(self):
+        self.pool.close()
+
+
+# the raw tables the snowflake queries read, with sms_data kept as the json document it is in CCP_SMS_HISTORY
+SQLITE_SCHEMA = """
+create table if not exists ccp_sms_history (sms_data text not null);
+create index if not exists ccp_sms_history_created on ccp_sms_history (json_extract(sms_data, '$.metadata.created_dt'));
+create table if not exists account (
+    id text primary key, firstname text, lastname text, billingstreet text, billing_address_2__c text,
+    billingcity text, billingstate text, billingpostalcode text, county__c text, personbirthdate text,
+    member_id__c text, cs_sex__c text, sex__pc text, cs_gender__c text, gender__pc text,
+    primary_do_not_contact__c integer, primary_do_not_text__c integer, test_account__c integer
+);
+create table if not exists member_block_touchpoint_history__c (
+    id text primary key, ssh_internal_object_link_id text, touchpoint_name__c text, member_block__c text,
+    modality__c text, outcome_code__c text, outcome_subcode__c text
+);
+create index if not exists tph_link on member_block_touchpoint_history__c (ssh_internal_object_link_id);
+create table if not exists member_block__c (id text primary key, name text);
+create table if not exists "case" (
+    id text primary key, status text, mobile__c text, touchpoint_history_id__c text, lastmodifieddate text
+);
+create index if not exists case_tph on "case" (touchpoint_history_id__c);
+create index if not exists case_modified on "case" (lastmodifieddate);
+create table if not exists touchpoint_history_best_result_view (
+    touchpoint_history_id text, account_casesafe_id text, touchpoint_name text, member_block text, message text,
+    touchpoint_datetime text, modality text, touchpoint_type text, outcome_code text, outcome_subcode text,
+    error integer default 0
+);
+create index if not exists history_member on touchpoint_history_best_result_view (account_casesafe_id, touchpoint_datetime);
+"""
+
+# BACKLOG_SQL in sqlite: sms_data:a.b -> json_extract(sms_data, '$.a.b'), CONVERT_TIMEZONE is done in pandas
+SQLITE_BACKLOG_SQL = """
+    select
+    null as STATUS,
+    tph.id as TOUCHPOINT_HISTORY_ID,
+    c.id as CASE_ID,
+    c.status as CASE_STATUS,
+    json_extract(sms.sms_data, '$.metadata.member_id') as ACCOUNT_CASESAFE_ID,
+    json_extract(sms.sms_data, '$.metadata.client_code') as CLIENT,
+    json_extract(sms.sms_data, '$.metadata.program_code') as PROGRAM,
+    json_extract(sms.sms_data, '$.payload.outbound.payload.body') as MESSAGE_SENT,
+    json_extract(sms.sms_data, '$.metadata.content_code') as CONTENT_CODE,
+    mb.name as BLOCK_NAME,
+    tph.touchpoint_name__c as TOUCHPOINT_NAME,
+    json_extract(sms.sms_data, '$.payload.language') as LANGUAGE,
+    json_extract(sms.sms_data, '$.payload.language_written') as LANGUAGE_WRITTEN,
+    null as CREATED_DATE_EST,
+    json_extract(sms.sms_data, '$.metadata.created_dt') as CREATED_DATE,
+    json_extract(sms.sms_data, '$.metadata.acknowledged') = 1 as ACKNOWLEDGE_STATUS,
+    json_extract(sms.sms_data, '$.payload.Body') as BODY,
+    null as OUTCOME_CODE,
+    null as OUTCOME_SUBCODE,
+    null as CHG_RESPONSE,
+    ac.firstname as ACCOUNT_FIRST_NAME,
+    ac.lastname as ACCOUNT_LAST_NAME,
+    c.mobile__c as PHONE,
+    coalesce(billingstreet, '') ||' '|| coalesce(billing_address_2__c, '') ||' '|| coalesce(billingcity, '') ||' '|| coalesce(billingstate, '') ||' '|| coalesce(billingpostalcode, '') as BILLING_ADDRESS,
+    county__c as COUNTY,
+    ac.personbirthdate as MEMBER_DOB,
+    ac.member_id__c as MEMBER_ID,
+    ifnull(cs_sex__c, sex__pc) as SEX,
+    ifnull(cs_gender__c, gender__pc) as GENDER,
+    ac.primary_do_not_contact__c as DO_NOT_CONTACT,
+    ac.primary_do_not_text__c as DO_NOT_TEXT
+    from ccp_sms_history sms
+    inner join account ac
+        on json_extract(sms.sms_data, '$.metadata.member_id') = ac.id
+    left join member_block_touchpoint_history__c tph
+        on json_extract(sms.sms_data, '$.payload.salesforce_history.body.id') = tph.ssh_internal_object_link_id
+    left join member_block__c mb
+        on tph.member_block__c = mb.id
+    left join "case" c
+        on tph.id = c.touchpoint_history_id__c
+    where json_extract(sms.sms_data, '$.metadata.execution') = 'incoming'
+    and c.id is not null
+    and c.status = 'New'
+    and ac.test_account__c = 0
+    and json_extract(sms.sms_data, '$.metadata.created_dt') >= :created_after{filters}
+    order by json_extract(sms.sms_data, '$.metadata.created_dt');
+"""
+SQLITE_FILTER_EXPRESSIONS = {
+    'client': "json_extract(sms.sms_data, '$.metadata.client_code')",
+    'program': "json_extract(sms.sms_data, '$.metadata.program_code')",
+    'touchpoint_name': "tph.touchpoint_name__c",
+    'language': "json_extract(sms.sms_data, '$.payload.language')",
+}
+
+SQLITE_HISTORY_SQL = """
+    select touchpoint_history_id as TOUCHPOINT_HISTORY_ID, account_casesafe_id as ACCOUNT_CASESAFE_ID,
+    touchpoint_name as TOUCHPOINT_NAME, mb.name as NAME, tph.message as MESSAGE, tph.touchpoint_datetime as TOUCHPOINT_DATETIME,
+    modality as MODALITY, touchpoint_type as TOUCHPOINT_TYPE, outcome_code as OUTCOME_CODE, outcome_subcode as OUTCOME_SUBCODE
+    from touchpoint_history_best_result_view tph
+    inner join member_block__c mb
+    on tph.member_block = mb.id
+    where account_casesafe_id in ({ids})
+    and error = 0
+    order by account_casesafe_id, touchpoint_datetime;
+"""
+
+SQLITE_SUBCODE_SQL = """
+    select outcome_code__c as OUTCOME_CODE__C, outcome_subcode__c as OUTCOME_SUBCODE__C, count(*) as N
+    from member_block_touchpoint_history__c
+    where modality__c = 'SMS'
+    and outcome_code__c not like 'Outbound Call%'
+    and outcome_code__c != 'Inbound SMS - Wrong Language'
+    group by 1, 2
+    order by 3 desc;
+"""
+
+SQLITE_CLOSED_CASES_SQL = """
+    select id as CASE_ID
+    from "case"
+    where status != 'New'
+    and lastmodifieddate >= :changed_since;
+"""
+
+# sqlite's default limit on bound parameters in one statement
+SQLITE_MAX_PARAMS = 999
+
+
+def _json_time(value):
+    return None if pd.isna(value) else pd.Timestamp(value).strftime('%Y-%m-%d %H:%M:%S.%f')
+
+
+def _none(value):
+    return None if pd.isna(value) else value
+
+
+class SqliteSource:
+    # the backlog queries on a local sqlite file laid out like the snowflake tables they read,
+    # for profiling the load path and post-processing offline. seed() fills it from fixture frames
+    # every query opens its own connection, so any number of threads can use it
+
+    def __init__(self, path, size=4):
+        self.path = path
+        self.size = size
+        self._lock = threading.Lock()
+        self._stats = {'queries': 0, 'rows': 0}
+        with self._connect() as db:
+            db.executescript(SQLITE_SCHEMA)
+
+    def _connect(self):
+        db = sqlite3.connect(self.path, timeout=30)
+        db.execute('pragma journal_mode=wal')
+        return db
+
+    def _query(self, sql, params, name):
+        with METRICS.span('sqlite_query', query=name) as span:
+            db = self._connect()
+            try:
+                result = pd.read_sql_query(sql, db, params=params)
+            finally:
+                db.close()
+            span.set(rows=len(result))
+        with self._lock:
+            self._stats['queries'] += 1
+            self._stats['rows'] += len(result)
+        return result
+
+    def _in_list(self, sql, ids, name):
+        ids = list(ids)
+        frames = [self._query(sql.replace('{ids}', ','.join('?' * len(chunk))), chunk, name)
+                  for chunk in [ids[i:i + SQLITE_MAX_PARAMS] for i in range(0, max(len(ids), 1), SQLITE_MAX_PARAMS)]]
+        return pd.concat(frames, ignore_index=True) if len(frames) > 1 else frames[0]
+
+    def backlog(self, created_after, backlog_filter=None):
+        values = filter_values(backlog_filter)
+        predicates = ''.join(f"\n    and {SQLITE_FILTER_EXPRESSIONS[field]} = :{field}" for field in values)
+        params = {'created_after': timestamp_param(created_after), **values}
+        backlog_df = self._query(SQLITE_BACKLOG_SQL.replace('{filters}', predicates), params, 'backlog')
+        # the types the snowflake connector hands back
+        backlog_df['CREATED_DATE'] = pd.to_datetime(backlog_df.CREATED_DATE)
+        backlog_df['CREATED_DATE_EST'] = backlog_df.CREATED_DATE.dt.tz_localize('UTC').dt.tz_convert('America/New_York') \
+            .dt.tz_localize(None)
+        backlog_df['MEMBER_DOB'] = pd.to_datetime(backlog_df.MEMBER_DOB)
+        for col in ['ACKNOWLEDGE_STATUS', 'DO_NOT_CONTACT', 'DO_NOT_TEXT']:
+            backlog_df[col] = backlog_df[col].astype('boolean').astype(object).where(backlog_df[col].notna(), None)
+        return backlog_df
+
+    def history(self, member_ids):
+        history_df = self._in_list(SQLITE_HISTORY_SQL, member_ids, 'history')
+        history_df['TOUCHPOINT_DATETIME'] = pd.to_datetime(history_df.TOUCHPOINT_DATETIME)
+        return history_df
+
+    def subcodes(self):
+        return self._query(SQLITE_SUBCODE_SQL, None, 'subcodes')
+
+    def closed_cases(self, changed_since):
+        return self._query(SQLITE_CLOSED_CASES_SQL, {'changed_since': timestamp_param(changed_since)}, 'closed_cases')
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats)
+
+    def close(self):
+        pass
+
+    def seed(self, backlog_df, history_df=None):
+        # load fixture data: backlog_df in the shape BACKLOG_SQL returns (language codes, not LANG_MAP names),
+        # history_df in the shape HISTORY_SQL returns. Rows are split back into the raw tables, with sms_data
+        # built as the json document the snowflake query reads its paths from
+        blocks = {name: f'MB{i:06d}' for i, name in enumerate(pd.unique(pd.concat(
+            [backlog_df.BLOCK_NAME, history_df.NAME if history_df is not None else pd.Series(dtype=object)]).dropna()))}
+        accounts = backlog_df.drop_duplicates('ACCOUNT_CASESAFE_ID')
+        link = 'SSH' + backlog_df.TOUCHPOINT_HISTORY_ID.astype(str)
+
+        sms_rows = [(json.dumps({
+            'metadata': {'member_id': row.ACCOUNT_CASESAFE_ID, 'client_code': _none(row.CLIENT),
+                         'program_code': _none(row.PROGRAM), 'content_code': _none(row.CONTENT_CODE),
+                         'created_dt': _json_time(row.CREATED_DATE), 'acknowledged': bool(row.ACKNOWLEDGE_STATUS),
+                         'execution': 'incoming'},
+            'payload': {'Body': _none(row.BODY), 'language': _none(row.LANGUAGE), 'language_written': _none(row.LANGUAGE_WRITTEN),
+                        'outbound': {'payload': {'body': _none(row.MESSAGE_SENT)}},
+                        'salesforce_history': {'body': {'id': ssh}}},
+        }),) for row, ssh in zip(backlog_df.itertuples(index=False), link)]
+
+        with self._connect() as db:
+            db.executemany('insert or replace into member_block__c values (?, ?)', [(i, name) for name, i in blocks.items()])
+            db.executemany('insert or replace into account values (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)', [
+                (row.ACCOUNT_CASESAFE_ID, _none(row.ACCOUNT_FIRST_NAME), _none(row.ACCOUNT_LAST_NAME), _none(row.BILLING_ADDRESS),
+                 None, None, None, None, _none(row.COUNTY), _json_time(row.MEMBER_DOB), _none(row.MEMBER_ID), None, _none(row.SEX),
+                 None, _none(row.GENDER), bool(row.DO_NOT_CONTACT), bool(row.DO_NOT_TEXT), False)
+                for row in accounts.itertuples(index=False)])
+            db.executemany('insert or replace into member_block_touchpoint_history__c values (?, ?, ?, ?, ?, ?, ?)', [
+                (row.TOUCHPOINT_HISTORY_ID, ssh, _none(row.TOUCHPOINT_NAME), blocks.get(row.BLOCK_NAME), 'SMS', None, None)
+                for row, ssh in zip(backlog_df.itertuples(index=False), link)])
+            db.executemany('insert or replace into "case" values (?, ?, ?, ?, ?)', [
+                (row.CASE_ID, _none(row.CASE_STATUS), _none(row.PHONE), row.TOUCHPOINT_HISTORY_ID, _json_time(row.CREATED_DATE))
+                for row in backlog_df.itertuples(index=False)])
+            db.executemany('insert into ccp_sms_history values (?)', sms_rows)
+            if history_df is not None:
+                # the history feeds both the history view and the outcome counts the subcode query groups
+                db.executemany('insert into touchpoint_history_best_result_view values (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, 0)', [
+                    (row.TOUCHPOINT_HISTORY_ID, row.ACCOUNT_CASESAFE_ID, _none(row.TOUCHPOINT_NAME), blocks.get(row.NAME),
+                     _none(row.MESSAGE), _json_time(row.TOUCHPOINT_DATETIME), _none(row.MODALITY), _none(row.TOUCHPOINT_TYPE),
+                     _none(row.OUTCOME_CODE), _none(row.OUTCOME_SUBCODE))
+                    for row in history_df.itertuples(index=False)])
+                db.executemany('insert or replace into member_block_touchpoint_history__c values (?, ?, ?, ?, ?, ?, ?)', [
+                    (row.TOUCHPOINT_HISTORY_ID, None, _none(row.TOUCHPOINT_NAME), blocks.get(row.NAME), _none(row.MODALITY),
+                     _none(row.OUTCOME_CODE), _none(row.OUTCOME_SUBCODE))
+                    for row in history_df.itertuples(index=False)])
+        logger.info(f"Seeded {self.path}: {len(backlog_df)} inbound sms, "
+                    f"{0 if history_df is None else len(history_df)} history rows")
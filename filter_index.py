@@ -0,0 +1,86 @@
+import numpy as np
+import pandas as pd
+
+# the cascading filters on the backlog, in the order they are shown
+FILTER_COLUMNS = ['CLIENT', 'PROGRAM', 'TOUCHPOINT_NAME', 'LANGUAGE']
+# selectbox value that means "no filter on this column"
+ALL = 'All'
+
+
+class FilterIndex:
+    # built once per backlog snapshot so the filter dropdowns and df_toshow come from lookups, not full scans
+    # - each filter column is turned into categorical codes
+    # - rows are grouped by their (client, program, touchpoint, language) combination
+    # - inside a group the row positions are sorted by CREATED_DATE so a date cut is a binary search
+
+    def __init__(self, backlog_df):
+        self.n_rows = len(backlog_df)
+        self.levels = {}      # column -> list of values, position = code
+        self.code_of = {}     # column -> {value: code}
+        codes = []
+        for col in FILTER_COLUMNS:
+            col_codes, uniques = pd.factorize(backlog_df[col], use_na_sentinel=False)
+            # take the level values from the rows themselves so missing values stay as they were (None vs NaN)
+            _, first_rows = np.unique(col_codes, return_index=True)
+            self.levels[col] = backlog_df[col].iloc[first_rows].tolist()
+            self.code_of[col] = {v: i for i, v in enumerate(self.levels[col])}
+            codes.append(col_codes.astype(np.int64))
+
+        # one list entry per combination, in order of first appearance in the backlog
+        self.groups = []      # (code tuple, positions sorted by date, dates sorted)
+        if self.n_rows == 0:
+            return
+
+        # combine the four codes into one key per row
+        combo = np.zeros(self.n_rows, dtype=np.int64)
+        for col, col_codes in zip(FILTER_COLUMNS, codes):
+            combo = combo * (len(self.levels[col]) + 1) + col_codes
+        uniq, first_pos, group_of_row = np.unique(combo, return_index=True, return_inverse=True)
+        group_of_row = group_of_row.ravel()
+
+        # rows without a date can never pass the date filter, leave them out of the index
+        dates = backlog_df.CREATED_DATE.to_numpy(dtype='datetime64[ns]')
+        positions = np.flatnonzero(~np.isnat(dates))
+        order = np.lexsort((positions, dates[positions], group_of_row[positions]))
+        positions = positions[order]
+        bounds = np.searchsorted(group_of_row[positions], np.arange(len(uniq) + 1))
+
+        for g in np.argsort(first_pos, kind='stable'):
+            row = first_pos[g]
+            key = tuple(int(col_codes[row]) for col_codes in codes)
+            group_positions = positions[bounds[g]:bounds[g + 1]]
+            self.groups.append((key, group_positions, dates[group_positions]))
+
+    def _matching_groups(self, selected):
+        # selected: {column: value}, ALL / None means no filter on that column
+        wanted = []
+        for col, value in selected.items():
+            if value is None or value == ALL:
+                continue
+            code = self.code_of[col].get(value)
+            if code is None:
+                return []
+            wanted.append((FILTER_COLUMNS.index(col), code))
+        return [g for g in self.groups if all(g[0][i] == code for i, code in wanted)]
+
+    def options(self, column, **selected):
+        # distinct values of column among rows that match the other selections, in order of first appearance
+        # (same as backlog_df[column][mask].unique())
+        col_i = FILTER_COLUMNS.index(column)
+        seen = dict.fromkeys(key[col_i] for key, _, _ in self._matching_groups(selected))
+        return [self.levels[column][code] for code in seen]
+
+    def positions(self, created_after=None, **selected):
+        # row positions matching the selections with CREATED_DATE > created_after, in backlog order
+        cutoff = None if created_after is None else pd.Timestamp(created_after).to_datetime64()
+        parts = []
+        for _, group_positions, group_dates in self._matching_groups(selected):
+            start = 0 if cutoff is None else np.searchsorted(group_dates, cutoff, side='right')
+            parts.append(group_positions[start:])
+        if len(parts) == 0:
+            return np.array([], dtype=np.int64)
+        return np.sort(np.concatenate(parts))
+
+    def view(self, backlog_df, created_after=None, **selected):
+        # the filtered backlog, with the original row label kept in the 'index' column
+        return backlog_df.iloc[self.positions(created_after, **selected)].reset_index()
@@ -0,0 +1,117 @@
+import logging
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+
+class MemberHistoryCache:
+    # touchpoint history per ACCOUNT_CASESAFE_ID, loaded only when a member is opened (or about to be)
+    # loader(member_ids) -> history dataframe for those members
+    # holds at most max_members entries (least recently used goes first), each good for ttl seconds
+
+    def __init__(self, loader, max_members=500, ttl=600, prefetch_workers=2):
+        self.loader = loader
+        self.max_members = max_members
+        self.ttl = ttl
+        self._entries = OrderedDict()   # member_id -> (loaded_at, history_df)
+        self._inflight = {}             # member_id -> future of a running load
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=prefetch_workers, thread_name_prefix='history-prefetch')
+        self._stats = {'hits': 0, 'misses': 0, 'expired': 0, 'evicted': 0, 'loads': 0}
+
+    def _fresh(self, member_id):
+        # returns the cached frame or None. caller holds the lock
+        entry = self._entries.get(member_id)
+        if entry is None:
+            return None
+        loaded_at, history_df = entry
+        if time.monotonic() - loaded_at > self.ttl:
+            del self._entries[member_id]
+            self._stats['expired'] += 1
+            return None
+        self._entries.move_to_end(member_id)
+        return history_df
+
+    def _store(self, member_ids, history_df):
+        now = time.monotonic()
+        groups = dict(tuple(history_df.groupby('ACCOUNT_CASESAFE_ID', sort=False))) if len(history_df) else {}
+        with self._lock:
+            for member_id in member_ids:
+                member_df = groups.get(member_id, history_df.iloc[0:0]).reset_index(drop=True)
+                self._entries[member_id] = (now, member_df)
+                self._entries.move_to_end(member_id)
+                self._inflight.pop(member_id, None)
+            while len(self._entries) > self.max_members:
+                self._entries.popitem(last=False)
+                self._stats['evicted'] += 1
+
+    def _load(self, member_ids):
+        try:
+            history_df = self.loader(member_ids)
+        except Exception:
+            with self._lock:
+                for member_id in member_ids:
+                    self._inflight.pop(member_id, None)
+            raise
+        self._store(member_ids, history_df)
+        with self._lock:
+            self._stats['loads'] += 1
+        return history_df
+
+    def get(self, member_id):
+        # history for one member, loading it (or waiting on a prefetch already running) on a miss
+        with self._lock:
+            history_df = self._fresh(member_id)
+            if history_df is not None:
+                self._stats['hits'] += 1
+                return history_df
+            self._stats['misses'] += 1
+            future = self._inflight.get(member_id)
+        if future is not None:
+            try:
+                future.result()
+            except Exception:
+                pass  # the prefetch failed, try again below
+            with self._lock:
+                history_df = self._fresh(member_id)
+            if history_df is not None:
+                return history_df
+        history_df = self._load([member_id])
+        return history_df[history_df.ACCOUNT_CASESAFE_ID == member_id].reset_index(drop=True)
+
+    def prefetch(self, member_ids):
+        # load the members that are not cached yet in the background, in one query
+        with self._lock:
+            todo = [m for m in pd.unique(pd.Series(member_ids, dtype=object).dropna())
+                    if self._fresh(m) is None and m not in self._inflight]
+            if len(todo) == 0:
+                return None
+            future = self._executor.submit(self._load, todo)
+            for member_id in todo:
+                self._inflight[member_id] = future
+        future.add_done_callback(_log_prefetch_error)
+        return future
+
+    def invalidate(self, member_id=None):
+        with self._lock:
+            if member_id is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(member_id, None)
+
+    def stats(self):
+        with self._lock:
+            out = dict(self._stats)
+            out['cached_members'] = len(self._entries)
+            out['inflight'] = len(self._inflight)
+        return out
+
+
+def _log_prefetch_error(future):
+    if future.exception() is not None:
+        logger.info(f"Member history prefetch failed: {future.exception()}")
@@ -0,0 +1,178 @@
+import bisect
+import logging
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+# latency buckets in seconds, from a cache hit to a slow snowflake pull
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+# every metric name gets this prefix in the export
+PREFIX = 'sms_app_'
+
+
+class Histogram:
+    # cumulative-bucket histogram, the same shape prometheus uses
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)   # last one is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q):
+        # estimate like prometheus' histogram_quantile: linear inside the bucket the rank falls in
+        if self.count == 0:
+            return None
+        rank = q * self.count
+        seen = 0
+        for i, n in enumerate(self.counts):
+            if seen + n >= rank and n > 0:
+                if i == len(self.buckets):
+                    return self.buckets[-1]
+                lower = self.buckets[i - 1] if i > 0 else 0.0
+                return lower + (self.buckets[i] - lower) * (rank - seen) / n
+            seen += n
+        return self.buckets[-1]
+
+
+class Span:
+    # what a span() block found out along the way (query id, rows ...)
+
+    def __init__(self, name, labels):
+        self.name = name
+        self.labels = labels
+        self.attributes = {}
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+
+def _key(name, labels):
+    return name, tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _labels_text(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ''
+    escaped = [(k, v.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')) for k, v in pairs]
+    return '{' + ','.join(f'{k}="{v}"' for k, v in escaped) + '}'
+
+
+class Metrics:
+    # process-wide counters, latency histograms and recent spans
+    # - span(name, **labels) times a block into the `<name>_seconds` histogram and counts errors
+    # - inc(name, value, **labels) for counters (rows, bytes ...)
+    # - prometheus_text() renders everything in the prometheus text format, start_export() writes it to a file
+
+    def __init__(self, recent_spans=200):
+        self._lock = threading.Lock()
+        self._histograms = {}
+        self._counters = {}
+        self.recent = deque(maxlen=recent_spans)
+        self._export_thread = None
+
+    def observe(self, name, seconds, **labels):
+        key = _key(name, labels)
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram()
+            histogram.observe(seconds)
+
+    def inc(self, name, value=1, **labels):
+        key = _key(name, labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    @contextmanager
+    def span(self, name, **labels):
+        span = Span(name, labels)
+        start = time.perf_counter()
+        error = None
+        try:
+            yield span
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            elapsed = time.perf_counter() - start
+            self.observe(f'{name}_seconds', elapsed, **labels)
+            if error is not None:
+                self.inc(f'{name}_errors_total', **labels)
+            record = {'name': name, 'labels': labels, 'attributes': span.attributes,
+                      'duration_ms': round(elapsed * 1000, 1), 'error': None if error is None else str(error)}
+            with self._lock:
+                self.recent.append(record)
+            details = ' '.join(f'{k}={v}' for k, v in {**labels, **span.attributes}.items())
+            logger.info(f"span {name} {record['duration_ms']} ms {details}" + (f" error={error}" if error else ''))
+
+    def summary(self):
+        # {metric{labels}: {'count', 'p50_s', 'p99_s'}}, for a quick look at the current shift
+        with self._lock:
+            items = list(self._histograms.items())
+        return {f'{name}{_labels_text(labels)}': {'count': h.count, 'p50_s': h.quantile(0.5), 'p99_s': h.quantile(0.99)}
+                for (name, labels), h in items}
+
+    def prometheus_text(self):
+        with self._lock:
+            histograms = sorted(self._histograms.items())
+            counters = sorted(self._counters.items())
+            histograms = [(key, list(h.buckets), list(h.counts), h.sum, h.count) for key, h in histograms]
+
+        lines = []
+        typed = set()
+        for (name, labels), buckets, counts, total, count in histograms:
+            metric = PREFIX + name
+            if metric not in typed:
+                lines.append(f'# TYPE {metric} histogram')
+                typed.add(metric)
+            cumulative = 0
+            for bound, n in zip(list(buckets) + ['+Inf'], counts):
+                cumulative += n
+                lines.append(f'{metric}_bucket{_labels_text(labels, [("le", str(bound))])} {cumulative}')
+            lines.append(f'{metric}_sum{_labels_text(labels)} {total}')
+            lines.append(f'{metric}_count{_labels_text(labels)} {count}')
+        for (name, labels), value in counters:
+            metric = PREFIX + name
+            if metric not in typed:
+                lines.append(f'# TYPE {metric} counter')
+                typed.add(metric)
+            lines.append(f'{metric}{_labels_text(labels)} {value}')
+        return '\n'.join(lines) + '\n'
+
+    def write(self, path):
+        # write atomically so a scraper (node_exporter textfile collector ...) never reads half a file
+        tmp = f'{path}.tmp'
+        with open(tmp, 'w') as f:
+            f.write(self.prometheus_text())
+        os.replace(tmp, path)
+
+    def start_export(self, path, interval=15):
+        # write the metrics to path every interval seconds from a background thread
+        if self._export_thread is not None:
+            return
+
+        def export():
+            while True:
+                try:
+                    self.write(path)
+                except OSError as e:
+                    logger.info(f"Metrics export to {path} failed: {e}")
+                time.sleep(interval)
+
+        self._export_thread = threading.Thread(target=export, name='metrics-export', daemon=True)
+        self._export_thread.start()
+
+
+# the registry everything in this process records to
+METRICS = Metrics()
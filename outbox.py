@@ -0,0 +1,201 @@
+import json
+import logging
+import random
+import sqlite3
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+create table if not exists outbox_jobs (
+    id integer primary key autoincrement,
+    idempotency_key text not null unique,
+    touchpoint_history_id text,
+    steps text not null,             -- json list of [handler name, payload]
+    steps_done integer not null default 0,
+    final_status text,               -- the backlog STATUS to show once the job is done
+    state text not null default 'pending',   -- pending / running / done / failed
+    attempts integer not null default 0,
+    last_error text,
+    next_attempt_at real not null default 0,
+    created_at real not null,
+    updated_at real not null
+);
+create index if not exists outbox_jobs_state on outbox_jobs (state, next_attempt_at);
+create index if not exists outbox_jobs_tph on outbox_jobs (touchpoint_history_id);
+"""
+
+
+class Outbox:
+    # durable queue of api calls (sms send, case close) run by background worker threads
+    # - a job is a list of steps that run in order; steps_done is saved after each one, so a retry
+    #   picks up where it failed instead of re-sending a text that already went out
+    # - failed jobs are retried with jittered backoff up to max_attempts, then marked failed
+    # - once_steps (the sms send) are never retried automatically: a timeout may mean the text went out,
+    #   so the job is marked failed for an agent to check and retry()
+    # - handlers: {name: fn(payload, idempotency_key)} - raise to fail the step
+    # - one job per idempotency_key, enqueueing the same key again returns the existing job
+    # - on_finish(touchpoint_history_id, state) is called once a job is done or has failed for good
+
+    def __init__(self, path, handlers, workers=2, max_attempts=5, backoff=2, poll_interval=0.5, on_finish=None,
+                 once_steps=(), stale_after=600):
+        self.path = path
+        self.handlers = handlers
+        self.on_finish = on_finish
+        self.once_steps = set(once_steps)
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.poll_interval = poll_interval
+        self._wakeup = threading.Event()
+        self._stop = threading.Event()
+        self._claim_lock = threading.Lock()
+
+        with self._connect() as db:
+            db.executescript(SCHEMA)
+        self._recover(stale_after)
+
+        self._workers = [threading.Thread(target=self._work, name=f'outbox-worker-{i}', daemon=True)
+                         for i in range(workers)]
+        for worker in self._workers:
+            worker.start()
+
+    def _connect(self):
+        db = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        db.execute('pragma journal_mode=wal')
+        db.row_factory = sqlite3.Row
+        return db
+
+    def _recover(self, stale_after):
+        # jobs left running by a process that died: not touched for stale_after seconds (a live process
+        # sharing the file updates them after every step). They go back in the queue, unless they
+        # stopped inside a once step, then nobody knows if it went through and they are marked failed
+        with self._connect() as db:
+            db.execute('begin immediate')
+            rows = db.execute("select * from outbox_jobs where state = 'running' and updated_at < ?",
+                              (time.time() - stale_after,)).fetchall()
+            failed = []
+            for row in rows:
+                step = json.loads(row['steps'])[row['steps_done']][0]
+                if step in self.once_steps:
+                    failed.append(row)
+                    db.execute("""update outbox_jobs set state = 'failed', last_error = ?, updated_at = ? where id = ?""",
+                               (f"interrupted during {step}, check whether it went through before retrying", time.time(), row['id']))
+                else:
+                    db.execute("update outbox_jobs set state = 'pending', updated_at = ? where id = ?", (time.time(), row['id']))
+            db.execute('commit')
+        if len(rows) > 0:
+            logger.info(f"Outbox recovered {len(rows)} interrupted job(s), {len(failed)} marked failed")
+        for row in failed:
+            self._finished(row, 'failed')
+
+    def enqueue(self, idempotency_key, steps, touchpoint_history_id=None, final_status=None):
+        # steps: [(handler name, payload), ...]. Returns the job id
+        now = time.time()
+        with self._connect() as db:
+            db.execute("""insert or ignore into outbox_jobs
+                          (idempotency_key, touchpoint_history_id, steps, final_status, created_at, updated_at)
+                          values (?, ?, ?, ?, ?, ?)""",
+                       (idempotency_key, touchpoint_history_id, json.dumps(steps), final_status, now, now))
+            job_id = db.execute("select id from outbox_jobs where idempotency_key = ?", (idempotency_key,)).fetchone()['id']
+        logger.info(f"Outbox job {job_id} queued for touchpoint {touchpoint_history_id}: {[name for name, _ in steps]}")
+        self._wakeup.set()
+        return job_id
+
+    def _claim(self):
+        # atomically move the next due job to running
+        with self._claim_lock, self._connect() as db:
+            db.execute('begin immediate')
+            row = db.execute("""select * from outbox_jobs where state = 'pending' and next_attempt_at <= ?
+                                order by id limit 1""", (time.time(),)).fetchone()
+            if row is not None:
+                db.execute("update outbox_jobs set state = 'running', attempts = attempts + 1, updated_at = ? where id = ?",
+                           (time.time(), row['id']))
+            db.execute('commit')
+        return row
+
+    def _run(self, job):
+        steps = json.loads(job['steps'])
+        steps_done = job['steps_done']
+        try:
+            for name, payload in steps[steps_done:]:
+                self.handlers[name](payload, job['idempotency_key'])
+                steps_done += 1
+                with self._connect() as db:
+                    db.execute("update outbox_jobs set steps_done = ?, updated_at = ? where id = ?",
+                               (steps_done, time.time(), job['id']))
+        except Exception as e:
+            attempts = job['attempts'] + 1
+            step = steps[steps_done][0]
+            error = str(e)
+            failed = attempts >= self.max_attempts
+            if step in self.once_steps:
+                failed = True
+                error = f"{e} ({step} not retried, check whether it went through before retrying)"
+            delay = random.uniform(0, self.backoff * 2 ** attempts)
+            logger.info(f"Outbox job {job['id']} step {steps_done + 1} failed (attempt {attempts}): {e}")
+            with self._connect() as db:
+                db.execute("""update outbox_jobs set state = ?, last_error = ?, next_attempt_at = ?, updated_at = ?
+                              where id = ?""",
+                           ('failed' if failed else 'pending', error, time.time() + delay, time.time(), job['id']))
+            if failed:
+                self._finished(job, 'failed')
+            return
+        with self._connect() as db:
+            db.execute("update outbox_jobs set state = 'done', last_error = null, updated_at = ? where id = ?",
+                       (time.time(), job['id']))
+        logger.info(f"Outbox job {job['id']} done")
+        self._finished(job, 'done')
+
+    def _finished(self, job, state):
+        if self.on_finish is None:
+            return
+        try:
+            self.on_finish(job['touchpoint_history_id'], state)
+        except Exception:
+            logger.exception(f"Outbox on_finish failed for job {job['id']}")
+
+    def _work(self):
+        while not self._stop.is_set():
+            try:
+                job = self._claim()
+            except sqlite3.Error as e:
+                logger.info(f"Outbox claim failed: {e}")
+                job = None
+            if job is None:
+                self._wakeup.wait(self.poll_interval)
+                self._wakeup.clear()
+                continue
+            self._run(job)
+
+    def status(self, touchpoint_history_ids):
+        # latest job per touchpoint: {touchpoint_history_id: {'state', 'final_status', 'last_error', 'attempts'}}
+        ids = [str(i) for i in touchpoint_history_ids]
+        out = {}
+        if len(ids) == 0:
+            return out
+        with self._connect() as db:
+            for chunk_start in range(0, len(ids), 500):
+                chunk = ids[chunk_start:chunk_start + 500]
+                rows = db.execute(f"""select touchpoint_history_id, state, final_status, last_error, attempts
+                                      from outbox_jobs where touchpoint_history_id in ({','.join('?' * len(chunk))})
+                                      order by id""", chunk).fetchall()
+                for row in rows:
+                    out[row['touchpoint_history_id']] = dict(row)
+        return out
+
+    def retry(self, touchpoint_history_id):
+        # put a failed job back in the queue
+        with self._connect() as db:
+            db.execute("""update outbox_jobs set state = 'pending', attempts = 0, next_attempt_at = 0, updated_at = ?
+                          where touchpoint_history_id = ? and state = 'failed'""", (time.time(), str(touchpoint_history_id)))
+        self._wakeup.set()
+
+    def stats(self):
+        with self._connect() as db:
+            return {row['state']: row['n'] for row in
+                    db.execute("select state, count(*) as n from outbox_jobs group by state").fetchall()}
+
+    def stop(self):
+        self._stop.set()
+        self._wakeup.set()
@@ -0,0 +1,118 @@
+import datetime
+import heapq
+
+import numpy as np
+import pandas as pd
+
+# priorities: view_df -> list of per-row sort keys, lowest goes first
+# the queue position (created_dt order) always breaks ties, so with no keys the heap is the old queue order
+
+
+def queue_order(view_df):
+    return []
+
+
+def sla_breached(hours=24):
+    # messages older than the sla first, then the rest (each oldest first)
+    def priority(view_df):
+        cutoff = pd.Timestamp(datetime.datetime.now() - datetime.timedelta(hours=hours))
+        return [(view_df.CREATED_DATE > cutoff).to_numpy().astype(np.int64)]
+    return priority
+
+
+def do_not_text_last(view_df):
+    # members who cant be texted only ever get a no response close, work the others first
+    # a missing flag counts as textable
+    flags = view_df.DO_NOT_TEXT.eq(True) | view_df.DO_NOT_CONTACT.eq(True)
+    return [flags.to_numpy().astype(np.int64)]
+
+
+def ranked(column, values):
+    # rows whose column is in values first, in the order given, then everything else
+    rank = {v: i for i, v in enumerate(values)}
+
+    def priority(view_df):
+        return [view_df[column].astype(object).map(rank).fillna(len(rank)).to_numpy(dtype=np.int64)]
+    return priority
+
+
+def combine(*priorities):
+    # sort by the first priority, then the next ...
+    def priority(view_df):
+        return [key for p in priorities for key in p(view_df)]
+    return priority
+
+
+def priority_from_config(cfg):
+    # cfg: the [queue] secrets, e.g. priority = ['sla', 'do_not_text', 'client'], clients = [...], sla_hours = 24
+    named = {
+        'queue_order': lambda: queue_order,
+        'sla': lambda: sla_breached(cfg.get('sla_hours', 24)),
+        'do_not_text': lambda: do_not_text_last,
+        'client': lambda: ranked('CLIENT', cfg.get('clients', [])),
+        'language': lambda: ranked('LANGUAGE', cfg.get('languages', [])),
+    }
+    unknown = [name for name in cfg.get('priority', []) if name not in named]
+    if unknown:
+        raise ValueError(f"Unknown queue priority {unknown}, expected some of {list(named)}")
+    return combine(*[named[name]() for name in cfg.get('priority', ['queue_order'])])
+
+
+class QueueScheduler:
+    # the open messages of one filtered view in a heap, ordered by a pluggable priority
+    # - built once per view (O(n)), after that next_open() and mark_done() dont depend on the queue length:
+    #   done items are dropped lazily when they reach the top of the heap
+    # - position(tph) is the row of the message in the view the scheduler was built from
+
+    def __init__(self, view_df, priority=queue_order):
+        open_rows = np.flatnonzero(view_df.STATUS.isna().to_numpy())
+        open_df = view_df.iloc[open_rows]
+        tph_ids = open_df.TOUCHPOINT_HISTORY_ID.astype(str).tolist()
+        keys = [np.asarray(key).tolist() for key in priority(open_df)]
+        self._heap = list(zip(*keys, open_rows.tolist(), tph_ids))
+        heapq.heapify(self._heap)
+        self._positions = dict(zip(tph_ids, open_rows.tolist()))
+        self._done = set()
+
+    def __len__(self):
+        # open messages left
+        return len(self._positions) - len(self._done)
+
+    def position(self, tph):
+        return self._positions.get(str(tph))
+
+    def mark_done(self, tph_ids):
+        for tph in [tph_ids] if isinstance(tph_ids, str) else tph_ids:
+            if str(tph) in self._positions:
+                self._done.add(str(tph))
+
+    def _drop_done(self):
+        while self._heap and self._heap[0][-1] in self._done:
+            heapq.heappop(self._heap)
+
+    def next_open(self, skip=()):
+        # the highest priority open message not in skip (leased to someone else), or None
+        # skipped items stay in the queue, their lease may run out
+        aside = []
+        self._drop_done()
+        while self._heap and self._heap[0][-1] in skip:
+            aside.append(heapq.heappop(self._heap))
+            self._drop_done()
+        tph = self._heap[0][-1] if self._heap else None
+        for item in aside:
+            heapq.heappush(self._heap, item)
+        return tph
+
+    def upcoming(self, n, skip=()):
+        # positions of the next n open messages (for prefetching), the queue is left as it was
+        taken, positions = [], []
+        self._drop_done()
+        while self._heap and len(positions) < n:
+            item = heapq.heappop(self._heap)
+            taken.append(item)
+            if item[-1] not in skip:
+                positions.append(item[-2])
+            self._drop_done()
+        for item in taken:
+            heapq.heappush(self._heap, item)
+        return positions
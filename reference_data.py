@@ -0,0 +1,170 @@
+import hashlib
+import io
+import logging
+import sqlite3
+import threading
+import time
+
+import pandas as pd
+
+from metrics import METRICS
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+create table if not exists reference_tables (
+    name text primary key,
+    version integer not null,
+    fetched_at real not null,
+    checksum text not null,
+    data text not null          -- the frame as json (orient='split')
+);
+"""
+
+
+class ReferenceData:
+    # small lookup tables that rarely change (outcome subcodes, the language list), kept in a sqlite file
+    # and shared by every session in the process instead of being queried with every backlog load
+    # - loaders: {name: () -> DataFrame}
+    # - at start the tables are read from the file, stale or not, so nobody waits on a query;
+    #   only a table that has never been loaded is fetched before get() returns
+    # - a background thread reloads tables older than ttl seconds, checking every interval seconds.
+    #   the version only goes up when the content changed, and a failed reload keeps serving the old table
+    # - another process that shares the file (or a restart) picks up a fresh table without querying again
+
+    def __init__(self, path, loaders, ttl=86400, interval=3600):
+        self.path = path
+        self.loaders = loaders
+        self.ttl = ttl
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._load_locks = {name: threading.Lock() for name in loaders}
+        self._tables = {}       # name -> (frame, version, fetched_at epoch seconds, checksum)
+        self._stop = threading.Event()
+        self._thread = None
+        with self._connect() as db:
+            db.executescript(SCHEMA)
+        for name in loaders:
+            self._read(name)
+
+    def _connect(self):
+        db = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        db.execute('pragma journal_mode=wal')
+        return db
+
+    def _read(self, name):
+        # the table as the file has it, if it is newer than ours. False if the file doesnt have it
+        with self._connect() as db:
+            row = db.execute('select version, fetched_at, checksum, data from reference_tables where name = ?',
+                             (name,)).fetchone()
+        if row is None:
+            return False
+        version, fetched_at, checksum, data = row
+        with self._lock:
+            current = self._tables.get(name)
+            if current is not None and checksum == current[3]:
+                self._tables[name] = (current[0], version, max(fetched_at, current[2]), checksum)
+                return True
+        if current is None or fetched_at > current[2]:
+            try:
+                frame = pd.read_json(io.StringIO(data), orient='split', dtype=False)
+            except ValueError:
+                logger.exception(f"Reference table {name} in {self.path} is unreadable, it will be reloaded")
+                return False
+            with self._lock:
+                self._tables[name] = (frame, version, fetched_at, checksum)
+        return True
+
+    def _load(self, name):
+        with METRICS.span('reference_load', table=name) as span:
+            frame = self.loaders[name]()
+            span.set(rows=len(frame))
+        data = frame.to_json(orient='split', index=False, date_format='iso')
+        checksum = hashlib.sha256(data.encode()).hexdigest()
+        now = time.time()
+        # read and bump the version in one write transaction, another process may be loading the same table
+        db = self._connect()
+        try:
+            db.execute('begin immediate')
+            row = db.execute('select version, checksum from reference_tables where name = ?', (name,)).fetchone()
+            changed = row is None or row[1] != checksum
+            version = (row[0] if row is not None else 0) + changed
+            if changed:
+                db.execute('insert or replace into reference_tables values (?, ?, ?, ?, ?)',
+                           (name, version, now, checksum, data))
+            else:
+                db.execute('update reference_tables set fetched_at = ? where name = ?', (now, name))
+            db.execute('commit')
+        except Exception:
+            db.execute('rollback')
+            raise
+        finally:
+            db.close()
+        with self._lock:
+            if changed or name not in self._tables:
+                self._tables[name] = (frame, version, now, checksum)
+            else:
+                self._tables[name] = (self._tables[name][0], version, now, checksum)
+        if changed:
+            logger.info(f"Reference table {name} version {version}: {len(frame)} rows")
+        return changed
+
+    def _age(self, name):
+        with self._lock:
+            table = self._tables.get(name)
+        return None if table is None else time.time() - table[2]
+
+    def refresh(self, names=None, force=False):
+        # reload the tables (all by default) that are older than ttl. returns the names whose content changed
+        changed = []
+        for name in names or list(self.loaders):
+            with self._load_locks[name]:
+                age = self._age(name)
+                if not force and age is not None and age < self.ttl:
+                    continue
+                # someone else may have refreshed the file in the meantime
+                if not force and self._read(name) and self._age(name) < self.ttl:
+                    continue
+                if self._load(name):
+                    changed.append(name)
+        return changed
+
+    def get(self, name):
+        with self._lock:
+            table = self._tables.get(name)
+        if table is None:
+            # first start: nothing on disk yet
+            self.refresh([name])
+            with self._lock:
+                table = self._tables[name]
+        return table[0]
+
+    def version(self, name):
+        with self._lock:
+            table = self._tables.get(name)
+        return None if table is None else table[1]
+
+    def info(self):
+        # {name: {version, age_s, rows}} for the logs
+        with self._lock:
+            tables = dict(self._tables)
+        return {name: {'version': version, 'age_s': round(time.time() - fetched_at), 'rows': len(frame)}
+                for name, (frame, version, fetched_at, _) in tables.items()}
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run, name='reference-data', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        while not self._stop.is_set():
+            for name in self.loaders:
+                try:
+                    self.refresh([name])
+                except Exception:
+                    logger.exception(f"Reference table {name} refresh failed")
+            self._stop.wait(self.interval)
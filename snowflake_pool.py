@@ -0,0 +1,196 @@
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+import snowflake.connector
+from snowflake.connector.errors import DatabaseError, ProgrammingError
+
+from metrics import METRICS
+
+logger = logging.getLogger(__name__)
+
+# snowflake error numbers that mean the session/token is gone and we need a fresh login
+SESSION_EXPIRED_ERRNOS = {390111, 390112, 390114}
+
+
+class SnowflakePool:
+    # a small process-wide pool of snowflake connections
+    # connections are created lazily up to `size`, handed out with connection() and
+    # health checked when they have been idle for longer than health_check_interval
+    # a checkout waiting on a full pool is woken both when a connection comes back and when one
+    # is dropped (broken, failed health check), then it can open a new one in the freed slot
+
+    def __init__(self, connection_parameters, size=4, checkout_timeout=30, health_check_interval=300, connect=None):
+        self.connection_parameters = dict(connection_parameters)
+        # keep the session alive on snowflake's side so idle pooled connections dont expire
+        self.connection_parameters.setdefault('client_session_keep_alive', True)
+        self.size = size
+        self.checkout_timeout = checkout_timeout
+        self.health_check_interval = health_check_interval
+        self._connect = connect or snowflake.connector.connect
+
+        self._idle = []               # (conn, last used monotonic), most recently used last
+        self._lock = threading.Lock()
+        self._slots = threading.Condition(self._lock)
+        self._created = 0
+        self._in_use = 0
+        self._stats = {
+            'checkouts': 0,
+            'connects': 0,
+            'reconnects': 0,
+            'health_checks': 0,
+            'checkout_timeouts': 0,
+            'dropped': 0,
+            'wait_total_s': 0.0,
+            'wait_max_s': 0.0,
+        }
+
+    def _new_connection(self):
+        conn = self._connect(**self.connection_parameters)
+        with self._lock:
+            self._stats['connects'] += 1
+        return conn
+
+    def _is_healthy(self, conn):
+        try:
+            if conn.is_closed():
+                return False
+            with self._lock:
+                self._stats['health_checks'] += 1
+            conn.cursor().execute('select 1').fetchone()
+            return True
+        except (DatabaseError, ProgrammingError) as e:
+            logger.info(f"Snowflake pool health check failed: {e}")
+            return False
+
+    def _reconnect(self, conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
+        with self._lock:
+            self._stats['reconnects'] += 1
+        return self._new_connection()
+
+    def _drop(self, conn, dropped=True):
+        # close a connection that wont go back in the pool and free its slot for a waiting checkout
+        if conn is not None:
+            try:
+                conn.close()
+            except Exception:
+                pass
+        with self._slots:
+            self._created -= 1
+            self._stats['dropped'] += int(dropped)
+            self._slots.notify()
+
+    def _checkout(self):
+        start = time.perf_counter()
+        deadline = time.monotonic() + self.checkout_timeout
+        conn, last_used = None, None
+        # take an idle connection, or grow the pool if there is room, otherwise wait for either
+        with self._slots:
+            while True:
+                if len(self._idle) > 0:
+                    conn, last_used = self._idle.pop()
+                    break
+                if self._created < self.size:
+                    self._created += 1
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._stats['checkout_timeouts'] += 1
+                    raise TimeoutError(f"No Snowflake connection available after {self.checkout_timeout}s (pool size {self.size})")
+                self._slots.wait(remaining)
+
+        if conn is None:
+            try:
+                conn = self._new_connection()
+            except Exception:
+                self._drop(None, dropped=False)
+                raise
+
+        # check connections that have been sitting around for a while
+        elif (time.monotonic() - last_used) > self.health_check_interval:
+            try:
+                if not self._is_healthy(conn):
+                    conn = self._reconnect(conn)
+            except Exception:
+                # the old connection is closed or unusable and no new one was made, give the slot back
+                self._drop(conn)
+                raise
+
+        wait = time.perf_counter() - start
+        with self._lock:
+            self._in_use += 1
+            self._stats['checkouts'] += 1
+            self._stats['wait_total_s'] += wait
+            self._stats['wait_max_s'] = max(self._stats['wait_max_s'], wait)
+        return conn
+
+    def _checkin(self, conn, broken=False):
+        with self._lock:
+            self._in_use -= 1
+        if broken or conn.is_closed():
+            self._drop(conn)
+            return
+        with self._slots:
+            self._idle.append((conn, time.monotonic()))
+            self._slots.notify()
+
+    @contextmanager
+    def connection(self):
+        # usage: with pool.connection() as conn: ...
+        conn = self._checkout()
+        broken = False
+        try:
+            yield conn
+        except (DatabaseError, ProgrammingError) as e:
+            broken = is_session_expired(e)
+            raise
+        finally:
+            self._checkin(conn, broken=broken)
+
+    def fetch_pandas(self, sql, params=None, name='query'):
+        # run one query and return a dataframe; if the session expired, log in again and retry once
+        # name labels the query in the metrics (snowflake_query span, rows and bytes counters)
+        with METRICS.span('snowflake_query', query=name) as span:
+            for attempt in (1, 2):
+                try:
+                    with self.connection() as conn:
+                        cur = conn.cursor()
+                        try:
+                            result = cur.execute(sql, params).fetch_pandas_all()
+                            n_bytes = int(result.memory_usage(deep=True).sum())
+                            span.set(query_id=getattr(cur, 'sfqid', None), rows=len(result), bytes=n_bytes, attempts=attempt)
+                            METRICS.inc('snowflake_rows_total', len(result), query=name)
+                            METRICS.inc('snowflake_bytes_total', n_bytes, query=name)
+                            return result
+                        finally:
+                            cur.close()
+                except (DatabaseError, ProgrammingError) as e:
+                    if attempt == 1 and is_session_expired(e):
+                        logger.info(f"Snowflake session expired, reconnecting: {e}")
+                        continue
+                    raise
+
+    def stats(self):
+        with self._lock:
+            out = dict(self._stats)
+            out['size'] = self.size
+            out['open'] = self._created
+            out['in_use'] = self._in_use
+            out['idle'] = len(self._idle)
+        out['wait_avg_s'] = out['wait_total_s'] / out['checkouts'] if out['checkouts'] else 0.0
+        return out
+
+    def close(self):
+        with self._slots:
+            idle, self._idle = self._idle, []
+        for conn, _ in idle:
+            self._drop(conn, dropped=False)
+
+
+def is_session_expired(e):
+    return getattr(e, 'errno', None) in SESSION_EXPIRED_ERRNOS
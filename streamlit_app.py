@@ -1,61 +1,55 @@
 import streamlit as st
-import pandas as pd
 import datetime
-import numpy as np
-from streamlit.web import cli as stcli
-import requests
 import json
 from  streamlit import session_state as ss
-import snowflake.connector
 from streamlit_oauth import OAuth2Component
 import base64
 import logging
-from cryptography.hazmat.primitives import serialization
-from cryptography.hazmat.backends import default_backend
+import uuid
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from backlog_snapshot import SnapshotCache
+from outbox import Outbox
+from template_catalog import TemplateCatalogCache
+from work_claims import WorkClaims
+from metrics import METRICS
+from app_logging import setup_logging
+# pandas, snowflake, requests and the modules built on them are imported after login, see below
 
 st.set_page_config(layout="wide")
 
 # set up logging
-# Configure the logger
-log_fname = 'sms_2_way_' + datetime.datetime.now().strftime("%Y_%m_%d") + '.log'
-logging.basicConfig(
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    level=logging.INFO,
-    handlers=[
-        logging.FileHandler(log_fname),  # Log to a file
-        logging.StreamHandler()  # Log to console
-    ]
-)
+# json lines to a file that rotates daily or at max_bytes, written by a background thread (app_logging.py)
+# optional [logging] secrets: path, max_bytes, backup_count, max_payload_chars, payload_sample_rate
+setup_logging(**dict(st.secrets.get("logging", {})))
 
 logger = logging.getLogger(__name__)
+run_start = time.perf_counter()
 
-
-
-
-st.markdown(
-    """
-    <style>
-    [data-testid="stElementToolbar"] {
-        display: none;
-    }
-    </style>
-    """,
-    unsafe_allow_html=True
-)
-
-st.markdown("""
+# hide the dataframe toolbar, bold table headers
+APP_STYLES = """
 <style>
+[data-testid="stElementToolbar"] {
+    display: none;
+}
 table th {
     font-weight: bold;
 }
 </style>
-""", unsafe_allow_html=True)
+"""
+st.markdown(APP_STYLES, unsafe_allow_html=True)
 
+# static assets are read from disk once per process
+@st.cache_resource
+def logo():
+    with open('SameSky Health Logo Horizontal RGB.png', 'rb') as f:
+        return f.read()
 
 
-# organize the snowflake queries here
-@st.cache_data 
-def snf_queries():
+
+# one shared pool of snowflake connections for the whole server process
+@st.cache_resource
+def snf_pool():
     # set up the snowflake credentials using Streamlit secrets
     connection_parameters = {
         'user': st.secrets["snowflake"]["user"],
@@ -67,131 +61,151 @@ def snf_queries():
         'schema': st.secrets["snowflake"]["schema"],
         'insecure_mode': True  # Bypass OCSP certificate validation for Streamlit Cloud
     }
-
-    # Use password-based authentication
-    conn = snowflake.connector.connect(**connection_parameters)
-    cur = conn.cursor()  
+    # pool settings are optional, e.g. [snowflake_pool] size = 4
+    pool_cfg = st.secrets.get("snowflake_pool", {})
+    return SnowflakePool(connection_parameters,
+                         size = pool_cfg.get('size', 4),
+                         checkout_timeout = pool_cfg.get('checkout_timeout', 30),
+                         health_check_interval = pool_cfg.get('health_check_interval', 300))
+
+# where the backlog queries run. optional [data_source] secrets:
+#   backend = 'snowflake' (default) or 'sqlite', path = the sqlite file (seeded with SqliteSource.seed()), size
+@st.cache_resource
+def data_source():
+    source_cfg = st.secrets.get("data_source", {})
+    backend = source_cfg.get('backend', 'snowflake')
+    if backend == 'sqlite':
+        return SqliteSource(source_cfg.get('path', 'sms_local.sqlite3'), size = source_cfg.get('size', 4))
+    if backend != 'snowflake':
+        raise ValueError(f"Unknown data source backend {backend!r}, expected 'snowflake' or 'sqlite'")
+    return SnowflakeSource(snf_pool())
+
+def load_backlog(source, store, backlog_filter):
+    # delta refresh of the backlog using the created_dt watermark
+    # a full re-pull still happens every full_refresh_hours to pick up anything the delta missed
+    # store is the last pull of this filter (kept by backlog_snapshot(), which runs one load per filter at a time)
+    # the date window and any column filters go into the query, so only the rows of the window are fetched
+    # closed cases are found by lastmodifieddate since the last refresh, looking back case_change_overlap_minutes
+    # further for changes that reach salesforce_raw late
+    backlog_cfg = st.secrets.get("backlog", {})
+    now = datetime.datetime.now()
+    refresh_start = pd.Timestamp.now(tz = 'UTC').tz_localize(None)
+    delta = backlog_cfg.get('delta_refresh', True) and store.get('last_full') is not None and \
+        (now - store['last_full']) < datetime.timedelta(hours = backlog_cfg.get('full_refresh_hours', 6))
+    store['backlog_df'] = refresh_backlog(source, store.get('backlog_df'), backlog_filter.created_after, delta = delta,
+                                          backlog_filter = backlog_filter, changed_since = store.get('changed_since'))
+    store['changed_since'] = refresh_start - pd.Timedelta(minutes = backlog_cfg.get('case_change_overlap_minutes', 60))
+    if not delta:
+        store['last_full'] = now
+    return store['backlog_df'].copy()
+
+# touchpoint history is loaded per member when they come up in the texting panel, not for the whole backlog
+@st.cache_resource
+def member_history():
+    history_cfg = st.secrets.get("member_history", {})
+    source = data_source()
+    return MemberHistoryCache(lambda member_ids: fetch_history(source, member_ids, max_workers = source.size),
+                              max_members = history_cfg.get('max_members', 500),
+                              ttl = history_cfg.get('ttl', 600))
+
+# the filter index only depends on the rows in the snapshot, so sessions on the same snapshot share it
+# sessions on the same snapshot that merged the same change feed batches have the same rows too
+@st.cache_resource(max_entries = 4)
+def filter_index(snapshot_version, feed_version, n_rows, _backlog_df):
+    return FilterIndex(_backlog_df)
+
+# organize the snowflake queries here (run on data_source(), which is snowflake unless configured otherwise)
+# not cached itself: backlog_snapshot() makes sure only one of these runs at a time per filter and shares the result
+def snf_queries(source, store, history, backlog_filter):
+    timings = {}
+    start = time.perf_counter()
+
+    # get the backlog of inbound sms in the date window. After the first pull only the delta is fetched
+    # (the subcodes and the language list are reference_data(), they are not reloaded with the backlog)
+    backlog_df = run_timed(timings, 'backlog', load_backlog, source, store, backlog_filter)
+
+    # start on the history of the first members in the default (last day) view as soon as we know who they are
+    last_day = datetime.datetime.now() - datetime.timedelta(days = 1)
+    history.prefetch(backlog_df.ACCOUNT_CASESAFE_ID[backlog_df.CREATED_DATE > last_day].head(3))
+
+    timings['total'] = round(time.perf_counter() - start, 3)
+    for step, seconds in timings.items():
+        METRICS.observe('snf_queries_seconds', seconds, step = step)
+    logger.info(f"Backlog snapshot memory: {memory_report(backlog_df)}")
+    logger.info(f"snf_queries timings (s): {timings}")
+    logger.info(f"Data source stats: {source.stats()}")
  
-    # get the backlog of inbound sms
-    # for now, assume a backlog of 2 weeks
-    twoweeks = datetime.datetime.now() - datetime.timedelta(weeks=2)
-    twoweeks = twoweeks.strftime("%Y-%m-%d")
-    backlog_sql = f"""
-        select 
-        Null as Status,
-        tph.id as touchpoint_history_id,   
-        tph.id as touchpoint_history_id1,   
-        c.id as case_id, 
-        c.status as case_status,
-        sms.sms_data:metadata.member_id::string as account_casesafe_id1,
-        sms.sms_data:metadata.member_id::string as account_casesafe_id,
-        sms.sms_data:metadata.client_code::string as client1,
-        sms.sms_data:metadata.client_code::string as client,
-        sms.sms_data:metadata.program_code::string as program1,
-        sms.sms_data:metadata.program_code::string as program,
-        sms.sms_data:payload:outbound:payload.body::string as message_sent1,
-        sms.sms_data:payload:outbound:payload.body::string as message_sent,
-        sms.sms_data:metadata.content_code::string as content_code,
-        sms.sms_data:metadata.content_code::string as content_code1,
-        mb.name as block_name,
-        tph.touchpoint_name__c as touchpoint_name,
-        sms.sms_data:payload:language::string as language,
-        sms.sms_data:payload:language_written::string as language_written,
-        CONVERT_TIMEZONE('UTC', 'America/New_York', sms.sms_data:metadata.created_dt::datetime) AS created_date_EST,
-        sms.sms_data:metadata.created_dt::datetime as created_date,
-        sms.sms_data:metadata.acknowledged = true as acknowledge_status,
-        sms.sms_data:payload.Body::string as body,
-        Null as outcome_code,
-        null as outcome_subcode,
-        null as chg_response,
-        ac.firstname as account_first_name,
-        ac.lastname as account_last_name, 
-        c.mobile__c as phone,
-        -- ac.phone ,
-        coalesce(billingstreet, '') ||' '|| coalesce(billing_address_2__c, '') ||' '|| coalesce(billingcity, '') ||' '|| coalesce(billingstate, '') ||' '|| coalesce(billingpostalcode, '') as billing_address,
-        county__c as county,
-        ac.personbirthdate as member_dob,
-        ac.member_id__c as member_id, 
-        IFNULL(cs_sex__c, sex__pc) as sex,
-        IFNULL(cs_gender__c, gender__pc) as gender,
-        ac.primary_do_not_contact__c as do_not_contact,
-        ac.primary_do_not_text__c as do_not_text
-        FROM "CCP_MEMBER_INTEGRATION"."CCP_SMS_HISTORY" sms
-        inner join salesforce_raw.account ac
-            on sms.sms_data:metadata.member_id = ac.id
-        left join salesforce_raw.member_block_touchpoint_history__c tph
-            on sms.sms_data:payload.salesforce_history.body.id = tph.ssh_internal_object_link_id
-        left join salesforce_raw.member_block__c mb
-            on tph.member_block__c = mb.id 
-        LEFT JOIN SALESFORCE_RAW.CASE c
-        on touchpoint_history_id = c.touchpoint_history_id__c --account_casesafe_id = c.accountid
-        where sms_data:metadata.execution = 'incoming' 
-        and case_id is not null  -- uncomment for PROD
-        and case_status = 'New' -- Uncomment for PROD
-        and ac.test_account__c = False --  ## UCOMMENT FOR PROD
-        and sms_data:metadata.created_dt > '{twoweeks}'
-       -- and sms.sms_data:metadata.acknowledged = False   # UNCOMMENT FOR PROD
-        order by sms_data:metadata.created_dt asc;
-    """
-    backlog_df = cur.execute(backlog_sql).fetch_pandas_all() 
-
-    # do a quick mapping of language code to actual language    
-    lang_map = {"en-US":"English", "ar-001":"Arabic", "es-419":"Spanish"}
-    backlog_df.LANGUAGE = backlog_df.LANGUAGE.replace(lang_map)
-
-
-
-    # also pull all the historical touchpoints for all the members in this queue
-        # also pull all the historical touchpoints for all the members in this queue
-    member_ids = backlog_df.ACCOUNT_CASESAFE_ID.unique()
-    # deal with single member_ids
-    if len(member_ids) > 1:
-        member_ids = tuple(member_ids)
+    return backlog_df
+
+# the backlog snapshots sessions read from, one per BacklogFilter (the date range picked)
+# - older than ttl seconds -> sessions keep getting the previous snapshot while one refresh runs in the background
+# - a filter inside a fresh wider one (last day inside last two weeks) is sliced from it, no query
+@st.cache_resource
+def backlog_snapshot():
+    # optional [snapshot] secrets: ttl, max_windows
+    snapshot_cfg = st.secrets.get("snapshot", {})
+    # resolve the shared resources here so the background refresh thread doesnt need a script context
+    source, history = data_source(), member_history()
+    return SnapshotCache(lambda backlog_filter, store: snf_queries(source, store, history, backlog_filter),
+                         covers = covers, narrow = apply_filter, ttl = snapshot_cfg.get('ttl', 120),
+                         max_entries = snapshot_cfg.get('max_windows', 4))
+
+def date_range_start(date_range):
+    # first day of the 'Date Range' selection, rows created after it are shown
+    if date_range == 'Last Two Weeks':
+        # tmp_date = datetime.datetime(2023, 9, 1)  ## JUST FOR DEV TESTING
+        tmp_date = datetime.datetime.now() - datetime.timedelta(weeks = 2)
+    elif date_range == 'Last Week':
+        tmp_date = datetime.datetime.now() - datetime.timedelta(weeks = 1)
     else:
-        member_ids =  "('" + str(member_ids[0]) + "')"
- 
-    history_sql = f"""
-        select touchpoint_history_id, account_casesafe_id, touchpoint_name, mb.name, tph.message, tph.touchpoint_datetime, modality,touchpoint_type, outcome_code, outcome_subcode, 
-        from salesforce_mart.touchpoint_history_best_result_view tph 
-        inner join salesforce_raw.member_block__c mb
-        on tph.member_block = mb.id
-        where account_casesafe_id in {member_ids}
-        and error = False
-        order by account_casesafe_id, touchpoint_datetime;
-    """
-    history_df = cur.execute(history_sql).fetch_pandas_all()
-
-    # and get a list of all outcome subcodes that go with inbound sms 
-    subcode_sql = """
-        select outcome_code__c, outcome_subcode__c, count(*) as n
-        from salesforce_raw.member_block_touchpoint_history__c
-        where modality__c = 'SMS'
-        and outcome_code__c not like 'Outbound Call%'
-        and outcome_code__c != 'Inbound SMS - Wrong Language'
-        group by 1, 2
-        order by 3 desc;
-    """
-    subcode_df = cur.execute(subcode_sql).fetch_pandas_all()
-
-    # also pull in the list of languages here
-    lang_df = pd.read_csv('languages(in).csv')
-
- 
-    return backlog_df, history_df, subcode_df, lang_df
+        tmp_date = datetime.datetime.now() - datetime.timedelta(days = 1)
+    return tmp_date.strftime("%Y-%m-%d")
+
+def backlog_filter():
+    # what this session's backlog is fetched with: the date window of the 'Date Range' selectbox
+    # (the client/program/touchpoint/language options come from every row in the window, so those stay local)
+    return BacklogFilter(created_after = date_range_start(ss.get('date_range', 'Last Day')))
+
+# new inbound sms past the watermark of the first snapshot, polled in the background for every session
+@st.cache_resource
+def change_feed():
+    # optional [change_feed] secrets: enabled, interval, retention
+    feed_cfg = st.secrets.get("change_feed", {})
+    source = data_source()
+    feed = ChangeFeed(lambda since: fetch_backlog(source, since),
+                      interval = feed_cfg.get('interval', 15),
+                      retention = feed_cfg.get('retention', 86400))
+    if feed_cfg.get('enabled', True):
+        feed.start(backlog_snapshot().get(backlog_filter()).data)
+    return feed
+
+def merge_new_messages():
+    # add what the change feed found since this session last looked to the session's backlog
+    new_rows, ss.feed_version = change_feed().rows_since(ss.feed_version)
+    if new_rows is not None:
+        n_rows = len(ss.backlog_df)
+        ss.backlog_df = append_backlog_rows(ss.backlog_df, new_rows)
+        logger.info(f"Merged {len(ss.backlog_df) - n_rows} new inbound sms, feed version {ss.feed_version}")
+
+# checks the feed on its own every interval seconds, without rerunning the page
+@st.fragment(run_every = st.secrets.get("change_feed", {}).get('interval', 15))
+def new_messages_notice():
+    waiting = change_feed().pending(ss.feed_version)
+    if waiting > 0:
+        st.info(f'{waiting} new message(s) arrived')
+        if st.button('Show new messages'):
+            st.rerun()
 
 def next_sms():
     # clears whatever session state needs to be cleared and resets everything else
 
     logger.info(f"CHG went to next sms from {ss.sms_idx}")
 
-    # moves the index to the next one
-    ss.sms_idx = ss.sms_idx + 1
-    # checks to make sure there are still messages available
-    if ss.sms_idx == len(ss.df_toshow):
-        # then you are out of messages
-        ss.all_done = True
-    else:
-        ss.all_done = False
+    # the message just closed leaves the queue, claim_message() picks the next one by priority on the rerun
+    # (and sets all_done when there is nothing left)
+    if ss.get('queue_scheduler') is not None and ss.get('claimed_tph') is not None:
+        ss.queue_scheduler.mark_done(ss.claimed_tph)
+    ss.all_done = False
 
     # resets the next step option
     # ss.next_step = None
@@ -208,95 +222,141 @@ def next_sms():
     ss.response_touse = None
     ss.other_outcome_notes = None
     ss.case_closed = False
+    ss.case_submitted = False
     ss.message_sent = False
     # reprint the backlog
 
-@st.cache_data 
-def sms_api(action, member_id, message_id = None, message_text = None):
-    # set up and run the sms API
-    url = st.secrets["api"]["sms_api_url"]
-
-    headers = {
-        'Content-Type':'application/json',
-        'x-api-key': st.secrets["api"]["x_api_key"]
+# one http client (pooled keep-alive connections, timeouts, retries) shared by every session
+@st.cache_resource
+def api_client():
+    # optional [api_client] secrets: pool_size, max_retries, backoff, connect_timeout, read_timeout
+    client_cfg = st.secrets.get("api_client", {})
+    timeouts = {'connect_timeout': client_cfg.get('connect_timeout', 3.05),
+                'read_timeout': client_cfg.get('read_timeout', 30)}
+    endpoints = {
+        'sms': {'url': st.secrets["api"]["sms_api_url"], **timeouts},
+        'case_close': {'url': st.secrets["api"]["case_close_api_url"], **timeouts},
     }
+    return ApiClient(st.secrets["api"]["x_api_key"], endpoints,
+                     pool_size = client_cfg.get('pool_size', 10),
+                     max_retries = client_cfg.get('max_retries', 3),
+                     backoff = client_cfg.get('backoff', 0.5))
+
+def sms_list_request(client, member_id):
+    # the list action of the sms API - the templated responses available for this member
+    data = {
+        "action":"list",
+        "member_id":f"{member_id}"
+    }
+    logger.info("SMS/Content API payload", extra = {'payload': data})
+    api_output = client.post('sms', data, idempotent = True)
+    logger.info("SMS/Content API response", extra = {'payload': api_output})
+    return api_output
 
-
-    if action == 'list':
-        data = {
-            "action":"list",
-            "member_id":f"{member_id}"
-        }
-    elif (action == 'send') & (message_text == None):
+# template catalogs per member, shared across sessions and prefetched for the next members in the queue
+@st.cache_resource
+def template_catalog():
+    # optional [template_catalog] secrets: max_members, ttl
+    catalog_cfg = st.secrets.get("template_catalog", {})
+    client = api_client()
+    return TemplateCatalogCache(lambda member_id: sms_list_request(client, member_id),
+                                max_members = catalog_cfg.get('max_members', 200),
+                                ttl = catalog_cfg.get('ttl', 900))
+
+def send_idempotency_key(touchpoint_history_id, message_id, message_text):
+    # the same response to the same inbound message always gets the same key
+    return str(uuid.uuid5(uuid.NAMESPACE_URL, f"{touchpoint_history_id}|{message_id}|{message_text}"))
+
+def sms_send_payload(member_id, message_id, message_text = None):
+    # body of the send action, message_source only when the agent edited the template
+    if message_text == None:
         data = {
             "action": "send",
             "member_id": f"{member_id}",
             "id": f"{message_id}"
         }
-        ss.case_closed = True
-    elif (action == 'send') & (message_text != None):
+    else:
         data = {
             "action": "send",
             "member_id":  f"{member_id}",
             "id": f"{message_id}",
             "message_source": f"{message_text}"
         }
-        ss.case_closed = True
-
-    logger.info(f"SMS/Content API payload: {data}")
-    response = requests.post(url, headers=headers, data=json.dumps(data))
-    
-    #  print(response)
+    return data
 
-    api_output = json.loads(response.text)
-    logger.info(f"SMS/Content API response: {api_output}")
+def sms_api(action, member_id, message_id = None, message_text = None, idempotency_key = None):
+    # set up and run the sms API
+    # list is served from the template catalog cache, send is never cached
+    if action == 'list':
+        with METRICS.span('sms_api', action = action):
+            return template_catalog().get(member_id)
+    elif action == 'send':
+        data = sms_send_payload(member_id, message_id, message_text)
+        ss.case_closed = True
+        ss.case_submitted = True
+
+    # dont send the same response twice from this session (double click, rerun)
+    if idempotency_key in ss.sent_keys:
+        logger.info(f"SMS send skipped, already sent with idempotency key {idempotency_key}")
+        return ss.sent_keys[idempotency_key]
+
+    logger.info("SMS/Content API payload", extra = {'payload': data})
+    # sends are never retried - a retried send could text the member twice
+    headers = {'Idempotency-Key': idempotency_key} if idempotency_key is not None else None
+    with METRICS.span('sms_api', action = action):
+        api_output = api_client().post('sms', data, headers = headers)
+    logger.info("SMS/Content API response", extra = {'payload': api_output})
+    if idempotency_key is not None:
+        ss.sent_keys[idempotency_key] = api_output
     # st.write('response is: ')
     # st.write(api_output)
 
     return api_output
 
 
-def case_account_api():
-    # this calls the api to close the case and do any account updates
-
+def case_account_payload(row, outcome_code, outcome_subcode, pos_interaction = None, other_outcome_notes = None, lang_update = None):
     # create the body for the case/account update
     api_body =   {
-        "phone": f"{tmp_df.PHONE}",
+        "phone": f"{row.PHONE}",
         "modified_by": ss.auth,
         "case": {
-            "id": f"{tmp_df.CASE_ID}",
-            "outcome_code": f"{ss.outcome_code}",
-            "outcome_subcode": f"{ss.outcome_subcode}", 
-            "positive_interaction_notes": f"{ss.pos_interaction}",
-            "other_outcome_notes": f"{ss.other_outcome_notes}"
+            "id": f"{row.CASE_ID}",
+            "outcome_code": f"{outcome_code}",
+            "outcome_subcode": f"{outcome_subcode}", 
+            "positive_interaction_notes": f"{pos_interaction}",
+            "other_outcome_notes": f"{other_outcome_notes}"
         },
         "account": {
-            "id": f"{tmp_df.ACCOUNT_CASESAFE_ID}",
-            "language": f"{ss.lang_update}"
+            "id": f"{row.ACCOUNT_CASESAFE_ID}",
+            "language": f"{lang_update}"
         }
     }
+    return api_body
 
+def current_case_payload():
+    # case/account update for the message on screen, from what the agent picked
+    return case_account_payload(tmp_df, ss.outcome_code, ss.outcome_subcode, ss.pos_interaction, ss.other_outcome_notes, ss.lang_update)
 
+def case_close_request(client, api_body):
     # call the API to close the case 
-    url = st.secrets["api"]["case_close_api_url"]
-
-    headers = {
-        'Content-Type':'application/json',
-        'x-api-key': st.secrets["api"]["x_api_key"]
-    }
-    logger.info(f"Case close API will run with this paylod: {api_body}")
-    response = requests.post(url, headers=headers, data=json.dumps(api_body))
-    
-    # print(response)
-    
-    api_output = json.loads(response.text)
-    logger.info(f"Case close API ran with this response:  {api_output}")
-    # parse the response
+    logger.info("Case close API will run with this paylod", extra = {'payload': api_body})
+    api_output = client.post('case_close', api_body)
+    logger.info("Case close API ran with this response", extra = {'payload': api_output})
+    # parse the response - raises if the case wasnt closed
     bulk_update = api_output['case']['bulkupdate']['Body']
     two_way = api_output['case']['remove_two_way_sms']
+    return api_output
+
+def case_account_api():
+    # this calls the api to close the case and do any account updates
+    with METRICS.span('case_close'):
+        api_output = case_close_request(api_client(), current_case_payload())
+    if len(work_claims().complete(ss.auth, [tmp_df.TOUCHPOINT_HISTORY_ID])) == 0:
+        logger.info(f"Case closed for touchpoint {tmp_df.TOUCHPOINT_HISTORY_ID} while another agent held it")
 
     # set a flag that the case is being closed
     ss.case_closed = True
+    ss.case_submitted = True
 
     return api_output   
 
@@ -334,16 +394,27 @@ def account_updates():
     # else:
     #     ss.backlog_df.loc[backlog_idx,'CHG_RESPONSE'] = ss.response_touse
 
+def escalations_data(row):
+    # the escalations table for one backlog row. The first six fields are repeated at the front
+    # (the *1 columns) so they can be copied in one go; they are built here instead of being selected twice in SQL
+    esc_df = row[['TOUCHPOINT_HISTORY_ID','ACCOUNT_CASESAFE_ID','CLIENT','PROGRAM','MESSAGE_SENT','CONTENT_CODE','CREATED_DATE_EST',
+                  'CREATED_DATE','ACKNOWLEDGE_STATUS','BODY','ACCOUNT_FIRST_NAME','ACCOUNT_LAST_NAME','PHONE',
+                  'BILLING_ADDRESS','COUNTY','MEMBER_DOB','BLOCK_NAME','TOUCHPOINT_NAME','MEMBER_ID','SEX','GENDER','DO_NOT_CONTACT','DO_NOT_TEXT']].to_frame().T
+    for i, col in enumerate(['TOUCHPOINT_HISTORY_ID', 'ACCOUNT_CASESAFE_ID','CLIENT','PROGRAM','MESSAGE_SENT','CONTENT_CODE']):
+        esc_df.insert(i, col + '1', esc_df[col])
+    return esc_df
+
 def update_apptable():
     # does the table updates to make it more in sync with the Close Case API calls. Moved from account_udpates
         # update the dataframe so that it says message done
+    # status/outcome columns are categoricals, set_backlog_value adds new values to the categories
     backlog_idx = tmp_df['index']
     if ss.next_step == 'Close Case w/ NO Response':
-        ss.backlog_df.loc[backlog_idx, 'STATUS'] = 'Closed No Response'
+        set_backlog_value(ss.backlog_df, backlog_idx, 'STATUS', 'Closed No Response')
     else:
-        ss.backlog_df.loc[backlog_idx, 'STATUS'] = 'Response Sent'
-    ss.backlog_df.loc[backlog_idx, 'OUTCOME_CODE'] = ss.outcome_code
-    ss.backlog_df.loc[backlog_idx, 'OUTCOME_SUBCODE'] = ss.outcome_subcode
+        set_backlog_value(ss.backlog_df, backlog_idx, 'STATUS', 'Response Sent')
+    set_backlog_value(ss.backlog_df, backlog_idx, 'OUTCOME_CODE', ss.outcome_code)
+    set_backlog_value(ss.backlog_df, backlog_idx, 'OUTCOME_SUBCODE', ss.outcome_subcode)
     # update the datafraome on top first 
     if ss.response_touse == None:
         ss.backlog_df.loc[backlog_idx,'CHG_RESPONSE'] = 'Case closed, no text sent'
@@ -352,6 +423,479 @@ def update_apptable():
     
     ss.case_closed = True
 
+# durable outbox for the send + case close calls, worked off by background threads
+@st.cache_resource
+def outbox():
+    # optional [outbox] secrets: enabled, path, workers, max_attempts, stale_after
+    outbox_cfg = st.secrets.get("outbox", {})
+    client, claims = api_client(), work_claims()
+
+    def send(data, idempotency_key):
+        logger.info("SMS/Content API payload", extra = {'payload': data})
+        api_output = client.post('sms', data, headers = {'Idempotency-Key': idempotency_key})
+        logger.info("SMS/Content API response", extra = {'payload': api_output})
+        if 'status' in api_output and int(api_output['status']) >= 400:
+            raise ApiError(f"SMS send failed: {api_output.get('message')}")
+
+    return Outbox(outbox_cfg.get('path', 'sms_outbox.sqlite3'),
+                  {'sms_send': send, 'case_close': lambda api_body, key: case_close_request(client, api_body)},
+                  workers = outbox_cfg.get('workers', 2),
+                  max_attempts = outbox_cfg.get('max_attempts', 5),
+                  # sends are never retried on their own - a retried send could text the member twice
+                  once_steps = {'sms_send'},
+                  stale_after = outbox_cfg.get('stale_after', 600),
+                  # the message stays held while its job runs, then it is closed for everyone or given back
+                  on_finish = lambda tph, state: claims.finish(tph, state == 'done'))
+
+def outbox_enabled():
+    return st.secrets.get("outbox", {}).get('enabled', True)
+
+# counters and latency histograms (metrics.py) written out for prometheus
+@st.cache_resource
+def metrics_export():
+    # optional [metrics] secrets: path, export_interval
+    metrics_cfg = st.secrets.get("metrics", {})
+    METRICS.start_export(metrics_cfg.get('path', 'sms_metrics.prom'), metrics_cfg.get('export_interval', 15))
+    return METRICS
+
+# outcome subcodes and the language list: rarely change, so they are kept on disk and shared by every session
+# read from the file at start (no query), refreshed in the background once older than ttl
+@st.cache_resource
+def reference_data():
+    # optional [reference_data] secrets: path, ttl, interval (seconds)
+    reference_cfg = st.secrets.get("reference_data", {})
+    source = data_source()
+    reference = ReferenceData(reference_cfg.get('path', 'sms_reference.sqlite3'),
+                              {'subcodes': lambda: fetch_subcodes(source),
+                               'languages': lambda: pd.read_csv('languages(in).csv')},
+                              ttl = reference_cfg.get('ttl', 86400),
+                              interval = reference_cfg.get('interval', 3600))
+    reference.start()
+    logger.info(f"Reference data: {reference.info()}")
+    return reference
+
+# leases on backlog messages shared by every agent (session) so two people dont answer the same text
+@st.cache_resource
+def work_claims():
+    # optional [work_claims] secrets: path, lease_seconds
+    claims_cfg = st.secrets.get("work_claims", {})
+    return WorkClaims(claims_cfg.get('path', 'sms_work_claims.sqlite3'),
+                      lease_seconds = claims_cfg.get('lease_seconds', 300))
+
+# the open messages in df_toshow, in [queue] priority order
+@st.cache_resource
+def queue_priority():
+    # optional [queue] secrets: priority (list of queue_order, sla, do_not_text, client, language), sla_hours,
+    # clients, languages. The default is the old created_dt order
+    return priority_from_config(st.secrets.get("queue", {}))
+
+def queue_scheduler():
+    # built once per view (snapshot, change feed, filters), not on every rerun
+    queue_key = (ss.snapshot_version, ss.feed_version, len(ss.backlog_df), ss.client_code_filt, ss.program_code_filt,
+                 ss.tp_filt, ss.lang_filt, ss.time_filt)
+    if ss.get('queue_key') != queue_key:
+        ss.queue_key = queue_key
+        ss.queue_scheduler = QueueScheduler(ss.df_toshow, queue_priority())
+        # everything closed in the last two weeks, then only what was closed since
+        ss.queue_synced_at = 0
+    return ss.queue_scheduler
+
+def claim_message():
+    # make sure this agent holds the lease on the message being texted
+    # staying on the same message renews the lease (each rerun is the heartbeat),
+    # otherwise the agent gets the highest priority open message nobody else is working
+    if ss.case_submitted:
+        # finished with this one, it stays on screen until they go to the next message
+        return
+    claims = work_claims()
+    held = ss.get('claimed_tph')
+    current = str(ss.df_toshow.TOUCHPOINT_HISTORY_ID.iloc[ss.sms_idx]) if ss.sms_idx < len(ss.df_toshow) else None
+    # update_apptable() already shows the outcome picked (case_closed) while the agent is still working the message
+    current_open = current is not None and (pd.isna(ss.df_toshow.STATUS.iloc[ss.sms_idx]) or (ss.case_closed and current == held))
+    if current_open and (current == held) and claims.heartbeat(ss.auth, held):
+        return
+
+    scheduler = queue_scheduler()
+    # messages closed by anyone since the last look leave the queue
+    synced_at = time.time()
+    scheduler.mark_done(claims.done_since(ss.queue_synced_at))
+    ss.queue_synced_at = synced_at
+
+    # if the lease ran out while they were on it, try to get the same message back first
+    claimed = claims.claim_next(ss.auth, [held]) if current_open and (current == held) else None
+    leased = claims.leased_to_others(ss.auth)
+    while claimed is None:
+        candidate = scheduler.next_open(skip = leased)
+        if candidate is None:
+            break
+        # claim_next checks again in its transaction, someone may have just taken it
+        claimed = claims.claim_next(ss.auth, [candidate])
+        leased.add(candidate)
+    ss.claimed_tph = claimed
+    if claimed is None:
+        ss.all_done = True
+    else:
+        ss.sms_idx = scheduler.position(claimed)
+
+def queue_case_close(idempotency_key, send_data = None):
+    # hand the (send and) case close for the current message to the outbox instead of waiting on the apis
+    # returns False if another agent has the message now, nothing is queued then
+    if len(work_claims().queue(ss.auth, [tmp_df.TOUCHPOINT_HISTORY_ID])) == 0:
+        st.error('Another agent has picked up this message, it was not closed')
+        return False
+    steps = []
+    if send_data is not None:
+        steps.append(['sms_send', send_data])
+    steps.append(['case_close', current_case_payload()])
+    final_status = 'Response Sent' if send_data is not None else 'Closed No Response'
+    outbox().enqueue(idempotency_key, steps, touchpoint_history_id = str(tmp_df.TOUCHPOINT_HISTORY_ID), final_status = final_status)
+    ss.outbox_pending.add(str(tmp_df.TOUCHPOINT_HISTORY_ID))
+    set_backlog_value(ss.backlog_df, tmp_df['index'], 'STATUS', 'Queued')
+    ss.case_closed = True
+    ss.case_submitted = True
+    return True
+
+def reconcile_outbox():
+    # update STATUS for the messages this session queued once the outbox has worked them off
+    # returns the touchpoints whose job failed for good
+    if len(ss.outbox_pending) == 0:
+        return []
+    failed = []
+    jobs = outbox().status(ss.outbox_pending)
+    for tph, job in jobs.items():
+        backlog_idx = ss.backlog_df.index[ss.backlog_df.TOUCHPOINT_HISTORY_ID == tph]
+        if job['state'] == 'done':
+            status = job['final_status']
+            ss.outbox_pending.discard(tph)
+        elif job['state'] == 'failed':
+            status = 'Failed'
+            failed.append(tph)
+        else:
+            status = 'Queued'
+        for idx in backlog_idx:
+            set_backlog_value(ss.backlog_df, idx, 'STATUS', status)
+        if job['state'] == 'failed':
+            logger.info(f"Outbox job for touchpoint {tph} failed after {job['attempts']} attempts: {job['last_error']}")
+    return failed
+
+def bulk_close(labels, outcome_code, outcome_subcode, other_outcome_notes = None, pos_interaction = None):
+    # close many backlog rows with no response, a few case close calls at a time
+    # returns a dataframe of the cases that failed
+    concurrency = st.secrets.get("bulk_close", {}).get('concurrency', 4)
+    client = api_client()
+    rows = ss.backlog_df.loc[labels]
+    # lease the whole selection first, another agent may have picked some of it up since the table was drawn
+    tph_ids = rows.TOUCHPOINT_HISTORY_ID.astype(str)
+    claimed = work_claims().claim(ss.auth, tph_ids)
+    failures = [{'MEMBER_ID': row.MEMBER_ID, 'CASE_ID': row.CASE_ID, 'ERROR': 'Taken by another agent'}
+                for row, tph in zip(rows.itertuples(), tph_ids) if tph not in claimed]
+    rows = rows[tph_ids.isin(claimed)]
+    progress = st.progress(0.0, text = f'Closing {len(rows)} cases')
+    closed = []
+    with ThreadPoolExecutor(max_workers = concurrency) as pool:
+        futures = {pool.submit(case_close_request, client,
+                               case_account_payload(row, outcome_code, outcome_subcode, pos_interaction, other_outcome_notes)): label
+                   for label, row in rows.iterrows()}
+        for i, future in enumerate(as_completed(futures)):
+            label = futures[future]
+            try:
+                future.result()
+                closed.append(label)
+            except Exception as e:
+                failures.append({'MEMBER_ID': rows.loc[label, 'MEMBER_ID'], 'CASE_ID': rows.loc[label, 'CASE_ID'], 'ERROR': str(e)})
+            progress.progress((i + 1) / len(futures), text = f'Closed {len(closed)} of {len(futures)} cases, {len(failures)} failed')
+
+    # update the table for the ones that went through, and let the others go for whoever retries them
+    work_claims().complete(ss.auth, rows.loc[closed, 'TOUCHPOINT_HISTORY_ID'])
+    for tph in rows.TOUCHPOINT_HISTORY_ID.drop(closed):
+        work_claims().release(ss.auth, tph)
+    for label in closed:
+        set_backlog_value(ss.backlog_df, label, 'STATUS', 'Closed No Response')
+        set_backlog_value(ss.backlog_df, label, 'OUTCOME_CODE', outcome_code)
+        set_backlog_value(ss.backlog_df, label, 'OUTCOME_SUBCODE', outcome_subcode)
+        ss.backlog_df.loc[label, 'CHG_RESPONSE'] = 'Case closed, no text sent'
+    logger.info(f"Bulk close with no response - outcome code {outcome_code}, outcome subcode {outcome_subcode}: "
+                f"{len(closed)} closed, {len(failures)} failed")
+    return pd.DataFrame(failures, columns = ['MEMBER_ID', 'CASE_ID', 'ERROR'])
+
+@st.fragment
+def bulk_close_panel():
+    # pick many open rows from the filtered backlog and close them all with one outcome
+    # results of the last bulk close, kept over the rerun that refreshes the table
+    if ss.get('bulk_result') is not None:
+        n_closed, failures = ss.bulk_result
+        if len(failures) > 0:
+            st.error(f'{len(failures)} case(s) could not be closed, {n_closed} closed')
+            st.dataframe(failures, hide_index = True)
+        else:
+            st.success(f'Closed {n_closed} case(s)')
+
+    open_df = ss.df_toshow[ss.df_toshow.STATUS.isna()].set_index('index')
+    # leave out what other agents are working on or have already closed
+    open_df = open_df[~open_df.TOUCHPOINT_HISTORY_ID.astype(str).isin(work_claims().taken_by_others(ss.auth))]
+    if len(open_df) == 0:
+        st.write('No open messages in the current filter')
+        return
+    pick_df = open_df[['MEMBER_ID','CLIENT','PROGRAM','TOUCHPOINT_NAME','BODY','CREATED_DATE']].copy()
+    pick_df.insert(0, 'Select', False)
+    edited = st.data_editor(pick_df, hide_index = True, disabled = list(pick_df.columns[1:]), key = 'bulk_editor')
+    labels = list(edited.index[edited.Select])
+
+    bcol1, bcol2, bcol3 = st.columns(3)
+    with bcol1:
+        bulk_code = st.selectbox('Outcome code for all selected', list(ss.subcode_df.OUTCOME_CODE__C.unique()), key = 'bulk_outcome_code')
+    with bcol2:
+        subcode_list = ss.subcode_df.sort_values('OUTCOME_SUBCODE__C')
+        bulk_subcode = st.selectbox('Subcode for all selected', [None] + list(subcode_list.OUTCOME_SUBCODE__C.unique()), key = 'bulk_outcome_subcode')
+    with bcol3:
+        bulk_notes = st.text_input('Other Outcome Notes', key = 'bulk_notes')
+
+    if (bulk_subcode == None) & (bulk_code != 'Inbound SMS - Wrong Number'):
+        st.warning('Please enter in a subcode to close the cases',icon="⚠️")
+    elif st.button(f'Close {len(labels)} selected case(s) with NO response', disabled = len(labels) == 0):
+        failures = bulk_close(labels, bulk_code, bulk_subcode, bulk_notes)
+        ss.bulk_result = (len(labels) - len(failures), failures)
+        # start over with a fresh selection on the updated table
+        del ss['bulk_editor']
+        st.rerun()
+
+def log_latency(region, start):
+    # how long one rerun of a region took - the whole script, or just a fragment
+    elapsed = time.perf_counter() - start
+    METRICS.observe('rerun_seconds', elapsed, region = region)
+    logger.info(f"Rerun latency - {region}: {elapsed * 1000:.1f} ms")
+
+@st.fragment
+def backlog_table_panel():
+    # the filtered backlog, sorted and paged here so only the visible page goes to the browser
+    # a fragment, so sorting and paging dont rerun the rest of the app
+    start = time.perf_counter()
+    # optional [backlog_table] secrets: page_size
+    default_size = st.secrets.get("backlog_table", {}).get('page_size', 50)
+    sizes = sorted({25, 50, 100, 250, default_size})
+
+    # back to the first page when the filters change
+    view_key = (ss.snapshot_version, ss.client_code_filt, ss.program_code_filt, ss.tp_filt, ss.lang_filt, ss.time_filt)
+    if ss.get('table_view_key') != view_key:
+        ss.table_view_key = view_key
+        ss.table_page = 1
+
+    tcol1, tcol2, tcol3, tcol4 = st.columns(4)
+    with tcol1:
+        sort_by = st.selectbox('Sort by', [QUEUE_ORDER] + TABLE_COLUMNS, key = 'table_sort_by')
+    with tcol2:
+        sort_dir = st.radio('Order', ['Ascending', 'Descending'], horizontal = True, key = 'table_sort_dir')
+    with tcol3:
+        page_size = st.selectbox('Rows per page', sizes, index = sizes.index(default_size), key = 'table_page_size')
+    n_pages = page_count(len(ss.df_toshow), page_size)
+    if ss.get('table_page', 1) > n_pages:
+        ss.table_page = n_pages
+    with tcol4:
+        page = st.number_input(f'Page (of {n_pages})', min_value = 1, max_value = n_pages, step = 1, key = 'table_page')
+
+    order = sort_order(ss.df_toshow, sort_by, sort_dir == 'Ascending', ss.backlog_df)
+    st.dataframe(table_page(ss.df_toshow, order, page, page_size, ss.backlog_df), hide_index=True)
+    first_row = min(len(ss.df_toshow), (page - 1) * page_size + 1)
+    st.caption(f'Rows {first_row}-{min(len(ss.df_toshow), page * page_size)} of {len(ss.df_toshow)}'
+               + ('' if sort_by == QUEUE_ORDER else ' - texting still goes in queue order'))
+    log_latency('backlog table', start)
+
+# the texting panel is split into two regions so working a message doesnt redo the backlog above it
+# - member_context_panel: the member and their touchpoint history. It only changes with the message
+#   on screen, so it is drawn on full reruns only
+# - action_panel: a fragment - picking an action, template or subcode reruns just this panel, not the
+#   filters, backlog table and member context. Moving to the next message does a full st.rerun()
+def member_context_panel(tmp_df):
+    start = time.perf_counter()
+    col1, col2 = st.columns([0.4, 0.6])
+    with col1:
+        # calculate the age
+        today = datetime.datetime.today()
+
+        if (tmp_df.MEMBER_DOB == 'None') |  (pd.isnull(tmp_df.MEMBER_DOB)):
+            tmp_df['age'] = 'Unknown'
+        else:
+            tmp_df['age'] = today.year - tmp_df.MEMBER_DOB.year - ((today.month, today.day) < (tmp_df.MEMBER_DOB.month, tmp_df.MEMBER_DOB.day))
+        # tmp_df['age'] = today.year - tmp_df.MEMBER_DOB.year - ((today.month, today.day) < (tmp_df.MEMBER_DOB.month, tmp_df.MEMBER_DOB.day))
+
+        st.write('**Member Name:** ' + tmp_df.ACCOUNT_FIRST_NAME + ' ' + tmp_df.ACCOUNT_LAST_NAME)
+        st.write('**Member ID:** ' + str(tmp_df.MEMBER_ID))
+        st.write('**Member Age:** ' + str(tmp_df.age))
+        message =  '**Message: "' + tmp_df.BODY + '"**'
+        st.write(message) 
+        # additioanl data
+        st.write('**Date Sent:** ' + str(tmp_df.CREATED_DATE))
+        st.write('**Client:** ' + tmp_df.CLIENT)
+        st.write('**Program:** ' + tmp_df.PROGRAM)
+        st.write('**Block Name:** ' + tmp_df.BLOCK_NAME)
+        st.write('**Touchpoint Name:** ' + tmp_df.TOUCHPOINT_NAME)
+        st.write('** Last Outbound Message:** "' + tmp_df.MESSAGE_SENT + '"')
+
+        # st.dataframe(tmp_df[['CLIENT','PROGRAM','BLOCK_NAME','TOUCHPOINT_NAME','CREATED_DATE','MESSAGE_SENT']], hide_index = True) 
+
+    with col2:
+        st.write('Full Touchpoint History')
+        tmp_tph = member_history().get(tmp_df.ACCOUNT_CASESAFE_ID)
+        # warm up the history for the next few members in the queue
+        upcoming = ss.df_toshow.ACCOUNT_CASESAFE_ID.iloc[queue_scheduler().upcoming(3, skip = {ss.claimed_tph})].tolist()
+        member_history().prefetch(upcoming)
+        # and their templated responses, so "Close Case & Respond" doesnt wait on the list call
+        template_catalog().prefetch([tmp_df.ACCOUNT_CASESAFE_ID] + upcoming)
+        st.table(tmp_tph[['TOUCHPOINT_DATETIME','TOUCHPOINT_TYPE','MESSAGE']].iloc[0:10].reset_index(drop = True)) #, hide_index = True) 
+
+    log_latency('member context', start)
+
+@st.fragment
+def action_panel(tmp_df):
+    start = time.perf_counter()
+    # fragment reruns skip claim_message(), so the lease is renewed here until the close is sent or queued
+    if (ss.case_submitted == False) and (work_claims().heartbeat(ss.auth, ss.claimed_tph) == False):
+        # lost the lease, go back through claim_message()
+        st.rerun()
+
+    st.write('Take Action')
+    ss.next_step = st.selectbox('What do you want to do?', [None,'Close Case w/ NO Response', 'Close Case & Respond'],  key = 'selectbox_next_step')
+
+    escalation_flag =  st.checkbox('Check to view escalations data', key = 'esc_flag')
+            
+    if escalation_flag == True: # then show all the escalations data needed
+        esc_df = escalations_data(tmp_df)
+        st.write('##### Escalations Data')
+        st.write('Hit shift + arrow to highlight and copy')
+        st.dataframe(esc_df, hide_index=True)
+        
+
+        
+
+    if ss.next_step == 'Close Case w/ NO Response':
+        st.header('Close the case with no response needed')  
+        account_updates()
+        # update_apptable()
+        # subcode = st.selectbox('Select the appropriate subcode', ss.subcode_df.OUTCOME_SUBCODE__C.unique())
+
+        # # update the dataframe so that it says message skipped
+        # backlog_idx = tmp_df['index']
+        # ss.backlog_df.loc[backlog_idx, 'STATUS'] = 'No action needed'
+        # ss.backlog_df.loc[backlog_idx, 'OUTCOME_CODE'] = 'Inbound SMS'
+        # ss.backlog_df.loc[backlog_idx, 'OUTCOME_SUBCODE'] = subcode
+        # # ss.df_toshow.loc[ss.sms_idx,'STATUS'] = 'No action needed'
+
+        # ss.df_toshow.STATUS.iloc[ss.sms_idx] = 'No action needed'
+        if (ss.outcome_code == 'Inbound SMS' ) & ((ss.outcome_subcode == None) | (ss.outcome_code == 'Inbound SMS - Wrong Number')):
+            st.warning('Please enter in a subcode to close the case',icon="⚠️")
+
+        if (ss.outcome_subcode != None) | (ss.outcome_code == 'Inbound SMS - Wrong Number'):    
+            logger.info(f"Case updated with no response - outcome code {ss.outcome_code}, outcome subcode {ss.outcome_subcode}")
+            if st.button('Close the case', on_click=update_apptable()):
+                # st.write('HEY TONY, CLOSE THE CASE!')
+                # update_apptable()
+                # account_updates() -- have the table update here
+                if outbox_enabled():
+                    if queue_case_close(send_idempotency_key(tmp_df.TOUCHPOINT_HISTORY_ID, 'close', None)):
+                        st.write('Case queued to close')
+                else:
+                    response = case_account_api()
+                    st.write('Case closed')
+                # st.write('API says: ' + str(response))
+
+
+            if st.button('Go to the next message', on_click=next_sms):
+                st.rerun()
+
+
+    elif ss.next_step == 'Close Case & Respond':
+        st.header('Response time!')  
+        # call Tony's API to get the list of available repsonses
+
+        member_id = tmp_df.ACCOUNT_CASESAFE_ID
+        # one catalog lookup per rerun: the list response for the error handling and the catalog parsed from
+        # that same response (an uncached error would otherwise be asked for twice, and the answers could differ)
+        with METRICS.span('sms_api', action = 'list'):
+            responses, catalog = template_catalog().lookup(member_id)
+        ss.api_error = None
+        # put some error handling in here
+        if 'status' in responses.keys():
+            # then we have an error
+            if (responses['status'] == 422) or (responses['status'] == 404):
+                #DNC
+                st.write(responses['message'])
+                # TODO - find out what to do in terms of account updates
+                ss.api_error = 'do_not_contact'
+                st.warning('Please close the case without responding')
+                # if st.button('Go to the next message', on_click=next_sms):
+                #     st.rerun()          
+
+
+        # the response json is parsed once per catalog when it is loaded, here it is just lookups
+        if ss.api_error == None and catalog is None:
+            # an error page or anything else without templates. It isnt cached, the next rerun asks again
+            ss.api_error = 'catalog_unavailable'
+            st.error('The templated responses for this member could not be loaded, please try again in a moment')
+
+        if ss.api_error == None:
+            # now display subjects -> message name & message source
+            
+            cols1, cols2, cols3 = st.columns(3)
+            with cols1:
+                subject_touse = st.selectbox('Available Templated Response Subjects:', catalog.subjects, key = 'templated_response_subjects')
+                
+                msg_name = st.selectbox('Available Message Names', [None] + catalog.names[subject_touse], key = 'templated_response_names') 
+
+                if ss.templated_response_names != None:
+            
+                    msg_txt = st.selectbox('Choose the message', catalog.sources[(subject_touse, msg_name)], key = 'templated_messages')
+
+    
+                    ss.response_id = catalog.message_id(subject_touse, msg_name, msg_txt)
+                    ss.response_touse = catalog.source_of(subject_touse, ss.response_id)
+
+                    if ss.response_touse != None:
+                        st.write('Selected Message: ' + ss.response_touse)
+
+                    if st.checkbox('click to edit response', key = 'edit_box'):
+                        ss.response_touse = st.text_area('Edit Response', ss.response_touse) 
+
+            
+                    with cols2:
+                        account_updates()
+                        if (ss.outcome_code == 'Inbound SMS' ) & ((ss.outcome_subcode == None) | (ss.outcome_code == 'Inbound SMS - Wrong Number')):
+                        # if (ss.outcome_code == 'Inbound SMS' ) & (ss.outcome_subcode == None):
+                            st.warning('Please enter in a subcode to close the case',icon="⚠️")
+
+                    with cols3:
+                        if (ss.response_touse != None) & ((ss.outcome_subcode != None) | (ss.outcome_code == 'Inbound SMS - Wrong Number')):
+                            st.write('Selected Response: ' + ss.response_touse)
+                            if st.button('Click to send the above response and close the case', on_click=update_apptable()):
+                                logger.info(f"Case updated with a response - outcome code {ss.outcome_code}, outcome subcode {ss.outcome_subcode}, response {ss.response_touse}")
+                                # call the send API
+                                # was the message edited? 
+                                if ss.response_touse != catalog.source_of(subject_touse, ss.response_id):
+                                    message_text = ss.response_touse
+                                else:
+                                    message_text = None
+                                    
+                                send_key = send_idempotency_key(tmp_df.TOUCHPOINT_HISTORY_ID, ss.response_id, message_text)
+                                update_apptable()
+                                if outbox_enabled():
+                                    # the outbox sends and closes in the background, STATUS follows via reconcile_outbox()
+                                    if queue_case_close(send_key, sms_send_payload(member_id, ss.response_id, message_text)):
+                                        st.write('Message queued to send! ' + ss.response_touse + ' :tada:')
+                                        ss.message_sent = True
+                                else:
+                                    sent_output = sms_api('send', member_id, ss.response_id, message_text, idempotency_key = send_key)
+
+                                    st.write('Message Sent! ' + ss.response_touse + ' :tada:')
+                                    ss.message_sent = True
+
+                                    response_caseaccount = case_account_api()
+                                    st.write('Account updated! ') #  + str(response_caseaccount))
+
+                            if ss.message_sent == True:
+                                if st.button('Go to the next message', on_click=next_sms):
+                                    st.rerun()
+
+    log_latency('action panel', start)
+
 ##### START THE BUILD HERE ######
 
 # Set environment variables - PROD
@@ -417,35 +961,56 @@ else:
 #### Start getting data
 # make the whole thing conditional on login
 
-# first initialize the refresh_page session state - it starts as True for a new page
-if 'refresh_page' not in ss:
-    ss['refresh_page'] = True
-
 if 'auth' not in ss:
     st.write('Please log in to continue')
 else:
-    # get the data
-    # if this is a new page refresh, need to repull SNF data
-    if ss.refresh_page == True:
-        st.cache_data.clear()
-    backlog_df, history_df, subcode_df, lang_df = snf_queries()
+    # the data stack is only needed once someone is logged in, so the login screen doesnt wait on it
+    # (these bind module globals, which the functions above use)
+    import pandas as pd
+    from snowflake_pool import SnowflakePool
+    from data_sources import SnowflakeSource, SqliteSource
+    from backlog_queries import refresh_backlog, fetch_backlog, fetch_history, fetch_subcodes, run_timed, set_backlog_value, \
+        memory_report, append_backlog_rows, BacklogFilter, covers, apply_filter, carry_over_edits
+    from change_feed import ChangeFeed
+    from reference_data import ReferenceData
+    from queue_scheduler import QueueScheduler, priority_from_config
+    from member_history import MemberHistoryCache
+    from filter_index import FilterIndex
+    from api_client import ApiClient, ApiError
+    from backlog_table import TABLE_COLUMNS, LIVE_COLUMNS, QUEUE_ORDER, sort_order, page_count, table_page
 
-    # no longer a refresh page, set flag here
-    ss.refresh_page = False
-        
+    # get the data
+    # a new page no longer clears the cache for everyone - it reads the shared snapshot,
+    # which refreshes itself once it is older than the ttl
+    metrics_export()
+    snapshot_start = time.perf_counter()
+    session_filter = backlog_filter()
+    snapshot = backlog_snapshot().get(session_filter)
+    log_latency('snapshot', snapshot_start)
+    backlog_df = snapshot.data
+    reference = reference_data()
+    subcode_df, lang_df = reference.get('subcodes'), reference.get('languages')
 
     # setup the session state
     if 'backlog_df' not in ss:
-        ss['backlog_df'] = backlog_df
-
-    if 'history_df' not in ss:
-        ss['history_df'] = history_df
-
-    if 'subcode_df' not in ss:
-        ss['subcode_df'] = subcode_df
-
-    if 'lang_df' not in ss:
-        ss['lang_df'] = lang_df
+        # each session edits its own copy (STATUS, OUTCOME_CODE ...), never the shared snapshot
+        ss['backlog_df'] = backlog_df.copy()
+        ss['snapshot_version'] = snapshot.version
+        ss['snapshot_loaded_at'] = snapshot.loaded_at
+        ss['backlog_filter'] = session_filter
+        # feed batches polled before the snapshot load started are already in it (or closed since)
+        ss['feed_version'] = change_feed().version_at(snapshot.started_at)
+    elif ss.backlog_filter != session_filter:
+        # another date range: switch to that result set, keeping what this session did to the rows in both
+        ss.backlog_df = carry_over_edits(backlog_df.copy(), ss.backlog_df, LIVE_COLUMNS)
+        ss.snapshot_version = snapshot.version
+        ss.snapshot_loaded_at = snapshot.loaded_at
+        ss.backlog_filter = session_filter
+        ss.feed_version = change_feed().version_at(snapshot.started_at)
+
+    # shared and never edited, so every rerun takes the latest reference data
+    ss['subcode_df'] = subcode_df
+    ss['lang_df'] = lang_df
 
     if 'client_code_filt' not in ss:
         ss['client_code_filt'] = None # 'All'
@@ -457,7 +1022,7 @@ else:
         ss['lang_filt'] = None # 'All'
 
     if 'time_filt' not in ss:
-        ss['time_filt'] = min(ss.backlog_df.CREATED_DATE)
+        ss['time_filt'] = session_filter.created_after
 
     if 'tp_filt' not in ss:
         ss['tp_filt'] = None 
@@ -492,28 +1057,66 @@ else:
     if 'case_closed' not in ss:
         ss['case_closed'] = False
 
+    if 'case_submitted' not in ss:
+        ss['case_submitted'] = False
+
     if 'message_sent' not in ss:
         ss['message_sent'] = False
 
+    if 'sent_keys' not in ss:
+        ss['sent_keys'] = {}
+
+    if 'outbox_pending' not in ss:
+        ss['outbox_pending'] = set()
+
+    # pick up send/close results from the outbox
+    failed = reconcile_outbox()
+    if len(failed) > 0:
+        st.warning(f'{len(failed)} queued send/close call(s) failed, see STATUS = Failed in the backlog. '
+                   'A failed send may still have reached the member, check before retrying')
+        if st.button('Retry failed sends/closes'):
+            for tph in failed:
+                # a failed job gave its message back, hold it again unless someone else has it now
+                if len(work_claims().queue(ss.auth, [tph])) == 1:
+                    outbox().retry(tph)
+                else:
+                    st.warning(f'Touchpoint {tph} was picked up by another agent, it was not retried')
+
     # Start the build
 
-    st.image('SameSky Health Logo Horizontal RGB.png', width = 350)
+    st.image(logo(), width = 350)
     st.title('Inbound SMS Case Queue :iphone:') 
     st.header('SMS Backlog', divider='rainbow')  
 
+    # pull the latest messages for this agent without evicting anyone else's data
+    if st.button('Refresh backlog'):
+        snapshot = backlog_snapshot().get(session_filter, force = True)
+        ss.backlog_df = snapshot.data.copy()
+        ss.snapshot_version = snapshot.version
+        ss.snapshot_loaded_at = snapshot.loaded_at
+        ss.feed_version = change_feed().version_at(snapshot.started_at)
+        ss.start_checkbox = False
+    # the snapshot this session's rows came from, newer shared snapshots only show up after a refresh
+    st.caption(f'Backlog as of {ss.snapshot_loaded_at:%Y-%m-%d %H:%M:%S}')
+
+    # messages that came in since then go on the end of the queue
+    merge_new_messages()
+    new_messages_notice()
+
+    # the option lists and df_toshow come from an index built once per snapshot (and change feed version)
+    filter_start = time.perf_counter()
+    fidx = filter_index(ss.snapshot_version, ss.feed_version, len(ss.backlog_df), ss.backlog_df)
+
     filt1, filt2, filt3, filt4, filt5 = st.columns(5)
     with filt1: 
-        cc_tmp =  st.selectbox('Client',['All']+ list(ss.backlog_df.CLIENT.unique()))
+        cc_tmp =  st.selectbox('Client',['All']+ fidx.options('CLIENT'))
         if (ss.client_code_filt != None) and (ss.client_code_filt != cc_tmp):
             ss.start_checkbox = False
         ss.client_code_filt = cc_tmp
 
     with filt2:
         # dynamically filter the program codes based on the client selected 
-        if ss.client_code_filt == 'All':
-            programs_touse = list(ss.backlog_df.PROGRAM.unique())
-        else:
-            programs_touse = list(ss.backlog_df.PROGRAM[ss.backlog_df.CLIENT == ss.client_code_filt].unique())
+        programs_touse = fidx.options('PROGRAM', CLIENT = ss.client_code_filt)
 
         program_tmp = st.selectbox('Program', ['All'] + programs_touse)
 
@@ -525,14 +1128,7 @@ else:
     with filt3:
         # filter by touchpoint_name
         # filter by selected client and program
-        if (ss.client_code_filt == 'All') & (ss.program_code_filt == 'All'):
-            tps_touse =  list(ss.backlog_df.TOUCHPOINT_NAME.unique())
-        elif (ss.client_code_filt != 'All') & (ss.program_code_filt == 'All'):
-            tps_touse = list(ss.backlog_df.TOUCHPOINT_NAME[ss.backlog_df.CLIENT == ss.client_code_filt].unique())
-        elif  (ss.client_code_filt == 'All') & (ss.program_code_filt != 'All'):
-            tps_touse = list(ss.backlog_df.TOUCHPOINT_NAME[ss.backlog_df.PROGRAM == ss.program_code_filt].unique())
-        else:
-            tps_touse = list(ss.backlog_df.TOUCHPOINT_NAME[(ss.backlog_df.PROGRAM == ss.program_code_filt) & (ss.backlog_df.CLIENT == ss.client_code_filt)].unique())
+        tps_touse = fidx.options('TOUCHPOINT_NAME', CLIENT = ss.client_code_filt, PROGRAM = ss.program_code_filt)
         
         tmp_tp = st.selectbox('Touchpoint Name', ['All'] + tps_touse)
         
@@ -543,75 +1139,53 @@ else:
 
     with filt4:
         # filter available languages
-        tmp_lang = st.selectbox('Language',['All'] + list(ss.backlog_df.LANGUAGE.unique()))
+        tmp_lang = st.selectbox('Language',['All'] + fidx.options('LANGUAGE'))
         if (ss.lang_filt != None) and (ss.lang_filt != tmp_lang):
             ss.start_checkbox = False  
         ss.lang_filt = tmp_lang
         
     with filt5:
-        date_range = st.selectbox('Date Range',['Last Day', 'Last Week','Last Two Weeks']) # ['Last Two Weeks','Last Week','Last Day'])
+        # the backlog is fetched for this window, backlog_filter() reads the selection at the top of the script
+        date_range = st.selectbox('Date Range',['Last Day', 'Last Week','Last Two Weeks'], key = 'date_range') # ['Last Two Weeks','Last Week','Last Day'])
         # map daterange to dates
-        if date_range == 'Last Two Weeks':
-            # tmp_date = datetime.datetime(2023, 9, 1)  ## JUST FOR DEV TESTING
-            tmp_date = datetime.datetime.now() - datetime.timedelta(weeks = 2)
-        elif date_range == 'Last Week':
-            tmp_date = datetime.datetime.now() - datetime.timedelta(weeks = 1)
-        elif date_range == 'Last Day':
-            tmp_date = datetime.datetime.now() - datetime.timedelta(days = 1)
-        ss.time_filt = tmp_date.strftime("%Y-%m-%d")
-
-    # logic for filtering the df
-    if ss.client_code_filt == 'All':
-        client_use = ss.backlog_df.CLIENT.unique()
-    else:
-        client_use = [ss.client_code_filt]
-    if ss.program_code_filt == 'All':
-        program_use = ss.backlog_df.PROGRAM.unique()
-    else:
-        program_use = [ss.program_code_filt]
-    if ss.tp_filt == 'All':
-        tp_use = ss.backlog_df.TOUCHPOINT_NAME.unique()
-    else:
-        tp_use = [ss.tp_filt]
-    if ss.lang_filt == 'All':
-        lang_use = ss.backlog_df.LANGUAGE.unique()
-    else:
-        lang_use = [ss.lang_filt]
-    ss.df_toshow = ss.backlog_df[(ss.backlog_df.CLIENT.isin(client_use)) & 
-                                (ss.backlog_df.PROGRAM.isin(program_use)) & 
-                                (ss.backlog_df.TOUCHPOINT_NAME.isin(tp_use)) & 
-                                (ss.backlog_df.CREATED_DATE > ss.time_filt) &
-                                (ss.backlog_df.LANGUAGE.isin(lang_use))].reset_index()
+        ss.time_filt = date_range_start(date_range)
+
+    # logic for filtering the df - 'All' means no filter on that column
+    ss.df_toshow = fidx.view(ss.backlog_df, created_after = ss.time_filt,
+                             CLIENT = ss.client_code_filt,
+                             PROGRAM = ss.program_code_filt,
+                             TOUCHPOINT_NAME = ss.tp_filt,
+                             LANGUAGE = ss.lang_filt)
+    log_latency('filters', filter_start)
 
-    # print the backlog dataframe
-    st.dataframe(ss.df_toshow[['MEMBER_ID','STATUS','CHG_RESPONSE','CLIENT','PROGRAM','TOUCHPOINT_NAME','BODY','MESSAGE_SENT','CREATED_DATE','OUTCOME_CODE','OUTCOME_SUBCODE']], hide_index=True)
+    # print the backlog dataframe, one page at a time
+    backlog_table_panel()
+
+    # close many messages at once (STOP, thanks ...) without going through them one by one
+    if st.checkbox('Bulk close w/ NO response', key = 'bulk_mode'):
+        bulk_close_panel()
 
     # some logic that if the checkbox to text is unchecked, the queue counting starts over
     if ss.start_button == False:
         ss.sms_idx = 0
         ss.all_done = False 
         ss.case_closed = False
+        ss.case_submitted = False
         ss.message_sent = False
+        # give the message back to the other agents
+        if ss.get('claimed_tph') is not None:
+            work_claims().release(ss.auth, ss.claimed_tph)
+            ss.claimed_tph = None
 
     ss.start_button = st.checkbox('Check to start texting', key = 'start_checkbox')
+    if ss.start_button == True:
+        claim_message()
 
     if (ss.start_button == True) & (ss.all_done == False):
         # now start thte texting
         st.header('Texting', divider = 'rainbow')
         st.write('Texting will start at the stop of the queue shown above')
 
-        # need to put in a check to ensure that messages havent already been responded to
-        if (ss.df_toshow.STATUS.iloc[ss.sms_idx] != None) & (ss.case_closed == False):
-            # first_non_null_index = ss.backlog_df.STATUS.first_valid_index()
-            first_null_index = ss.df_toshow.STATUS.isna().idxmax() if ss.df_toshow.STATUS.isna().any() else 'No New Messages'
-            # if there are none, then you are done
-            if first_null_index == 'No New Messages': 
-                ss.all_done = True
-            else:
-                ss.sms_idx = first_null_index
-
-
-        col1, col2, col3  = st.columns([0.3, 0.5, 0.2])
         tmp_df = ss.df_toshow.iloc[ss.sms_idx]
         
         # do a check to see if the filters are changed. If so, clear the start button
@@ -621,199 +1195,18 @@ else:
         logger.info(f"Updating this touchpoint: {tmp_df.TOUCHPOINT_HISTORY_ID}")
         # quick Fill NA to make display eaiser
         tmp_df.fillna('None', inplace = True)
-        with col1:
-            # calculate the age
-            today = datetime.datetime.today()
-
-            if (tmp_df.MEMBER_DOB == 'None') |  (pd.isnull(tmp_df.MEMBER_DOB)):
-                tmp_df['age'] = 'Unknown'
-            else:
-                tmp_df['age'] = today.year - tmp_df.MEMBER_DOB.year - ((today.month, today.day) < (tmp_df.MEMBER_DOB.month, tmp_df.MEMBER_DOB.day))
-            # tmp_df['age'] = today.year - tmp_df.MEMBER_DOB.year - ((today.month, today.day) < (tmp_df.MEMBER_DOB.month, tmp_df.MEMBER_DOB.day))
-
-            st.write('**Member Name:** ' + tmp_df.ACCOUNT_FIRST_NAME + ' ' + tmp_df.ACCOUNT_LAST_NAME)
-            st.write('**Member ID:** ' + str(tmp_df.MEMBER_ID))
-            st.write('**Member Age:** ' + str(tmp_df.age))
-            message =  '**Message: "' + tmp_df.BODY + '"**'
-            st.write(message) 
-            # additioanl data
-            st.write('**Date Sent:** ' + str(tmp_df.CREATED_DATE))
-            st.write('**Client:** ' + tmp_df.CLIENT)
-            st.write('**Program:** ' + tmp_df.PROGRAM)
-            st.write('**Block Name:** ' + tmp_df.BLOCK_NAME)
-            st.write('**Touchpoint Name:** ' + tmp_df.TOUCHPOINT_NAME)
-            st.write('** Last Outbound Message:** "' + tmp_df.MESSAGE_SENT + '"')
-
-            # st.dataframe(tmp_df[['CLIENT','PROGRAM','BLOCK_NAME','TOUCHPOINT_NAME','CREATED_DATE','MESSAGE_SENT']], hide_index = True) 
-
-        with col2:
-            st.write('Full Touchpoint History')
-            tmp_tph = ss.history_df[ss.history_df.ACCOUNT_CASESAFE_ID == tmp_df.ACCOUNT_CASESAFE_ID]
-            st.table(tmp_tph[['TOUCHPOINT_DATETIME','TOUCHPOINT_TYPE','MESSAGE']].iloc[0:10].reset_index(drop = True)) #, hide_index = True) 
-
-        # colb1, colb2 = st.columns([0.2, 0.8])
-        with col3:
-            st.write('Take Action')
-            ss.next_step = st.selectbox('What do you want to do?', [None,'Close Case w/ NO Response', 'Close Case & Respond'],  key = 'selectbox_next_step')
-
-            escalation_flag =  st.checkbox('Check to view escalations data', key = 'esc_flag')
-                
-        if escalation_flag == True: # then show all the escalations data needed
-            esc_df = tmp_df[['TOUCHPOINT_HISTORY_ID1', 'ACCOUNT_CASESAFE_ID1','CLIENT1','PROGRAM1','MESSAGE_SENT1','CONTENT_CODE1',
-                'TOUCHPOINT_HISTORY_ID','ACCOUNT_CASESAFE_ID','CLIENT','PROGRAM','MESSAGE_SENT','CONTENT_CODE','CREATED_DATE_EST',
-                'CREATED_DATE','ACKNOWLEDGE_STATUS','BODY','ACCOUNT_FIRST_NAME','ACCOUNT_LAST_NAME','PHONE',
-                'BILLING_ADDRESS','COUNTY','MEMBER_DOB','BLOCK_NAME','TOUCHPOINT_NAME','MEMBER_ID','SEX','GENDER','DO_NOT_CONTACT','DO_NOT_TEXT']].to_frame().T
-            st.write('##### Escalations Data')
-            st.write('Hit shift + arrow to highlight and copy')
-            st.dataframe(esc_df, hide_index=True)
-            
-
-            
-
-        if ss.next_step == 'Close Case w/ NO Response':
-            st.header('Close the case with no response needed')  
-            account_updates()
-            # update_apptable()
-            # subcode = st.selectbox('Select the appropriate subcode', ss.subcode_df.OUTCOME_SUBCODE__C.unique())
-
-            # # update the dataframe so that it says message skipped
-            # backlog_idx = tmp_df['index']
-            # ss.backlog_df.loc[backlog_idx, 'STATUS'] = 'No action needed'
-            # ss.backlog_df.loc[backlog_idx, 'OUTCOME_CODE'] = 'Inbound SMS'
-            # ss.backlog_df.loc[backlog_idx, 'OUTCOME_SUBCODE'] = subcode
-            # # ss.df_toshow.loc[ss.sms_idx,'STATUS'] = 'No action needed'
-
-            # ss.df_toshow.STATUS.iloc[ss.sms_idx] = 'No action needed'
-            if (ss.outcome_code == 'Inbound SMS' ) & ((ss.outcome_subcode == None) | (ss.outcome_code == 'Inbound SMS - Wrong Number')):
-                st.warning('Please enter in a subcode to close the case',icon="⚠️")
-
-            if (ss.outcome_subcode != None) | (ss.outcome_code == 'Inbound SMS - Wrong Number'):    
-                logger.info(f"Case updated with no response - outcome code {ss.outcome_code}, outcome subcode {ss.outcome_subcode}")
-                if st.button('Close the case', on_click=update_apptable()):
-                    # st.write('HEY TONY, CLOSE THE CASE!')
-                    # update_apptable()
-                    # account_updates() -- have the table update here
-                    response = case_account_api()
-                    st.write('Case closed')
-                    # st.write('API says: ' + str(response))
-
-
-                if st.button('Go to the next message', on_click=next_sms):
-                    st.rerun()
-
-
-        elif ss.next_step == 'Close Case & Respond':
-            st.header('Response time!')  
-            # call Tony's API to get the list of available repsonses
-
-            member_id = tmp_df.ACCOUNT_CASESAFE_ID
-            responses = sms_api('list',member_id)
-            # put some error handling in here
-            if 'status' in responses.keys():
-                # then we have an error
-                if (responses['status'] == 422) or (responses['status'] == 404):
-                    #DNC
-                    st.write(responses['message'])
-                    # TODO - find out what to do in terms of account updates
-                    ss.api_error = 'do_not_contact'
-                    st.warning('Please close the case without responding')
-                    # if st.button('Go to the next message', on_click=next_sms):
-                    #     st.rerun()          
-            else:
-                ss.api_error = None
-
-
-            if ss.api_error == None:
-            # parse the response json
-                topics = responses['collection']
-                subjects = []
-                message_ids = [] 
-                tp_code = []
-                message_name = []
-                message_source = []
-                for i in np.arange(0, len(topics)):
-                    tmp_dict = topics[i]
-                    # itterate over messages
-                    for mi in np.arange(0, len(tmp_dict['messages'])):
-                        subjects.append(tmp_dict['name'])
-                        message_ids.append(tmp_dict['messages'][mi]['id'])
-                        tp_code.append(tmp_dict['messages'][mi]['touchpoint_code'])
-                        message_name.append(tmp_dict['messages'][mi]['name'])
-                        message_source.append(tmp_dict['messages'][mi]['message_source'])
-                # put into a dataframe
-                response_df = pd.DataFrame({'subjects':subjects, 
-                                            'message_ids':message_ids,
-                                            'touchpoint_code':tp_code,
-                                            'message_name':message_name,
-                                            'message_source':message_source
-                                            })
-                
-
-                # now display subjects -> message name & message source
-                
-                cols1, cols2, cols3 = st.columns(3)
-                with cols1:
-                    subject_touse = st.selectbox('Available Templated Response Subjects:', list(response_df.subjects.unique()), key = 'templated_response_subjects')
-                    msgs_df = response_df[response_df.subjects == subject_touse] 
-                    
-                    msg_name = st.selectbox('Available Message Names', [None] + list(msgs_df.message_name.unique()), key = 'templated_response_names') 
-
-                    if ss.templated_response_names != None:
-                
-                        sub_df = msgs_df[msgs_df.message_name == msg_name]
-                        msg_txt = st.selectbox('Choose the message', list(sub_df.message_source), key = 'templated_messages')
-
-        
-                        ss.response_id = msgs_df.message_ids[(msgs_df.message_name == msg_name) & (msgs_df.message_source == msg_txt)].unique()[0]
-                        ss.response_touse = msgs_df.message_source[msgs_df.message_ids == ss.response_id].unique()[0]
-
-                        if ss.response_touse != None:
-                            st.write('Selected Message: ' + ss.response_touse)
+        member_context_panel(tmp_df)
+        action_panel(tmp_df)
 
-                        if st.checkbox('click to edit response', key = 'edit_box'):
-                            ss.response_touse = st.text_area('Edit Response', ss.response_touse) 
-
-                
-                        with cols2:
-                            account_updates()
-                            if (ss.outcome_code == 'Inbound SMS' ) & ((ss.outcome_subcode == None) | (ss.outcome_code == 'Inbound SMS - Wrong Number')):
-                            # if (ss.outcome_code == 'Inbound SMS' ) & (ss.outcome_subcode == None):
-                                st.warning('Please enter in a subcode to close the case',icon="⚠️")
-
-                        with cols3:
-                            if (ss.response_touse != None) & ((ss.outcome_subcode != None) | (ss.outcome_code == 'Inbound SMS - Wrong Number')):
-                                st.write('Selected Response: ' + ss.response_touse)
-                                if st.button('Click to send the above response and close the case', on_click=update_apptable()):
-                                    logger.info(f"Case updated with a response - outcome code {ss.outcome_code}, outcome subcode {ss.outcome_subcode}, response {ss.response_touse}")
-                                    # call the send API
-                                    # was the message edited? 
-                                    if ss.response_touse != msgs_df.message_source[msgs_df.message_ids == ss.response_id].unique()[0]:
-                                        message_text = ss.response_touse
-                                    else:
-                                        message_text = None
-                                        
-                                    sent_output = sms_api('send', member_id, ss.response_id, message_text)
-                                    update_apptable()
-
-                                    st.write('Message Sent! ' + ss.response_touse + ' :tada:')
-                                    ss.message_sent = True
-
-                                    response_caseaccount = case_account_api()
-                                    st.write('Account updated! ') #  + str(response_caseaccount))
-
-                                if ss.message_sent == True:
-                                    if st.button('Go to the next message', on_click=next_sms):
-                                        st.rerun()
-                                
-
-        elif (ss.start_button == True) & (ss.all_done == True):
-            st.header('You have responded to all the text messages! :heavy_check_mark:')
-            st.balloons()
+    elif (ss.start_button == True) & (ss.all_done == True):
+        st.header('You have responded to all the text messages! :heavy_check_mark:')
+        st.balloons()
     
     # an option to logout
     st.header('Logout', divider='rainbow')
     if st.button("Logout"):
-        # clear the cache and make it rerun the snowflake queries
-        st.cache_data.clear()
+        # the backlog snapshot is shared, so logging out no longer clears it for everyone else
         del st.session_state["auth"]
         del st.session_state["token"]
+
+    log_latency('full rerun', run_start)
@@ -0,0 +1,182 @@
+import hashlib
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+
+class ParsedCatalog:
+    # the `collection` of a list response, indexed for the respond panel:
+    # subject -> message names -> message texts -> template id, all dict lookups
+
+    def __init__(self, collection):
+        self.subjects = []          # in the order the api returns them
+        self.names = {}             # subject -> [message name]
+        self.sources = {}           # (subject, message name) -> [message text]
+        self._message_id = {}       # (subject, message name, message text) -> template id
+        self._source_of = {}        # (subject, template id) -> message text
+        for topic in collection:
+            subject = topic['name']
+            if subject not in self.names:
+                self.subjects.append(subject)
+                self.names[subject] = []
+            for message in topic['messages']:
+                name, source, message_id = message['name'], message['message_source'], message['id']
+                if name not in self.names[subject]:
+                    self.names[subject].append(name)
+                self.sources.setdefault((subject, name), []).append(source)
+                # first one wins, same as taking unique()[0] on the old response_df
+                self._message_id.setdefault((subject, name, source), message_id)
+                self._source_of.setdefault((subject, message_id), source)
+
+    def message_id(self, subject, name, source):
+        return self._message_id[(subject, name, source)]
+
+    def source_of(self, subject, message_id):
+        return self._source_of[(subject, message_id)]
+
+
+def catalog_hash(collection):
+    return hashlib.sha1(json.dumps(collection, sort_keys=True).encode()).hexdigest()
+
+
+# list responses that mean the member cant be texted (do not contact), as opposed to a failed call
+DO_NOT_CONTACT_STATUSES = {404, 422}
+
+
+def is_cacheable(catalog):
+    # a catalog, or the do not contact answer. Anything else (a gateway error page ...) is asked for again next time
+    return isinstance(catalog, dict) and ('collection' in catalog or catalog.get('status') in DO_NOT_CONTACT_STATUSES)
+
+
+class TemplateCatalogCache:
+    # the templated responses (sms api `list` action) per member
+    # loader(member_id) -> the api json. At most max_members catalogs are kept, each for ttl seconds,
+    # and prefetch() loads the next members in the queue in the background.
+    # Each catalog is parsed once when it is loaded; members that get the same catalog share one ParsedCatalog
+    # Only is_cacheable() responses are kept, the rest are returned to the caller once and not stored
+
+    def __init__(self, loader, max_members=200, ttl=900, prefetch_workers=2):
+        self.loader = loader
+        self.max_members = max_members
+        self.ttl = ttl
+        self._entries = OrderedDict()   # member_id -> (loaded_at, catalog, parsed catalog or None)
+        self._parsed = OrderedDict()    # catalog content hash -> ParsedCatalog
+        self._inflight = {}             # member_id -> future
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=prefetch_workers, thread_name_prefix='catalog-prefetch')
+        self._stats = {'hits': 0, 'misses': 0, 'expired': 0, 'evicted': 0, 'loads': 0, 'uncached': 0, 'parses': 0,
+                       'parse_shared': 0}
+
+    def _fresh(self, member_id):
+        # caller holds the lock
+        entry = self._entries.get(member_id)
+        if entry is None:
+            return None
+        if time.monotonic() - entry[0] > self.ttl:
+            del self._entries[member_id]
+            self._stats['expired'] += 1
+            return None
+        self._entries.move_to_end(member_id)
+        return entry
+
+    def _parse(self, catalog):
+        # error responses (status 422/404 ...) have no collection
+        if 'collection' not in catalog:
+            return None
+        key = catalog_hash(catalog['collection'])
+        with self._lock:
+            parsed = self._parsed.get(key)
+            if parsed is not None:
+                self._parsed.move_to_end(key)
+                self._stats['parse_shared'] += 1
+                return parsed
+        parsed = ParsedCatalog(catalog['collection'])
+        with self._lock:
+            self._parsed[key] = parsed
+            self._stats['parses'] += 1
+            while len(self._parsed) > self.max_members:
+                self._parsed.popitem(last=False)
+        return parsed
+
+    def _load(self, member_id):
+        try:
+            catalog = self.loader(member_id)
+            entry = (time.monotonic(), catalog, self._parse(catalog))
+        finally:
+            with self._lock:
+                self._inflight.pop(member_id, None)
+        if not is_cacheable(entry[1]):
+            logger.info(f"Template catalog for {member_id} not cached, the api returned no collection: {str(entry[1])[:200]}")
+            with self._lock:
+                self._stats['uncached'] += 1
+            return entry
+        with self._lock:
+            self._entries[member_id] = entry
+            self._entries.move_to_end(member_id)
+            self._stats['loads'] += 1
+            while len(self._entries) > self.max_members:
+                self._entries.popitem(last=False)
+                self._stats['evicted'] += 1
+        return entry
+
+    def _entry(self, member_id):
+        with self._lock:
+            entry = self._fresh(member_id)
+            if entry is not None:
+                self._stats['hits'] += 1
+                return entry
+            self._stats['misses'] += 1
+            future = self._inflight.get(member_id)
+        if future is not None:
+            try:
+                return future.result()
+            except Exception:
+                pass  # the prefetch failed, try again below
+        return self._load(member_id)
+
+    def get(self, member_id):
+        # the raw list response for this member
+        return self._entry(member_id)[1]
+
+    def parsed(self, member_id):
+        # the ParsedCatalog for this member, None if the api returned an error instead of a collection
+        return self._entry(member_id)[2]
+
+    def lookup(self, member_id):
+        # (raw list response, ParsedCatalog or None) from one load, so the two always agree
+        _, catalog, parsed = self._entry(member_id)
+        return catalog, parsed
+
+    def prefetch(self, member_ids):
+        for member_id in dict.fromkeys(member_ids):
+            with self._lock:
+                if self._fresh(member_id) is not None or member_id in self._inflight:
+                    continue
+                future = self._executor.submit(self._load, member_id)
+                self._inflight[member_id] = future
+            future.add_done_callback(_log_prefetch_error)
+
+    def invalidate(self, member_id=None):
+        with self._lock:
+            if member_id is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(member_id, None)
+
+    def stats(self):
+        with self._lock:
+            out = dict(self._stats)
+            out['cached_members'] = len(self._entries)
+            out['parsed_catalogs'] = len(self._parsed)
+            out['inflight'] = len(self._inflight)
+        return out
+
+
+def _log_prefetch_error(future):
+    if future.exception() is not None:
+        logger.info(f"Template catalog prefetch failed: {future.exception()}")
@@ -0,0 +1,51 @@
+# ApiClient against the local stub api server (benchmarks/synthetic.py)
+import pytest
+
+from api_client import ApiClient, ApiError
+from benchmarks.synthetic import StubApiServer, catalog
+
+
+@pytest.fixture
+def stub():
+    server = StubApiServer({'catalog': catalog(2, 2)})
+    yield server
+    server.stop()
+
+
+@pytest.fixture
+def client(stub):
+    client = ApiClient('test', {'sms': {'url': stub.url('sms'), 'read_timeout': 0.5},
+                                'case_close': {'url': stub.url('case_close'), 'read_timeout': 0.5}},
+                       max_retries=2, backoff=0)
+    yield client
+    client.close()
+
+
+def test_list_retries_a_503(stub, client):
+    stub.fail_next('sms', status=503)
+    response = client.post('sms', {'action': 'list', 'member_id': 'm1'}, idempotent=True)
+    assert len(response['collection']) == 2
+    assert stub.requests == [('sms', 'list'), ('sms', 'list')]
+    assert client.stats()['sms']['retries'] == 1
+
+
+def test_list_gives_up_after_max_retries(stub, client):
+    stub.fail_next('sms', status=503, times=3)
+    with pytest.raises(ApiError):
+        client.post('sms', {'action': 'list', 'member_id': 'm1'}, idempotent=True)
+    assert len(stub.requests) == 3
+
+
+def test_send_is_not_retried(stub, client):
+    stub.fail_next('sms', status=503)
+    with pytest.raises(ApiError):
+        client.post('sms', {'action': 'send', 'member_id': 'm1', 'message_id': '1'})
+    assert stub.requests == [('sms', 'send')]
+    assert client.stats()['sms']['retries'] == 0
+
+
+def test_read_timeout_raises_api_error(stub, client):
+    stub.fail_next('case_close', delay=1.5)
+    with pytest.raises(ApiError, match='case_close'):
+        client.post('case_close', {'case': 'c1'})
+    assert client.stats()['case_close']['errors'] == 1
@@ -0,0 +1,27 @@
+import glob
+import json
+import logging
+
+from app_logging import JsonFormatter, RotatingLogFile
+
+
+def test_size_rollovers_keep_the_newest_backups(tmp_path):
+    path = str(tmp_path / 'app.log')
+    handler = RotatingLogFile(path, max_bytes=2000, backup_count=3)
+    handler.setFormatter(JsonFormatter())
+    logger = logging.getLogger('test_rotation')
+    logger.propagate = False
+    logger.addHandler(handler)
+    try:
+        for i in range(400):
+            logger.warning(f'record {i}')
+    finally:
+        logger.removeHandler(handler)
+        handler.close()
+
+    backups = glob.glob(path + '.*')
+    assert len(backups) == 3
+    kept = sorted(int(json.loads(line)['message'].split()[1])
+                  for name in backups + [path] for line in open(name))
+    # the current file and the three newest backups, with nothing missing in between
+    assert kept == list(range(kept[0], 400))
@@ -0,0 +1,127 @@
+import datetime
+import sqlite3
+
+import pandas as pd
+import pytest
+
+from backlog_queries import (BacklogFilter, apply_filter, backlog_query, carry_over_edits, covers, fetch_backlog,
+                             merge_backlog_delta, refresh_backlog, set_backlog_value)
+from benchmarks.synthetic import backlog_frame
+from data_sources import SqliteSource
+
+NOW = datetime.datetime(2024, 3, 1, 12, 0)
+TWO_WEEKS = '2024-02-16'
+LAST_WEEK = '2024-02-23'
+LAST_DAY = '2024-02-29'
+
+
+@pytest.fixture(scope='module')
+def source(tmp_path_factory):
+    source = SqliteSource(str(tmp_path_factory.mktemp('source') / 'source.sqlite3'))
+    source.seed(backlog_frame(400, 60, days=14, now=NOW))
+    return source
+
+
+def test_backlog_query_binds_the_filter_predicates():
+    sql, params = backlog_query(datetime.datetime(2024, 2, 29, 8, 30),
+                                BacklogFilter(LAST_DAY, client='ACME', language='Spanish'))
+    assert "sms.sms_data:metadata.client_code::string = %(client)s" in sql
+    assert "sms.sms_data:payload:language::string = %(language)s" in sql
+    assert 'program_code::string =' not in sql and '{filters}' not in sql
+    # the query has the language code, and the date window is passed on its own
+    assert params == {'created_after': '2024-02-29 08:30:00.000000', 'client': 'ACME', 'language': 'es-419'}
+
+
+def test_backlog_query_without_a_filter():
+    sql, params = backlog_query(LAST_DAY)
+    assert '{filters}' not in sql
+    assert params == {'created_after': LAST_DAY}
+
+
+@pytest.mark.parametrize('wide, narrow, expected', [
+    (BacklogFilter(TWO_WEEKS), BacklogFilter(LAST_DAY), True),
+    (BacklogFilter(LAST_DAY), BacklogFilter(TWO_WEEKS), False),
+    (BacklogFilter(TWO_WEEKS), BacklogFilter(LAST_WEEK, client='ACME'), True),
+    (BacklogFilter(TWO_WEEKS, client='ACME'), BacklogFilter(LAST_WEEK), False),
+    (BacklogFilter(TWO_WEEKS, client='ACME'), BacklogFilter(LAST_WEEK, client='BETA'), False),
+    (BacklogFilter(TWO_WEEKS, client='ACME'), BacklogFilter(LAST_WEEK, client='ACME', program='P1'), True),
+    (BacklogFilter(None), BacklogFilter(TWO_WEEKS), True),
+    (BacklogFilter(TWO_WEEKS), BacklogFilter(None), False),
+])
+def test_covers(wide, narrow, expected):
+    assert covers(wide, narrow) == expected
+
+
+@pytest.mark.parametrize('narrow', [
+    BacklogFilter(LAST_DAY),
+    BacklogFilter(LAST_WEEK, client='ACME'),
+    BacklogFilter(TWO_WEEKS, program='P2', touchpoint_name='Survey'),
+    BacklogFilter(LAST_WEEK, language='Spanish'),
+])
+def test_slicing_a_wide_window_matches_querying_the_narrow_one(source, narrow):
+    wide = fetch_backlog(source, TWO_WEEKS)
+    assert covers(BacklogFilter(TWO_WEEKS), narrow)
+    sliced = apply_filter(wide, narrow)
+    queried = fetch_backlog(source, narrow.created_after, narrow)
+    assert len(queried) > 0
+    assert sliced.TOUCHPOINT_HISTORY_ID.tolist() == queried.TOUCHPOINT_HISTORY_ID.tolist()
+    pd.testing.assert_frame_equal(sliced, queried, check_categorical=False)
+
+
+def test_carry_over_edits_to_the_same_rows_of_another_window(source):
+    wide = fetch_backlog(source, TWO_WEEKS)
+    narrow = fetch_backlog(source, LAST_WEEK)
+    # one edit on a row in both windows, one on a row only the two week window has
+    in_both = wide.index[wide.TOUCHPOINT_HISTORY_ID == narrow.TOUCHPOINT_HISTORY_ID.iloc[3]][0]
+    set_backlog_value(wide, in_both, 'STATUS', 'Response Sent')
+    set_backlog_value(wide, in_both, 'OUTCOME_CODE', 'Inbound SMS')
+    set_backlog_value(wide, 0, 'STATUS', 'Closed No Response')
+    narrow = carry_over_edits(narrow, wide, ['STATUS', 'OUTCOME_CODE', 'OUTCOME_SUBCODE'])
+    edited = narrow[narrow.STATUS.notna()]
+    assert edited.index.tolist() == [3]
+    assert edited.iloc[0][['STATUS', 'OUTCOME_CODE']].tolist() == ['Response Sent', 'Inbound SMS']
+    assert pd.isna(edited.iloc[0].OUTCOME_SUBCODE)
+
+
+def test_merge_backlog_delta_drops_closed_cases_and_rows_out_of_the_window(source):
+    backlog_df = fetch_backlog(source, TWO_WEEKS)
+    # the delta repeats the boundary rows at the watermark
+    delta_df = backlog_df.iloc[-2:].copy()
+    delta_df.loc[:, 'TOUCHPOINT_HISTORY_ID'] = [backlog_df.TOUCHPOINT_HISTORY_ID.iloc[-1], 'new0']
+    delta_df.loc[:, 'CASE_ID'] = [backlog_df.CASE_ID.iloc[-1], 'newC0']
+    delta_df.loc[:, 'CREATED_DATE'] = backlog_df.CREATED_DATE.iloc[-1]
+    set_backlog_value(backlog_df, 10, 'STATUS', 'Response Sent')
+    closed = {backlog_df.CASE_ID.iloc[5], backlog_df.CASE_ID.iloc[-3]}
+    window_start = backlog_df.CREATED_DATE.iloc[2]
+
+    merged = merge_backlog_delta(backlog_df, delta_df, closed, window_start)
+    kept = backlog_df.iloc[2:].loc[~backlog_df.CASE_ID.isin(closed)]
+    assert merged.TOUCHPOINT_HISTORY_ID.tolist() == kept.TOUCHPOINT_HISTORY_ID.tolist() + ['new0']
+    assert merged.TOUCHPOINT_HISTORY_ID.is_unique
+    assert not merged.CASE_ID.isin(closed).any()
+    assert merged.STATUS.eq('Response Sent').sum() == 1
+    assert merged.CREATED_DATE.is_monotonic_increasing
+
+
+def test_delta_refresh_matches_a_full_refresh(tmp_path):
+    source = SqliteSource(str(tmp_path / 'source.sqlite3'))
+    source.seed(backlog_frame(300, 40, days=14, now=NOW))
+    backlog_df = refresh_backlog(source, None, TWO_WEEKS)
+    last_refresh = NOW
+
+    # new messages, a case closed since the last refresh, and the window moved up a day
+    arrived = backlog_frame(20, 40, days=0.01, seed=1, now=NOW + datetime.timedelta(hours=1))
+    arrived['TOUCHPOINT_HISTORY_ID'] = [f'new{i}' for i in range(len(arrived))]
+    arrived['CASE_ID'] = [f'newC{i}' for i in range(len(arrived))]
+    source.seed(arrived)
+    with sqlite3.connect(source.path) as db:
+        db.execute('update "case" set status = ?, lastmodifieddate = ? where id = ?',
+                   ('Closed', '2024-03-01 12:30:00.000000', backlog_df.CASE_ID.iloc[-1]))
+    window_start = '2024-02-17'
+
+    refreshed = refresh_backlog(source, backlog_df, window_start, changed_since=last_refresh)
+    full = refresh_backlog(source, None, window_start)
+    assert refreshed.TOUCHPOINT_HISTORY_ID.tolist() == full.TOUCHPOINT_HISTORY_ID.tolist()
+    assert refreshed.CREATED_DATE.min() >= pd.Timestamp(window_start)
+    assert backlog_df.TOUCHPOINT_HISTORY_ID.iloc[-1] not in refreshed.TOUCHPOINT_HISTORY_ID.tolist()
+    assert refreshed.TOUCHPOINT_HISTORY_ID.str.startswith('new').sum() == 20
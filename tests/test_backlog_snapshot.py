@@ -0,0 +1,143 @@
+import threading
+import time
+
+import pytest
+
+from backlog_snapshot import SnapshotCache, SnapshotService
+
+
+class Loader:
+    # counts loads; while gate is cleared a load waits on it, fail makes the next load raise
+    def __init__(self):
+        self.calls = 0
+        self.gate = threading.Event()
+        self.gate.set()
+        self.fail = False
+
+    def __call__(self):
+        self.calls += 1
+        self.gate.wait(5)
+        if self.fail:
+            raise RuntimeError('snowflake is down')
+        return f'data {self.calls}'
+
+
+def wait_until(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+
+def test_sessions_starting_together_share_one_load():
+    loader = Loader()
+    loader.gate.clear()
+    service = SnapshotService(loader)
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(service.get())) for _ in range(5)]
+    for thread in threads:
+        thread.start()
+    wait_until(lambda: loader.calls == 1)
+    loader.gate.set()
+    for thread in threads:
+        thread.join()
+    assert loader.calls == 1
+    assert {(snapshot.data, snapshot.version) for snapshot in results} == {('data 1', 1)}
+
+
+def test_stale_snapshot_is_served_while_one_refresh_runs():
+    loader = Loader()
+    service = SnapshotService(loader, ttl=0)
+    first = service.get()
+    loader.gate.clear()
+    time.sleep(0.01)
+    # both get the old snapshot right away, only one refresh starts
+    assert service.get() is first
+    assert service.get() is first
+    loader.gate.set()
+    wait_until(lambda: service.version() == 2)
+    assert loader.calls == 2
+    assert service.get().data == 'data 2'
+
+
+def test_force_waits_for_a_fresh_load_and_keeps_the_old_one_if_it_fails():
+    loader = Loader()
+    service = SnapshotService(loader, ttl=300)
+    service.get()
+    assert service.get(force=True).version == 2
+    loader.fail = True
+    snapshot = service.get(force=True)
+    assert (snapshot.data, snapshot.version) == ('data 2', 2)
+    assert service.fresh() is snapshot
+
+
+def test_first_load_failure_is_raised():
+    loader = Loader()
+    loader.fail = True
+    service = SnapshotService(loader)
+    with pytest.raises(RuntimeError, match='down'):
+        service.get()
+    loader.fail = False
+    assert service.get().version == 1
+
+
+def cache_loader():
+    # keys are window starts (ints): a wider window is a smaller number, its data every day from the start
+    calls = []
+
+    def loader(key, state):
+        calls.append(key)
+        state['loads'] = state.get('loads', 0) + 1
+        return list(range(key, 10)), state['loads']
+    return loader, calls
+
+
+def cache(loader, **kwargs):
+    return SnapshotCache(loader, covers=lambda wide, narrow: wide <= narrow,
+                         narrow=lambda data, key: ([day for day in data[0] if day >= key], data[1]), **kwargs)
+
+
+def test_narrow_window_is_sliced_from_a_fresh_wide_one():
+    loader, calls = cache_loader()
+    snapshots = cache(loader, ttl=300)
+    assert snapshots.get(2).version == (2, 1)
+    sliced = snapshots.get(7)
+    assert sliced.data == ([7, 8, 9], 1)
+    assert sliced.version == (7, 2, 1)
+    assert snapshots.get(7) is sliced
+    assert calls == [2]
+    # a wider window than anything loaded has to be queried
+    assert snapshots.get(0).data == (list(range(10)), 1)
+    assert calls == [2, 0]
+
+
+def test_stale_wide_window_is_not_sliced():
+    loader, calls = cache_loader()
+    snapshots = cache(loader, ttl=0)
+    snapshots.get(2)
+    time.sleep(0.01)
+    assert snapshots.get(7).data == ([7, 8, 9], 1)
+    assert calls == [2, 7]
+
+
+def test_least_recently_used_window_is_evicted():
+    loader, calls = cache_loader()
+    snapshots = cache(loader, ttl=300, max_entries=2)
+    snapshots.get(5)
+    snapshots.get(3)
+    snapshots.get(5)
+    # 3 is the least recently used now, loading 1 evicts it
+    snapshots.get(1)
+    snapshots.get(5)
+    assert calls == [5, 3, 1]
+    assert snapshots.get(3, force=True).version == (3, 1)
+    assert calls == [5, 3, 1, 3]
+
+
+def test_loader_state_is_kept_per_window():
+    loader, _ = cache_loader()
+    snapshots = cache(loader, ttl=300)
+    snapshots.get(4)
+    snapshots.get(4, force=True)
+    assert snapshots.get(4).data[1] == 2
+    assert snapshots.get(0).data[1] == 1
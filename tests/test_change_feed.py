@@ -0,0 +1,99 @@
+import datetime
+import time
+
+import pandas as pd
+
+from backlog_queries import append_backlog_rows, set_backlog_value
+from benchmarks.synthetic import backlog_frame
+from change_feed import ChangeFeed, LocalTableSource
+
+NOW = datetime.datetime(2024, 3, 1, 12, 0)
+
+
+def new_rows(rows, prefix, now):
+    # rows created after the seeded table, with ids of their own
+    frame = backlog_frame(rows, 5, days=0.001, seed=1, now=now)
+    frame['TOUCHPOINT_HISTORY_ID'] = [f'{prefix}{i}' for i in range(rows)]
+    frame['CASE_ID'] = [f'{prefix}C{i}' for i in range(rows)]
+    return frame
+
+
+def polled_feed(table):
+    source = LocalTableSource(table)
+    backlog_df = source(NOW - datetime.timedelta(days=2))
+    feed = ChangeFeed(source)
+    # no background thread, the test polls
+    feed.stop()
+    feed.start(backlog_df)
+    return source, feed, backlog_df
+
+
+def test_poll_returns_rows_past_the_watermark_once():
+    table = backlog_frame(20, 5, days=1, now=NOW)
+    source, feed, backlog_df = polled_feed(table)
+    assert feed.poll() == 0
+
+    arrived = new_rows(3, 'new', NOW + datetime.timedelta(minutes=5))
+    # same created_dt as the newest seeded row: only the boundary ids already seen are skipped
+    tied = new_rows(1, 'tied', NOW)
+    tied['CREATED_DATE'] = table.CREATED_DATE.max()
+    source.append(pd.concat([arrived, tied], ignore_index=True))
+    assert feed.poll() == 4
+
+    rows, version = feed.rows_since(0)
+    assert version == 1
+    assert sorted(rows.TOUCHPOINT_HISTORY_ID) == ['new0', 'new1', 'new2', 'tied0']
+    assert feed.rows_since(version) == (None, 1)
+    # the rows at the new watermark are not returned again
+    assert feed.poll() == 0
+    assert feed.pending(0) == 4
+    assert len(append_backlog_rows(backlog_df, rows)) == 24
+
+
+def test_snapshot_loaded_after_a_poll_skips_that_batch():
+    table = backlog_frame(20, 5, days=1, now=NOW)
+    source, feed, _ = polled_feed(table)
+    source.append(new_rows(2, 'new', NOW + datetime.timedelta(minutes=5)))
+    feed.poll()
+
+    # a snapshot started after the poll has the batch, or no longer has a case closed since
+    started_at = datetime.datetime.now()
+    assert feed.version_at(started_at) == 1
+    assert feed.rows_since(feed.version_at(started_at)) == (None, 1)
+
+    source.append(new_rows(1, 'later', NOW + datetime.timedelta(minutes=10)))
+    feed.poll()
+    assert feed.version_at(started_at) == 1
+    rows, version = feed.rows_since(feed.version_at(started_at))
+    assert list(rows.TOUCHPOINT_HISTORY_ID) == ['later0']
+    assert version == 2
+
+
+def test_merged_rows_go_on_the_end_and_keep_the_session_edits():
+    table = backlog_frame(5, 5, days=1, now=NOW)
+    source, feed, backlog_df = polled_feed(table)
+    set_backlog_value(backlog_df, 4, 'STATUS', 'Response Sent')
+    source.append(new_rows(2, 'new', NOW + datetime.timedelta(minutes=5)))
+    feed.poll()
+    rows, _ = feed.rows_since(0)
+    # a row the session already has (a batch polled while its snapshot loaded) is not added twice
+    rows = pd.concat([source(NOW - datetime.timedelta(days=2)).iloc[[4]], rows], ignore_index=True)
+    merged = append_backlog_rows(backlog_df, rows)
+    assert merged.TOUCHPOINT_HISTORY_ID.tolist() == table.TOUCHPOINT_HISTORY_ID.tolist() + ['new0', 'new1']
+    assert merged.STATUS.iloc[4] == 'Response Sent'
+    assert merged.STATUS.iloc[5:].isna().all()
+    assert merged.LANGUAGE.isin(['English', 'Spanish', 'Arabic']).all()
+
+
+def test_batches_older_than_the_retention_are_dropped():
+    source, feed, _ = polled_feed(backlog_frame(5, 5, days=1, now=NOW))
+    feed.retention = 0.05
+    source.append(new_rows(1, 'first', NOW + datetime.timedelta(minutes=5)))
+    feed.poll()
+    time.sleep(0.1)
+    source.append(new_rows(1, 'second', NOW + datetime.timedelta(minutes=10)))
+    feed.poll()
+    rows, version = feed.rows_since(0)
+    assert version == 2
+    assert rows.TOUCHPOINT_HISTORY_ID.tolist() == ['second0']
+    assert feed.pending(0) == 1
@@ -0,0 +1,107 @@
+import datetime
+import sqlite3
+
+import pandas as pd
+import pytest
+
+import data_sources
+from backlog_queries import BacklogFilter
+from benchmarks.synthetic import backlog_frame, history_frame, member_ids
+from data_sources import SqliteSource
+
+NOW = datetime.datetime(2024, 3, 1, 12, 0)
+ACCOUNT_COLUMNS = ['ACCOUNT_FIRST_NAME', 'ACCOUNT_LAST_NAME', 'BILLING_ADDRESS', 'COUNTY', 'MEMBER_DOB', 'MEMBER_ID',
+                   'SEX', 'GENDER', 'DO_NOT_CONTACT', 'DO_NOT_TEXT']
+
+
+def fixture_backlog(rows=40, members=8):
+    backlog_df = backlog_frame(rows, members, days=3, now=NOW)
+    # the account columns come from one account row, so every message of a member has the same ones
+    backlog_df.loc[backlog_df.ACCOUNT_CASESAFE_ID == backlog_df.ACCOUNT_CASESAFE_ID[0], 'DO_NOT_TEXT'] = True
+    backlog_df.loc[[1, 2], 'ACKNOWLEDGE_STATUS'] = True
+    backlog_df.loc[3, 'PROGRAM'] = None
+    backlog_df[ACCOUNT_COLUMNS] = backlog_df.groupby('ACCOUNT_CASESAFE_ID')[ACCOUNT_COLUMNS].transform('first')
+    # sms_data keeps microseconds
+    backlog_df['CREATED_DATE'] = backlog_df.CREATED_DATE.dt.floor('us')
+    return backlog_df
+
+
+@pytest.fixture
+def source(tmp_path):
+    return SqliteSource(str(tmp_path / 'source.sqlite3'))
+
+
+def test_seeded_rows_come_back_as_the_backlog_query_returns_them(source):
+    seeded = fixture_backlog()
+    source.seed(seeded)
+    backlog_df = source.backlog(NOW - datetime.timedelta(days=7))
+    assert list(backlog_df.columns) == list(seeded.columns)
+    # the json paths in sms_data and the joined tables land in the same columns
+    same = [col for col in seeded.columns if col not in ('CREATED_DATE_EST', 'BILLING_ADDRESS', 'MEMBER_DOB')]
+    pd.testing.assert_frame_equal(backlog_df[same], seeded[same], check_dtype=False)
+    assert (backlog_df.BILLING_ADDRESS.str.strip() == seeded.BILLING_ADDRESS).all()
+    assert (backlog_df.MEMBER_DOB == seeded.MEMBER_DOB).all()
+
+    # the types the snowflake connector returns: timestamps, and python bools (not 0/1) for the flags
+    assert str(backlog_df.CREATED_DATE.dtype) == 'datetime64[ns]'
+    assert backlog_df.CREATED_DATE.is_monotonic_increasing
+    assert backlog_df.CREATED_DATE_EST[0] == backlog_df.CREATED_DATE[0] - pd.Timedelta(hours=5)
+    for col in ['ACKNOWLEDGE_STATUS', 'DO_NOT_CONTACT', 'DO_NOT_TEXT']:
+        assert {type(value) for value in backlog_df[col]} == {bool}
+    assert backlog_df.ACKNOWLEDGE_STATUS.sum() == 2
+    assert backlog_df.PROGRAM.isna().sum() == 1
+
+
+def test_backlog_leaves_out_closed_cases_test_accounts_and_older_rows(source):
+    seeded = fixture_backlog()
+    source.seed(seeded)
+    closed_at = NOW + datetime.timedelta(minutes=5)
+    with sqlite3.connect(source.path) as db:
+        db.execute('update "case" set status = ?, lastmodifieddate = ? where id = ?',
+                   ('Closed', closed_at.strftime('%Y-%m-%d %H:%M:%S.%f'), seeded.CASE_ID[5]))
+        db.execute('update account set test_account__c = 1 where id = ?', (seeded.ACCOUNT_CASESAFE_ID[0],))
+    expected = seeded[(seeded.index != 5) & (seeded.ACCOUNT_CASESAFE_ID != seeded.ACCOUNT_CASESAFE_ID[0])]
+    assert source.backlog(NOW - datetime.timedelta(days=7)).TOUCHPOINT_HISTORY_ID.tolist() == \
+        expected.TOUCHPOINT_HISTORY_ID.tolist()
+
+    created_after = seeded.CREATED_DATE[20]
+    assert source.backlog(created_after).TOUCHPOINT_HISTORY_ID.tolist() == \
+        expected[expected.CREATED_DATE >= created_after].TOUCHPOINT_HISTORY_ID.tolist()
+
+    assert source.closed_cases(NOW).CASE_ID.tolist() == [seeded.CASE_ID[5]]
+    assert source.closed_cases(closed_at + datetime.timedelta(seconds=1)).empty
+
+
+def test_backlog_filter_is_pushed_into_the_query(source):
+    seeded = fixture_backlog(200, 20)
+    source.seed(seeded)
+    # the filter has the LANG_MAP name, the table the language code
+    backlog_filter = BacklogFilter(None, client='ACME', language='Spanish')
+    expected = seeded[(seeded.CLIENT == 'ACME') & (seeded.LANGUAGE == 'es-419')]
+    assert len(expected) > 0
+    filtered = source.backlog(NOW - datetime.timedelta(days=7), backlog_filter)
+    assert filtered.TOUCHPOINT_HISTORY_ID.tolist() == expected.TOUCHPOINT_HISTORY_ID.tolist()
+
+
+def test_history_is_read_in_chunks_under_the_parameter_limit(source, monkeypatch):
+    monkeypatch.setattr(data_sources, 'SQLITE_MAX_PARAMS', 3)
+    ids = member_ids(8)
+    seeded_history = history_frame(ids, 4)
+    source.seed(fixture_backlog(), seeded_history)
+    before = source.stats()['queries']
+    history_df = source.history(ids[:7])
+    # 7 members at 3 per statement
+    assert source.stats()['queries'] - before == 3
+    expected = seeded_history[seeded_history.ACCOUNT_CASESAFE_ID.isin(ids[:7])].reset_index(drop=True)
+    pd.testing.assert_frame_equal(history_df, expected, check_dtype=False)
+    assert source.history([]).empty
+
+
+def test_subcodes_are_counted_from_the_seeded_history(source):
+    seeded_history = history_frame(member_ids(8), 5)
+    source.seed(fixture_backlog(), seeded_history)
+    subcodes = source.subcodes()
+    counts = seeded_history.groupby(['OUTCOME_CODE', 'OUTCOME_SUBCODE'], dropna=False).size()
+    assert {(code, None if pd.isna(subcode) else subcode, n) for (code, subcode), n in counts.items()} == \
+        set(subcodes.itertuples(index=False, name=None))
+    assert subcodes.N.is_monotonic_decreasing
@@ -0,0 +1,125 @@
+import json
+import sqlite3
+import time
+
+import pytest
+
+import outbox as outbox_module
+from outbox import Outbox
+
+
+class Handlers:
+    # records every call, fails a step for as many calls as it is told to
+    def __init__(self, fail=None):
+        self.calls = []
+        self.fail = dict(fail or {})
+
+    def handler(self, name):
+        def run(payload, idempotency_key):
+            self.calls.append((name, payload))
+            if self.fail.get(name, 0) > 0:
+                self.fail[name] -= 1
+                raise RuntimeError(f'{name} failed')
+        return run
+
+    def handlers(self, *names):
+        return {name: self.handler(name) for name in names}
+
+
+def wait_for(box, tph, states=('done', 'failed'), timeout=5):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        job = box.status([tph]).get(tph)
+        if job is not None and job['state'] in states:
+            return job
+        time.sleep(0.01)
+    raise AssertionError(f'job for {tph} never reached {states}')
+
+
+@pytest.fixture
+def make_outbox(tmp_path):
+    boxes = []
+
+    def make(handlers, **kwargs):
+        kwargs.setdefault('workers', 1)
+        kwargs.setdefault('backoff', 0)
+        kwargs.setdefault('poll_interval', 0.01)
+        box = Outbox(str(tmp_path / 'outbox.sqlite3'), handlers, **kwargs)
+        boxes.append(box)
+        return box
+    yield make
+    for box in boxes:
+        box.stop()
+
+
+def test_retry_resumes_after_the_steps_already_done(make_outbox):
+    calls = Handlers(fail={'case_close': 1})
+    finished = []
+    box = make_outbox(calls.handlers('sms_send', 'case_close'), on_finish=lambda tph, state: finished.append((tph, state)))
+    box.enqueue('k1', [['sms_send', {'n': 1}], ['case_close', {'n': 2}]], touchpoint_history_id='t1', final_status='Response Sent')
+    job = wait_for(box, 't1')
+    assert job['state'] == 'done'
+    assert job['attempts'] == 2
+    # the text went out once, only the case close ran again
+    assert [name for name, _ in calls.calls] == ['sms_send', 'case_close', 'case_close']
+    assert finished == [('t1', 'done')]
+
+
+def test_failed_step_waits_out_the_backoff(make_outbox, monkeypatch):
+    monkeypatch.setattr(outbox_module.random, 'uniform', lambda low, high: high)
+    calls = Handlers(fail={'case_close': 1})
+    box = make_outbox(calls.handlers('case_close'), backoff=30)
+    before = time.time()
+    box.enqueue('k1', [['case_close', {}]], touchpoint_history_id='t1')
+    time.sleep(0.2)
+    job = box.status(['t1'])['t1']
+    assert job['state'] == 'pending'
+    assert calls.calls == [('case_close', {})]
+    with sqlite3.connect(box.path) as db:
+        next_attempt_at = db.execute('select next_attempt_at from outbox_jobs').fetchone()[0]
+    # attempt 1 -> up to backoff * 2 ** 1 seconds
+    assert next_attempt_at >= before + 60
+    assert job['last_error'] == 'case_close failed'
+
+
+def test_job_fails_after_max_attempts_and_retry_runs_it_again(make_outbox):
+    calls = Handlers(fail={'case_close': 3})
+    finished = []
+    box = make_outbox(calls.handlers('case_close'), max_attempts=3, on_finish=lambda tph, state: finished.append(state))
+    box.enqueue('k1', [['case_close', {}]], touchpoint_history_id='t1')
+    job = wait_for(box, 't1')
+    assert job['state'] == 'failed'
+    assert job['attempts'] == 3
+    assert finished == ['failed']
+
+    box.retry('t1')
+    assert wait_for(box, 't1')['state'] == 'done'
+    assert len(calls.calls) == 4
+    assert finished == ['failed', 'done']
+
+
+def test_once_step_is_not_retried(make_outbox):
+    calls = Handlers(fail={'sms_send': 1})
+    box = make_outbox(calls.handlers('sms_send', 'case_close'), once_steps={'sms_send'})
+    box.enqueue('k1', [['sms_send', {}], ['case_close', {}]], touchpoint_history_id='t1')
+    job = wait_for(box, 't1')
+    assert job['state'] == 'failed'
+    assert job['attempts'] == 1
+    assert 'not retried' in job['last_error']
+    assert calls.calls == [('sms_send', {})]
+
+
+def test_only_stale_running_jobs_are_recovered(make_outbox, tmp_path):
+    # jobs another process left running: one still being worked on, two abandoned
+    box = make_outbox({}, workers=0)
+    now = time.time()
+    with sqlite3.connect(box.path) as db:
+        for key, tph, step, updated_at in [('k1', 't1', 'case_close', now), ('k2', 't2', 'case_close', now - 3600),
+                                           ('k3', 't3', 'sms_send', now - 3600)]:
+            db.execute("""insert into outbox_jobs (idempotency_key, touchpoint_history_id, steps, state, created_at, updated_at)
+                          values (?, ?, ?, 'running', ?, ?)""", (key, tph, json.dumps([[step, {}]]), updated_at, updated_at))
+    finished = []
+    box = make_outbox({}, workers=0, once_steps={'sms_send'}, on_finish=lambda tph, state: finished.append((tph, state)))
+    states = {tph: job['state'] for tph, job in box.status(['t1', 't2', 't3']).items()}
+    assert states == {'t1': 'running', 't2': 'pending', 't3': 'failed'}
+    assert finished == [('t3', 'failed')]
@@ -0,0 +1,87 @@
+import datetime
+
+import pandas as pd
+import pytest
+
+from queue_scheduler import QueueScheduler, priority_from_config
+
+NOW = datetime.datetime.now()
+
+
+def view(*rows):
+    # rows: (tph, hours old, client, language, do_not_text), in the view's created_dt order
+    return pd.DataFrame({
+        'STATUS': None,
+        'TOUCHPOINT_HISTORY_ID': [row[0] for row in rows],
+        'CREATED_DATE': [NOW - datetime.timedelta(hours=row[1]) for row in rows],
+        'CLIENT': pd.Categorical([row[2] for row in rows]),
+        'LANGUAGE': [row[3] for row in rows],
+        'DO_NOT_TEXT': [row[4] for row in rows],
+        'DO_NOT_CONTACT': False,
+    })
+
+
+VIEW = view(('t0', 30, 'Acme', 'English', False),
+            ('t1', 20, 'Beta', 'Spanish', True),
+            ('t2', 10, 'Beta', 'English', False),
+            ('t3', 2, 'Acme', 'Spanish', None))
+
+
+def order(scheduler):
+    out = []
+    while (tph := scheduler.next_open()) is not None:
+        out.append(tph)
+        scheduler.mark_done(tph)
+    return out
+
+
+@pytest.mark.parametrize('cfg, expected', [
+    ({}, ['t0', 't1', 't2', 't3']),
+    ({'priority': ['do_not_text']}, ['t0', 't2', 't3', 't1']),
+    ({'priority': ['client'], 'clients': ['Beta']}, ['t1', 't2', 't0', 't3']),
+    ({'priority': ['language'], 'languages': ['Spanish']}, ['t1', 't3', 't0', 't2']),
+    ({'priority': ['client', 'do_not_text'], 'clients': ['Beta']}, ['t2', 't1', 't0', 't3']),
+    ({'priority': ['do_not_text', 'language'], 'languages': ['Spanish']}, ['t3', 't0', 't2', 't1']),
+])
+def test_priority_order(cfg, expected):
+    assert order(QueueScheduler(VIEW, priority_from_config(cfg))) == expected
+
+
+def test_sla_puts_breached_messages_first():
+    newest_first = view(('t0', 1, 'Acme', 'English', False), ('t1', 30, 'Acme', 'English', False),
+                        ('t2', 2, 'Acme', 'English', False), ('t3', 40, 'Acme', 'English', False))
+    assert order(QueueScheduler(newest_first, priority_from_config({'priority': ['sla'], 'sla_hours': 24}))) == \
+        ['t1', 't3', 't0', 't2']
+
+
+def test_unknown_priority_is_rejected():
+    with pytest.raises(ValueError, match='fastest'):
+        priority_from_config({'priority': ['sla', 'fastest']})
+
+
+def test_closed_rows_are_left_out():
+    closed = VIEW.copy()
+    closed.loc[1, 'STATUS'] = 'Response Sent'
+    scheduler = QueueScheduler(closed)
+    assert len(scheduler) == 3
+    assert scheduler.position('t1') is None
+    assert order(scheduler) == ['t0', 't2', 't3']
+
+
+def test_skip_leaves_the_queue_as_it_was():
+    scheduler = QueueScheduler(VIEW)
+    assert scheduler.next_open(skip={'t0', 't1'}) == 't2'
+    assert scheduler.upcoming(2, skip={'t1'}) == [0, 2]
+    assert scheduler.next_open() == 't0'
+    assert len(scheduler) == 4
+
+
+def test_mark_done_takes_a_string_or_a_list():
+    scheduler = QueueScheduler(VIEW)
+    scheduler.mark_done('t0')
+    scheduler.mark_done(['t2', 'not-in-view'])
+    scheduler.mark_done({'t1'})
+    assert len(scheduler) == 1
+    assert scheduler.next_open() == 't3'
+    assert scheduler.position('t3') == 3
+    assert scheduler.upcoming(3) == [3]
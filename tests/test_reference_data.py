@@ -0,0 +1,94 @@
+import sqlite3
+import threading
+
+import pandas as pd
+import pytest
+
+from reference_data import ReferenceData
+
+
+class Loader:
+    # returns whatever frame it is set to, counting the calls; frame None -> the query fails
+    def __init__(self, frame):
+        self.frame = frame
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        if self.frame is None:
+            raise RuntimeError('snowflake is down')
+        return self.frame
+
+
+def langs(*names):
+    return pd.DataFrame({'Lang': list(names)})
+
+
+def test_tables_on_disk_are_read_at_start_without_a_query(tmp_path):
+    path = str(tmp_path / 'reference.sqlite3')
+    first = Loader(langs('English', 'Spanish'))
+    assert ReferenceData(path, {'languages': first}).get('languages').Lang.tolist() == ['English', 'Spanish']
+    assert first.calls == 1
+
+    # a restart (or another process): the file has it, even once it is stale
+    restarted = Loader(None)
+    reference = ReferenceData(path, {'languages': restarted}, ttl=0)
+    assert reference.get('languages').Lang.tolist() == ['English', 'Spanish']
+    assert reference.version('languages') == 1
+    assert restarted.calls == 0
+
+
+def test_version_goes_up_only_when_the_content_changes(tmp_path):
+    loader = Loader(langs('English'))
+    reference = ReferenceData(str(tmp_path / 'reference.sqlite3'), {'languages': loader})
+    reference.get('languages')
+    assert reference.refresh(force=True) == []
+    assert reference.version('languages') == 1
+
+    loader.frame = langs('English', 'French')
+    assert reference.refresh(force=True) == ['languages']
+    assert reference.version('languages') == 2
+    assert reference.get('languages').Lang.tolist() == ['English', 'French']
+    assert loader.calls == 3
+
+
+def test_failed_reload_keeps_the_old_table(tmp_path):
+    loader = Loader(langs('English'))
+    reference = ReferenceData(str(tmp_path / 'reference.sqlite3'), {'languages': loader})
+    reference.get('languages')
+    loader.frame = None
+    with pytest.raises(RuntimeError):
+        reference.refresh(force=True)
+    assert reference.get('languages').Lang.tolist() == ['English']
+    assert reference.version('languages') == 1
+
+
+def test_fresher_copy_from_another_process_is_picked_up(tmp_path):
+    path = str(tmp_path / 'reference.sqlite3')
+    ReferenceData(path, {'languages': Loader(langs('English'))}).get('languages')
+    # make the copy on disk older than the ttl before both processes start from it
+    with sqlite3.connect(path) as db:
+        db.execute('update reference_tables set fetched_at = fetched_at - 100')
+    ours_loader = Loader(langs('English'))
+    ours = ReferenceData(path, {'languages': ours_loader}, ttl=60)
+    theirs = ReferenceData(path, {'languages': Loader(langs('English', 'German'))}, ttl=60)
+    assert theirs.refresh() == ['languages']
+
+    # our copy is stale, but the file has a fresh one now: take it instead of querying
+    assert ours.refresh() == []
+    assert ours_loader.calls == 0
+    assert ours.get('languages').Lang.tolist() == ['English', 'German']
+    assert ours.version('languages') == 2
+
+
+def test_concurrent_reloads_each_get_their_own_version(tmp_path):
+    path = str(tmp_path / 'reference.sqlite3')
+    ReferenceData(path, {'languages': Loader(langs('English'))}).get('languages')
+    processes = [ReferenceData(path, {'languages': Loader(langs('English', f'Lang {i}'))}) for i in range(8)]
+    threads = [threading.Thread(target=reference.refresh, kwargs={'force': True}) for reference in processes]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    # every load changed the content, so every one of them is a new version
+    assert sorted(reference.version('languages') for reference in processes) == list(range(2, 10))
@@ -0,0 +1,127 @@
+import threading
+import time
+
+import pandas as pd
+import pytest
+from snowflake.connector.errors import DatabaseError
+
+from snowflake_pool import SnowflakePool
+
+
+def session_expired():
+    return DatabaseError(msg='Authentication token has expired', errno=390114)
+
+
+class FakeCursor:
+    sfqid = 'q1'
+
+    def __init__(self, conn):
+        self.conn = conn
+
+    def execute(self, sql, params=None):
+        if self.conn.fail_next is not None:
+            error, self.conn.fail_next = self.conn.fail_next, None
+            raise error
+        return self
+
+    def fetchone(self):
+        return (1,)
+
+    def fetch_pandas_all(self):
+        return pd.DataFrame({'N': [self.conn.number]})
+
+    def close(self):
+        pass
+
+
+class FakeConnection:
+    def __init__(self, number, fail_next=None):
+        self.number = number
+        self.fail_next = fail_next
+        self.closed = False
+
+    def cursor(self):
+        return FakeCursor(self)
+
+    def is_closed(self):
+        return self.closed
+
+    def close(self):
+        self.closed = True
+
+
+class FakeConnect:
+    # connect() for the pool: numbered fake connections, the first ones can be set up to fail a query
+    def __init__(self, failures=()):
+        self.made = []
+        self.failures = list(failures)
+
+    def __call__(self, **params):
+        conn = FakeConnection(len(self.made), self.failures.pop(0) if self.failures else None)
+        self.made.append(conn)
+        return conn
+
+
+def test_pool_grows_up_to_size_and_reuses_connections():
+    connect = FakeConnect()
+    pool = SnowflakePool({}, size=2, checkout_timeout=0.1, connect=connect)
+    with pool.connection() as first, pool.connection() as second:
+        assert first is not second
+        with pytest.raises(TimeoutError):
+            with pool.connection():
+                pass
+    with pool.connection() as again:
+        assert again in (first, second)
+    stats = pool.stats()
+    assert stats['connects'] == 2
+    assert stats['checkout_timeouts'] == 1
+    assert (stats['open'], stats['idle'], stats['in_use']) == (2, 2, 0)
+
+
+def test_dropping_a_broken_connection_wakes_a_waiting_checkout():
+    connect = FakeConnect()
+    pool = SnowflakePool({}, size=1, checkout_timeout=5, connect=connect)
+    holding = threading.Event()
+    got = {}
+
+    def hold_and_break():
+        with pytest.raises(DatabaseError):
+            with pool.connection():
+                holding.set()
+                time.sleep(0.2)
+                raise session_expired()
+
+    def wait_for_one():
+        holding.wait()
+        start = time.monotonic()
+        with pool.connection() as conn:
+            got['conn'], got['waited'] = conn, time.monotonic() - start
+
+    threads = [threading.Thread(target=hold_and_break), threading.Thread(target=wait_for_one)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    # the waiter opened a new connection in the freed slot instead of timing out
+    assert got['conn'] is connect.made[1]
+    assert got['waited'] < 2
+    assert connect.made[0].closed
+    assert pool.stats()['dropped'] == 1
+
+
+def test_fetch_pandas_logs_in_again_when_the_session_expired():
+    connect = FakeConnect(failures=[session_expired()])
+    pool = SnowflakePool({}, size=2, connect=connect)
+    result = pool.fetch_pandas('select 1', name='test')
+    assert result.N.tolist() == [1]
+    stats = pool.stats()
+    assert (stats['connects'], stats['dropped'], stats['open']) == (2, 1, 1)
+
+
+def test_other_query_errors_are_not_retried():
+    connect = FakeConnect(failures=[DatabaseError(msg='syntax error', errno=1003)])
+    pool = SnowflakePool({}, size=2, connect=connect)
+    with pytest.raises(DatabaseError):
+        pool.fetch_pandas('select nonsense', name='test')
+    # the connection is fine, it goes back in the pool
+    assert (pool.stats()['connects'], pool.stats()['idle']) == (1, 1)
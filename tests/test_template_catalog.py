@@ -0,0 +1,45 @@
+from benchmarks.synthetic import catalog
+from template_catalog import TemplateCatalogCache
+
+
+def counting_loader(responses):
+    calls = []
+
+    def loader(member_id):
+        calls.append(member_id)
+        return responses[member_id]
+    return loader, calls
+
+
+def test_catalogs_and_do_not_contact_replies_are_cached():
+    loader, calls = counting_loader({'m1': catalog(2, 2), 'm2': {'status': 422, 'message': 'do not contact'}})
+    cache = TemplateCatalogCache(loader)
+    assert cache.parsed('m1').subjects == ['Subject 0', 'Subject 1']
+    assert cache.parsed('m1') is cache.parsed('m1')
+    assert cache.get('m2')['status'] == 422
+    assert cache.parsed('m2') is None
+    cache.get('m2')
+    assert calls == ['m1', 'm2']
+
+
+def test_error_responses_are_not_cached():
+    responses = {'m1': {'message': 'Internal server error'}}
+    loader, calls = counting_loader(responses)
+    cache = TemplateCatalogCache(loader)
+    assert cache.parsed('m1') is None
+    # the api recovered, the next call gets the catalog
+    responses['m1'] = catalog(1, 1)
+    assert cache.parsed('m1').subjects == ['Subject 0']
+    assert calls == ['m1', 'm1']
+    assert cache.stats()['uncached'] == 1
+
+
+def test_lookup_asks_once_for_an_uncached_response():
+    responses = {'m1': {'message': 'Internal server error'}}
+    loader, calls = counting_loader(responses)
+    cache = TemplateCatalogCache(loader)
+    assert cache.lookup('m1') == ({'message': 'Internal server error'}, None)
+    responses['m1'] = catalog(1, 1)
+    raw, parsed = cache.lookup('m1')
+    assert parsed.subjects == ['Subject 0'] and 'collection' in raw
+    assert calls == ['m1', 'm1']
@@ -0,0 +1,58 @@
+from work_claims import WorkClaims
+
+
+def test_claim_leaves_out_what_others_hold_or_closed(tmp_path):
+    claims = WorkClaims(str(tmp_path / 'claims.sqlite3'))
+    assert claims.claim_next('bob', ['t1']) == 't1'
+    claims.complete('carol', ['t2'])
+    assert claims.claim('alice', ['t1', 't2', 't3', 't4']) == {'t3', 't4'}
+    # alice holds them now, bob cant take them
+    assert claims.claim('bob', ['t3', 't5']) == {'t5'}
+    assert claims.leased_to_others('carol') == {'t1', 't3', 't4', 't5'}
+
+
+def test_claim_keeps_the_agents_other_leases(tmp_path):
+    claims = WorkClaims(str(tmp_path / 'claims.sqlite3'))
+    claims.claim_next('alice', ['t1'])
+    claims.claim('alice', ['t2'])
+    assert claims.heartbeat('alice', 't1')
+    assert claims.heartbeat('alice', 't2')
+
+
+def test_queued_item_is_held_until_the_outbox_job_ends(tmp_path):
+    claims = WorkClaims(str(tmp_path / 'claims.sqlite3'), lease_seconds=0)
+    claims.claim_next('alice', ['t1'])
+    assert claims.queue('alice', ['t1']) == {'t1'}
+    # the lease time doesnt apply while it is queued, and claiming the next one doesnt drop it
+    claims.claim_next('alice', ['t2'])
+    assert claims.claim_next('bob', ['t1']) is None
+    assert claims.queue('bob', ['t1']) == set()
+    assert 't1' in claims.leased_to_others('bob')
+    assert claims.done_since(0) == set()
+
+    claims.finish('t1', done=False)
+    assert claims.claim_next('bob', ['t1']) == 't1'
+
+
+def test_finished_job_closes_the_queued_item(tmp_path):
+    claims = WorkClaims(str(tmp_path / 'claims.sqlite3'))
+    claims.queue('alice', ['t1'])
+    claims.finish('t1', done=True)
+    assert claims.done_since(0) == {'t1'}
+    assert claims.claim('bob', ['t1']) == set()
+
+
+def test_complete_leaves_other_agents_items_alone(tmp_path):
+    claims = WorkClaims(str(tmp_path / 'claims.sqlite3'))
+    claims.claim_next('bob', ['t1'])
+    claims.queue('carol', ['t2'])
+    claims.claim_next('alice', ['t3'])
+    assert claims.complete('alice', ['t1', 't2', 't3', 't4']) == {'t3', 't4'}
+    assert claims.heartbeat('bob', 't1')
+    assert claims.done_since(0) == {'t3', 't4'}
+
+
+def test_complete_takes_over_an_expired_lease(tmp_path):
+    claims = WorkClaims(str(tmp_path / 'claims.sqlite3'), lease_seconds=0)
+    claims.claim_next('bob', ['t1'])
+    assert claims.complete('alice', ['t1']) == {'t1'}
@@ -0,0 +1,177 @@
+import logging
+import sqlite3
+import time
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+create table if not exists work_claims (
+    touchpoint_history_id text primary key,
+    agent text not null,
+    state text not null default 'claimed',   -- claimed / queued / done
+    claimed_at real not null,
+    expires_at real not null
+);
+create index if not exists work_claims_expires on work_claims (state, expires_at);
+"""
+
+# done items stay blocked this long (the backlog only goes back two weeks)
+DONE_RETENTION = 15 * 24 * 3600
+
+
+class WorkClaims:
+    # shared leases on backlog items so two agents never work the same inbound message
+    # - claim_next() atomically hands an agent the first item in their queue nobody else holds
+    # - claim() takes a whole selection at once (bulk close), leaving out what others hold
+    # - a lease runs out after lease_seconds unless the agent renews it with heartbeat()
+    # - queue() holds the item for an outbox job (no expiry) until finish() says how the job ended
+    # - complete() keeps the item blocked for everyone once the case is closed
+
+    def __init__(self, path, lease_seconds=300):
+        self.path = path
+        self.lease_seconds = lease_seconds
+        with self._connect() as db:
+            db.executescript(SCHEMA)
+            db.execute("delete from work_claims where state != 'claimed' and claimed_at < ?", (time.time() - DONE_RETENTION,))
+
+    def _connect(self):
+        db = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        db.execute('pragma journal_mode=wal')
+        return db
+
+    def _taken(self, db, agent, now):
+        # items this agent cant have: done or queued by anyone, or leased to someone else
+        return {row[0] for row in db.execute(
+            """select touchpoint_history_id from work_claims
+               where state != 'claimed' or (agent != ? and expires_at > ?)""", (agent, now))}
+
+    def _lease(self, agent, touchpoint_history_ids, state, taken):
+        # set every id not in taken(db, now) to state for agent, in one transaction. Returns the set of ids set
+        # a done item's expires_at is when it was completed (done_since)
+        now = time.time()
+        expires_at = now if state == 'done' else now + self.lease_seconds
+        db = self._connect()
+        try:
+            db.execute('begin immediate')
+            leased = {str(tph) for tph in touchpoint_history_ids} - taken(db, now)
+            db.executemany("""insert into work_claims (touchpoint_history_id, agent, state, claimed_at, expires_at)
+                              values (?, ?, ?, ?, ?)
+                              on conflict (touchpoint_history_id) do update
+                              set agent = excluded.agent, state = excluded.state, claimed_at = excluded.claimed_at,
+                                  expires_at = excluded.expires_at""",
+                           [(tph, agent, state, now, expires_at) for tph in leased])
+            db.execute('commit')
+        except Exception:
+            db.execute('rollback')
+            raise
+        finally:
+            db.close()
+        return leased
+
+    def claim_next(self, agent, touchpoint_history_ids):
+        # touchpoint_history_ids: the agent's queue, in order. Returns the claimed id or None
+        now = time.time()
+        db = self._connect()
+        try:
+            db.execute('begin immediate')
+            taken = self._taken(db, agent, now)
+            claimed = next((str(tph) for tph in touchpoint_history_ids if str(tph) not in taken), None)
+            if claimed is not None:
+                # one item per agent at a time
+                db.execute("delete from work_claims where agent = ? and state = 'claimed' and touchpoint_history_id != ?",
+                           (agent, claimed))
+                db.execute("""insert into work_claims (touchpoint_history_id, agent, state, claimed_at, expires_at)
+                              values (?, ?, 'claimed', ?, ?)
+                              on conflict (touchpoint_history_id) do update
+                              set agent = excluded.agent, state = 'claimed', claimed_at = excluded.claimed_at,
+                                  expires_at = excluded.expires_at""",
+                           (claimed, agent, now, now + self.lease_seconds))
+            db.execute('commit')
+        except Exception:
+            db.execute('rollback')
+            raise
+        finally:
+            db.close()
+        if claimed is not None:
+            logger.info(f"{agent} claimed touchpoint {claimed}")
+        return claimed
+
+    def claim(self, agent, touchpoint_history_ids):
+        # lease every id nobody else holds or has closed, in one transaction. Returns the set of ids claimed
+        # unlike claim_next() the agent's other leases are kept
+        claimed = self._lease(agent, touchpoint_history_ids, 'claimed', lambda db, now: self._taken(db, agent, now))
+        logger.info(f"{agent} claimed {len(claimed)} touchpoint(s)")
+        return claimed
+
+    def queue(self, agent, touchpoint_history_ids):
+        # hold the ids for an outbox job, nobody (this agent included) is handed them until finish()
+        # ids that are done or held by another agent are left out. Returns the set of ids queued
+        def taken(db, now):
+            return {row[0] for row in db.execute(
+                """select touchpoint_history_id from work_claims
+                   where state = 'done' or (agent != ? and (state = 'queued' or expires_at > ?))""", (agent, now))}
+        queued = self._lease(agent, touchpoint_history_ids, 'queued', taken)
+        logger.info(f"{agent} queued {len(queued)} touchpoint(s)")
+        return queued
+
+    def finish(self, touchpoint_history_id, done):
+        # the outbox job for a queued item ended: done keeps it blocked like complete(), a failed one is given back
+        now = time.time()
+        with self._connect() as db:
+            if done:
+                db.execute("""update work_claims set state = 'done', claimed_at = ?, expires_at = ?
+                              where touchpoint_history_id = ? and state = 'queued'""", (now, now, str(touchpoint_history_id)))
+            else:
+                db.execute("delete from work_claims where touchpoint_history_id = ? and state = 'queued'",
+                           (str(touchpoint_history_id),))
+
+    def heartbeat(self, agent, touchpoint_history_id):
+        # renew the lease. False if the agent no longer holds it
+        now = time.time()
+        with self._connect() as db:
+            cur = db.execute("""update work_claims set expires_at = ?
+                                where touchpoint_history_id = ? and agent = ? and state = 'claimed' and expires_at > ?""",
+                             (now + self.lease_seconds, str(touchpoint_history_id), agent, now))
+            return cur.rowcount == 1
+
+    def release(self, agent, touchpoint_history_id=None):
+        # give back the agent's lease (all of them if no id is given)
+        with self._connect() as db:
+            if touchpoint_history_id is None:
+                db.execute("delete from work_claims where agent = ? and state = 'claimed'", (agent,))
+            else:
+                db.execute("delete from work_claims where agent = ? and state = 'claimed' and touchpoint_history_id = ?",
+                           (agent, str(touchpoint_history_id)))
+
+    def complete(self, agent, touchpoint_history_ids):
+        # mark the ids done for everyone. Ids another agent holds (leased, queued or done) are left alone
+        # and logged. Returns the set of ids completed
+        def taken(db, now):
+            return {row[0] for row in db.execute(
+                """select touchpoint_history_id from work_claims
+                   where agent != ? and (state != 'claimed' or expires_at > ?)""", (agent, now))}
+        ids = {str(tph) for tph in touchpoint_history_ids}
+        completed = self._lease(agent, ids, 'done', taken)
+        if len(completed) < len(ids):
+            logger.info(f"{agent} could not complete touchpoint(s) held by another agent: {sorted(ids - completed)}")
+        return completed
+
+    def taken_by_others(self, agent):
+        # ids leased to other agents or already done
+        with self._connect() as db:
+            return self._taken(db, agent, time.time())
+
+    def leased_to_others(self, agent):
+        # ids other agents are working right now or have queued (not the done ones)
+        now = time.time()
+        with self._connect() as db:
+            return {row[0] for row in db.execute(
+                """select touchpoint_history_id from work_claims
+                   where (state = 'queued' or (state = 'claimed' and expires_at > ?)) and agent != ?""", (now, agent))}
+
+    def done_since(self, since):
+        # ids completed by anyone at or after since (epoch seconds), for catching up incrementally
+        # a done item's expires_at is when it was completed, so this stays on the (state, expires_at) index
+        with self._connect() as db:
+            return {row[0] for row in db.execute(
+                "select touchpoint_history_id from work_claims where state = 'done' and expires_at >= ?", (since,))}